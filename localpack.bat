@@ -44,6 +44,12 @@ if errorlevel 1 (
 
 for /f %%i in ('powershell -Command "Get-Date -Format 'yyyyMMddHHmm'"') do set timestamp=%%i
 
+echo Compiling template bundle...
+python src/template_bundle.py build
+if errorlevel 1 (
+    echo Warning: template bundle build failed, templates will be decoded at runtime.
+)
+
 echo Building with PyInstaller (including pyscrcpy dependencies)...
 py -3.11 -m PyInstaller --onedir --noconsole --noconfirm ^
     --add-data "resources;resources/" ^
@@ -458,6 +458,13 @@ class EditorWebSocketServer:
             
             with open(final_path, "wb") as f:
                 f.write(img_data)
+
+            # 通知模板註冊表重新載入這張圖（腳本同進程運行時立即生效）
+            try:
+                from utils import get_template_registry
+                get_template_registry().invalidate(rel_path)
+            except Exception as e:
+                logger.warning(f"[EditorServer] 更新模板註冊表失敗: {e}")
                 
             # 回傳給前端的檔名應該包含相對路徑 (e.g. userscript/myimg.png)
             final_rel_name = rel_path
@@ -0,0 +1,241 @@
+"""
+多開模式 (fleet)
+
+一個 worker 進程綁定一台模擬器（ADB 序號 127.0.0.1:<port>），
+各自擁有獨立的 ScrcpyStreamManager / RuntimeContext / MonitorState 與日誌檔。
+以進程而非線程隔離：模板比對是 CPU 密集工作，多線程會被 GIL 互相拖慢，
+而且 script 內的串流管理器與 MonitorState 都是進程內單例。
+
+FleetSupervisor 在主進程中：
+    - 啟動所有 worker
+    - 收集 worker 回報的 MonitorState 快照並彙總輸出到日誌
+    - worker 異常退出（Farm 因錯誤結束時 exitcode 非 0）或長時間沒有進展時以退避間隔重啟
+
+worker 只在 Farm 的狀態循環有進展（MonitorState.last_progress 更新）時回報，
+回報本身就是心跳：卡在單一呼叫中的 Farm 不會再回報，超過 HEARTBEAT_TIMEOUT 後被重啟。
+"""
+import multiprocessing
+import queue
+import sys
+import threading
+import time
+
+import utils
+from utils import logger, LOGS_FOLDER_NAME, RegisterConsoleHandler, RegisterQueueHandler, StartLogListener, LoadConfigFromFile
+
+# worker 回報給 supervisor 的 MonitorState 欄位
+STATUS_FIELDS = [
+    'current_state', 'current_dungeon_state', 'current_target',
+    'dungeon_count', 'combat_count', 'chest_count', 'death_count',
+    'adb_retry_count', 'crash_counter', 'warnings',
+]
+
+
+def parse_fleet_spec(spec):
+    """解析 --fleet 參數
+
+    格式: "port[:emu_index],port[:emu_index],..."，例如 "16384:0,16416:1"
+    未指定 emu_index 時依出現順序編號。
+
+    Returns:
+        list: [(adb_port, emu_index), ...]
+    """
+    devices = []
+    for i, item in enumerate(x.strip() for x in spec.split(',')):
+        if not item:
+            continue
+        port, _, emu_index = item.partition(':')
+        devices.append((int(port), emu_index if emu_index else str(i)))
+    return devices
+
+
+def _snapshot_monitor_state(MonitorState):
+    return {name: getattr(MonitorState, name) for name in STATUS_FIELDS}
+
+
+def _worker_main(worker_id, config_path, adb_port, emu_index, status_queue, status_interval):
+    """worker 進程入口（必須是模組頂層函數，Windows 的 spawn 模式才能 pickle）"""
+    # 每個 worker 寫入各自的日誌檔，避免多個進程交錯寫同一個檔案
+    utils.LOG_FILE_PREFIX = f"{LOGS_FOLDER_NAME}/log_w{worker_id}_{adb_port}"
+    RegisterConsoleHandler()
+    RegisterQueueHandler()
+    StartLogListener()
+
+    from script import FarmConfig, CONFIG_VAR_LIST, MonitorState, Factory, configure_scrcpy_stream, cleanup_scrcpy_stream
+
+    setting = FarmConfig()
+    config = LoadConfigFromFile(config_path)
+    for _, _, var_config_name, var_default_value in CONFIG_VAR_LIST:
+        setattr(setting, var_config_name, config.get(var_config_name, var_default_value))
+    setting._CHARACTER_SKILL_CONFIG = config.get("_CHARACTER_SKILL_CONFIG", [])
+    setting._ADBPORT = adb_port
+    setting._EMU_INDEX = emu_index
+    setting._FLEET_MODE = True  # ADB 只做本設備的斷開 / 重連，不重啟 ADB 服務、不關閉模擬器進程
+    setting._FORCESTOPING = threading.Event()
+
+    configure_scrcpy_stream(f"127.0.0.1:{adb_port}")
+    logger.info(f"[Fleet] worker {worker_id} 啟動: 127.0.0.1:{adb_port} (模擬器編號 {emu_index})")
+
+    def report():
+        # 心跳來自 Farm 的進展，不是這個線程本身：沒有新進展時不回報
+        reported = 0
+        while not setting._FORCESTOPING.is_set():
+            progress = MonitorState.last_progress
+            if progress > reported:
+                try:
+                    status_queue.put((worker_id, progress, _snapshot_monitor_state(MonitorState)))
+                    reported = progress
+                except Exception:
+                    pass
+            setting._FORCESTOPING.wait(status_interval)
+    threading.Thread(target=report, name="FleetStatus", daemon=True).start()
+
+    try:
+        Factory()(setting)
+    finally:
+        setting._FORCESTOPING.set()
+        cleanup_scrcpy_stream()
+        utils.StopLogListener()
+    if setting._FARM_ERROR is not None:
+        # Farm 內部捕捉了例外並正常返回：以非 0 exitcode 讓 supervisor 重啟
+        sys.exit(1)
+
+
+class FleetSupervisor:
+    """多開 worker 監管者（在主進程執行）"""
+
+    STATUS_INTERVAL = 2.0        # worker 回報狀態的間隔（秒）
+    SUMMARY_INTERVAL = 60.0      # 彙總狀態寫入日誌的間隔（秒）
+    HEARTBEAT_TIMEOUT = 300.0    # 超過此秒數 Farm 沒有進展（沒有回報）視為卡死，強制重啟
+    RESTART_BACKOFF_MIN = 10.0   # 重啟退避下限（秒）
+    RESTART_BACKOFF_MAX = 600.0  # 重啟退避上限（秒）
+
+    def __init__(self, devices, config_path=None):
+        self.devices = devices
+        self.config_path = config_path
+        self._ctx = multiprocessing.get_context('spawn')
+        self._status_queue = self._ctx.Queue()
+        self._stop = threading.Event()
+        self.workers = {}
+        for worker_id, (adb_port, emu_index) in enumerate(devices):
+            self.workers[worker_id] = {
+                'adb_port': adb_port,
+                'emu_index': emu_index,
+                'process': None,
+                'status': {},
+                'started_at': 0.0,
+                'last_report': 0.0,
+                'restarts': 0,
+                'backoff': self.RESTART_BACKOFF_MIN,
+                'next_start': 0.0,
+                'finished': False,
+            }
+
+    def _start_worker(self, worker_id):
+        w = self.workers[worker_id]
+        process = self._ctx.Process(
+            target=_worker_main,
+            args=(worker_id, self.config_path, w['adb_port'], w['emu_index'], self._status_queue, self.STATUS_INTERVAL),
+            name=f"FleetWorker-{worker_id}",
+            daemon=True,
+        )
+        process.start()
+        w['process'] = process
+        w['started_at'] = w['last_report'] = time.time()
+        logger.info(f"[Fleet] 啟動 worker {worker_id} (port {w['adb_port']}, pid {process.pid})")
+
+    def _drain_status(self):
+        while True:
+            try:
+                worker_id, ts, status = self._status_queue.get(timeout=0.5)
+            except queue.Empty:
+                return
+            w = self.workers.get(worker_id)
+            if w is not None:
+                w['status'] = status
+                w['last_report'] = ts
+
+    def _check_workers(self):
+        now = time.time()
+        for worker_id, w in self.workers.items():
+            if w['finished']:
+                continue
+            process = w['process']
+            if process is None:
+                if now >= w['next_start']:
+                    self._start_worker(worker_id)
+                continue
+
+            if process.is_alive():
+                if now - w['last_report'] > self.HEARTBEAT_TIMEOUT:
+                    logger.warning(f"[Fleet] worker {worker_id} 超過 {self.HEARTBEAT_TIMEOUT:.0f}s 沒有進展，強制終止")
+                    process.terminate()
+                    process.join(timeout=10)
+                else:
+                    # 穩定運行一段時間後重置退避
+                    if now - w['started_at'] > self.RESTART_BACKOFF_MAX:
+                        w['backoff'] = self.RESTART_BACKOFF_MIN
+                    continue
+
+            exitcode = process.exitcode
+            w['process'] = None
+            if exitcode == 0:
+                # 任務正常結束（例如達到目標次數），不重啟
+                w['finished'] = True
+                logger.info(f"[Fleet] worker {worker_id} 任務結束")
+                continue
+            w['restarts'] += 1
+            w['next_start'] = now + w['backoff']
+            logger.error(f"[Fleet] worker {worker_id} 異常退出 (exitcode={exitcode})，{w['backoff']:.0f}s 後重啟 (第 {w['restarts']} 次)")
+            w['backoff'] = min(w['backoff'] * 2, self.RESTART_BACKOFF_MAX)
+
+    def summary(self):
+        """所有 worker 的彙總狀態"""
+        lines = []
+        total_dungeon = total_combat = total_chest = 0
+        for worker_id, w in self.workers.items():
+            s = w['status']
+            total_dungeon += s.get('dungeon_count', 0)
+            total_combat += s.get('combat_count', 0)
+            total_chest += s.get('chest_count', 0)
+            if w['finished']:
+                alive = "結束"
+            elif w['process'] is not None and w['process'].is_alive():
+                alive = "運行"
+            else:
+                alive = "等待重啟"
+            lines.append(
+                f"  #{worker_id} port {w['adb_port']} [{alive}] {s.get('current_state', '-')}/{s.get('current_dungeon_state', '-')} "
+                f"地城 {s.get('dungeon_count', 0)} 戰鬥 {s.get('combat_count', 0)} 寶箱 {s.get('chest_count', 0)} "
+                f"死亡 {s.get('death_count', 0)} 重啟 {w['restarts']}"
+                + (f" {' '.join(s['warnings'])}" if s.get('warnings') else "")
+            )
+        header = f"[Fleet] {len(self.workers)} 台: 地城 {total_dungeon} 戰鬥 {total_combat} 寶箱 {total_chest}"
+        return "\n".join([header] + lines)
+
+    def run(self):
+        """啟動並監管所有 worker，直到全部結束或 stop() 被呼叫"""
+        logger.info(f"[Fleet] 多開模式: {len(self.devices)} 台設備")
+        last_summary = time.time()
+        try:
+            while not self._stop.is_set():
+                self._check_workers()
+                self._drain_status()
+                if time.time() - last_summary >= self.SUMMARY_INTERVAL:
+                    logger.info(self.summary())
+                    last_summary = time.time()
+                if all(w['finished'] for w in self.workers.values()):
+                    logger.info("[Fleet] 所有 worker 已結束")
+                    break
+        finally:
+            self.stop()
+            logger.info(self.summary())
+
+    def stop(self):
+        """終止所有 worker"""
+        self._stop.set()
+        for w in self.workers.values():
+            process = w['process']
+            if process is not None and process.is_alive():
+                process.terminate()
+                process.join(timeout=10)
@@ -0,0 +1,145 @@
+"""
+每幀共用的衍生資料 (FrameContext)
+
+同一張截圖常被多個偵測函數重複轉換（灰階、HSV、平均亮度…）。
+ScreenShot 返回的幀包成 FrameContext：它就是原本的 ndarray（ndarray 子類別，唯讀），
+現有程式碼照常使用；衍生資料第一次用到時才計算，之後同一幀直接取用快取。
+
+偵測函數統一透過下列函數取得衍生資料，傳入一般 ndarray（例如 copy() 過的圖）時直接計算、不快取：
+    FrameGray(image, rect=None)     灰階（rect = (x, y, w, h) 時只取該區域）
+    FrameHSV(image, rect=None)      HSV
+    FrameMean(image, gray=False)    平均亮度（gray=False 等同 np.mean(image)）
+    FrameThumbnail(image, size)     縮圖 (INTER_AREA)
+    FramePHash(image)               64 位元感知雜湊 (DCT pHash)
+"""
+import cv2
+import numpy as np
+
+THUMBNAIL_SIZE = (90, 160)  # 預設縮圖尺寸 (寬, 高)，為 900x1600 的 1/10
+PHASH_SIZE = 32             # pHash 先縮成 32x32 灰階
+PHASH_BITS = 8              # 取 DCT 左上 8x8 低頻係數 → 64 位元
+
+
+class FrameContext(np.ndarray):
+    """ScreenShot 返回的幀：原本的 ndarray 加上衍生資料快取
+
+    只有 wrap() 建立的幀會快取；切片、copy() 或運算產生的陣列不快取
+    （切片仍是 FrameContext 型別，但衍生資料每次重新計算），運算結果一律為一般 ndarray。
+    """
+
+    @classmethod
+    def wrap(cls, image, key=None):
+        """包裝唯讀幀（不複製像素）
+
+        key: 幀的識別 (來源, 序號)，同一個 key 代表同一張畫面
+        """
+        frame = image.view(cls)
+        frame.key = key
+        frame._cache = {}
+        return frame
+
+    def __array_finalize__(self, obj):
+        self.key = None
+        self._cache = None
+
+    def __array_wrap__(self, obj, context=None, return_scalar=False):
+        # ufunc 的結果（差值、遮罩…）是新的資料，返回一般 ndarray
+        result = np.asarray(obj)
+        if return_scalar or result.ndim == 0:
+            return result[()]
+        return result
+
+    def __reduce__(self):
+        # pickle / 跨進程傳遞時還原成一般 ndarray
+        return np.asarray(self).__reduce__()
+
+    def derived(self, name, compute):
+        """取得衍生資料：同一幀同一名稱只計算一次（多線程同時計算時以先寫入者為準）"""
+        cache = self._cache
+        if cache is None:
+            return compute()
+        value = cache.get(name)
+        if value is None:
+            value = compute()
+            if isinstance(value, np.ndarray):
+                value.setflags(write=False)
+            value = cache.setdefault(name, value)
+        return value
+
+    @property
+    def plain(self):
+        """一般 ndarray 視圖（不複製）"""
+        return self.view(np.ndarray)
+
+    def cached_names(self):
+        return [] if self._cache is None else list(self._cache)
+
+
+def _plain(image):
+    return image.view(np.ndarray) if isinstance(image, FrameContext) else image
+
+
+def _crop(image, rect):
+    x, y, w, h = rect
+    return image[max(0, y):y + h, max(0, x):x + w]
+
+
+def _derive(image, name, compute):
+    if isinstance(image, FrameContext):
+        return image.derived(name, compute)
+    return compute()
+
+
+def FrameGray(image, rect=None):
+    """灰階；已算過整幀灰階時，區域直接從整幀切出"""
+    if rect is None:
+        return _derive(image, 'gray', lambda: cv2.cvtColor(_plain(image), cv2.COLOR_BGR2GRAY))
+    if isinstance(image, FrameContext) and image._cache is not None and 'gray' in image._cache:
+        return _crop(image._cache['gray'], rect)
+    return _derive(image, ('gray', tuple(rect)), lambda: cv2.cvtColor(_crop(_plain(image), rect), cv2.COLOR_BGR2GRAY))
+
+
+def FrameHSV(image, rect=None):
+    """HSV；已算過整幀 HSV 時，區域直接從整幀切出"""
+    if rect is None:
+        return _derive(image, 'hsv', lambda: cv2.cvtColor(_plain(image), cv2.COLOR_BGR2HSV))
+    if isinstance(image, FrameContext) and image._cache is not None and 'hsv' in image._cache:
+        return _crop(image._cache['hsv'], rect)
+    return _derive(image, ('hsv', tuple(rect)), lambda: cv2.cvtColor(_crop(_plain(image), rect), cv2.COLOR_BGR2HSV))
+
+
+def FrameMean(image, gray=False):
+    """平均亮度：gray=False 為所有通道的平均（等同 np.mean(image)），gray=True 為灰階平均"""
+    if gray:
+        return _derive(image, 'mean_gray', lambda: float(cv2.mean(FrameGray(image))[0]))
+
+    def compute():
+        plain = _plain(image)
+        channels = plain.shape[2] if plain.ndim == 3 else 1
+        return float(sum(cv2.mean(plain)[:channels]) / channels)
+    return _derive(image, 'mean', compute)
+
+
+def FrameThumbnail(image, size=THUMBNAIL_SIZE):
+    """縮圖 (寬, 高)"""
+    size = tuple(size)
+    return _derive(image, ('thumbnail', size), lambda: cv2.resize(_plain(image), size, interpolation=cv2.INTER_AREA))
+
+
+def FramePHash(image):
+    """64 位元感知雜湊 (DCT pHash)：相同畫面雜湊相同，輕微變化（雜訊、動畫）只差幾個位元
+
+    Returns:
+        int: 64 位元雜湊值，以 bin(a ^ b).count('1') 比較距離
+    """
+    def compute():
+        small = cv2.resize(FrameGray(image), (PHASH_SIZE, PHASH_SIZE), interpolation=cv2.INTER_AREA)
+        dct = cv2.dct(np.float32(small))[:PHASH_BITS, :PHASH_BITS]
+        bits = (dct > np.median(dct.flatten()[1:])).flatten()
+        return int(np.packbits(bits).view('>u8')[0])
+    return _derive(image, 'phash', compute)
+
+
+def PHashDistance(hash_a, hash_b):
+    """兩個 pHash 的漢明距離 (0~64)"""
+    return bin(hash_a ^ hash_b).count('1')
@@ -1558,6 +1558,47 @@ class ConfigPanelApp(tk.Toplevel):
         )
         self.debug_screenshot_check.grid(row=row, column=0, sticky=tk.W, pady=5)
 
+        # --- Session 錄製 ---
+        self.record_session_check = ttk.Checkbutton(
+            tab, text="錄製session (recordings/)",
+            variable=self.record_session_var, command=self.save_config,
+            style="Custom.TCheckbutton"
+        )
+        self.record_session_check.grid(row=row, column=1, sticky=tk.W, pady=5)
+
+        # --- 模板比對線程數 ---
+        row += 1
+        frame_match_workers = ttk.Frame(tab)
+        frame_match_workers.grid(row=row, column=0, columnspan=2, sticky=tk.W, pady=5)
+        ttk.Label(frame_match_workers, text="比對線程數:").grid(row=0, column=0, sticky=tk.W)
+        self.match_workers_spinbox = ttk.Spinbox(
+            frame_match_workers, from_=0, to=16, width=4,
+            textvariable=self.match_workers_var,
+            command=self.save_config
+        )
+        self.match_workers_spinbox.grid(row=0, column=1, padx=5, sticky=tk.W)
+        ttk.Label(frame_match_workers, text="(0=自動, 1=不並行)", foreground="gray").grid(row=0, column=2, sticky=tk.W)
+        ttk.Label(frame_match_workers, text="分類快取筆數:").grid(row=1, column=0, sticky=tk.W)
+        self.screen_cache_size_spinbox = ttk.Spinbox(
+            frame_match_workers, from_=0, to=512, width=4,
+            textvariable=self.screen_cache_size_var,
+            command=self.save_config
+        )
+        self.screen_cache_size_spinbox.grid(row=1, column=1, padx=5, sticky=tk.W)
+        ttk.Label(frame_match_workers, text="相似距離:").grid(row=1, column=2, sticky=tk.W)
+        self.screen_cache_distance_spinbox = ttk.Spinbox(
+            frame_match_workers, from_=0, to=16, width=3,
+            textvariable=self.screen_cache_distance_var,
+            command=self.save_config
+        )
+        self.screen_cache_distance_spinbox.grid(row=1, column=3, padx=5, sticky=tk.W)
+        self.vision_worker_check = ttk.Checkbutton(
+            frame_match_workers, text="背景視覺線程 (串流模式)",
+            variable=self.vision_worker_var, command=self.save_config,
+            style="Custom.TCheckbutton"
+        )
+        self.vision_worker_check.grid(row=2, column=0, columnspan=4, sticky=tk.W)
+
         # --- 圖片去背工具 ---
         row += 1
         frame_bgremove = ttk.LabelFrame(tab, text="技能圖片去背工具", padding=5)
@@ -2174,6 +2215,10 @@ class ConfigPanelApp(tk.Toplevel):
             # 戰鬥設定
             self.auto_combat_mode_combo,
             self.dungeon_repeat_limit_spinbox,
+            self.match_workers_spinbox,
+            self.screen_cache_size_spinbox,
+            self.screen_cache_distance_spinbox,
+            self.vision_worker_check,
             # 技能施放設定
             self.ae_caster_interval_entry,
             # 配置預設管理
@@ -1,5 +1,6 @@
 from gui import *
 import argparse
+import multiprocessing
 
 __version__ = '1.12.0'
 OWNER = "arnold2957"
@@ -190,12 +191,41 @@ def parse_args():
         default=None,  # 默認值設爲None
         help='配置文件路徑 (例如: c:/config.json)'
     )
+
+    # 多開模式：每台模擬器一個 worker 進程（無頭運行）
+    parser.add_argument(
+        '-fleet',
+        '--fleet',
+        type=str,
+        default=None,
+        help='多開模式，ADB 端口列表 (例如: 16384:0,16416:1，冒號後為模擬器編號)'
+    )
     
     return parser.parse_args()
 
+def FleetActive(config_path, fleet_spec):
+    from fleet import FleetSupervisor, parse_fleet_spec
+
+    RegisterConsoleHandler()
+    RegisterQueueHandler()
+    StartLogListener()
+    logger.info(f"WvDAS 巫術daphne自動刷怪 v{__version__} 多開模式")
+
+    supervisor = FleetSupervisor(parse_fleet_spec(fleet_spec), config_path)
+    try:
+        supervisor.run()
+    except KeyboardInterrupt:
+        logger.info("[Fleet] 收到中斷，停止所有 worker...")
+        supervisor.stop()
+
 def main():
+    multiprocessing.freeze_support()
     args = parse_args()
 
+    if args.fleet:
+        FleetActive(args.config, args.fleet)
+        return
+
     controller = AppController(args.headless, args.config)
     controller.mainloop()
 
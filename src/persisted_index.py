@@ -0,0 +1,126 @@
+"""
+執行期間學習、定期寫回 JSON 檔的索引
+
+模板搜索區域 (search_regions.py) 與畫面轉移統計 (screen_prior.py) 共用：
+    - 路徑解析：打包後寫在執行檔旁，開發時寫在 resources/ 下
+    - 讀檔（失敗時從空的索引重新開始）、節流寫檔（暫存檔 + 取代）、依鍵值重置
+    - 多開時每台設備一個檔案（各 worker 進程各自寫檔，不會互相覆蓋），第一次以共用檔為起點
+    - show / reset 命令列
+子類別只實作學習與查詢的邏輯，資料放在 self._data（讀寫時持有 self._lock）。
+"""
+import argparse
+import json
+import os
+import re
+import sys
+import threading
+import time
+
+from utils import logger, ResourcePath
+
+
+def persisted_path(relative_path):
+    # 打包後 ResourcePath 指向臨時解壓目錄，學習結果需要寫在執行檔旁才能保留
+    if getattr(sys, 'frozen', False):
+        return os.path.join(os.path.dirname(sys.executable), relative_path)
+    return ResourcePath(relative_path)
+
+
+def device_path(path, device):
+    """設備專屬的索引檔路徑，例如 search_regions.json -> search_regions.127.0.0.1_16384.json"""
+    root, ext = os.path.splitext(path)
+    name = re.sub(r'[^\w.-]', '_', device)  # ':' 不能用在 Windows 檔名
+    return f"{root}.{name}{ext}"
+
+
+class PersistedIndex:
+    """以 JSON 檔保存的索引: {鍵: 資料}"""
+
+    FILE = None             # 相對路徑，例如 "resources/search_regions.json"
+    LOG_TAG = "[索引]"
+    SAVE_INTERVAL = 60.0    # 寫檔節流（秒）
+
+    def __init__(self, path=None, device=None):
+        """
+        Args:
+            device: 設備序號（多開模式）。指定時讀寫設備專屬的檔案，
+                該檔案不存在時從共用檔案的內容開始學習
+        """
+        self.shared_path = path or persisted_path(self.FILE)
+        self.path = device_path(self.shared_path, device) if device else self.shared_path
+        self._lock = threading.Lock()
+        self._data = {}
+        self._dirty = False
+        self._last_save = time.time()
+        self.load()
+
+    def load(self):
+        path = self.path if os.path.exists(self.path) else self.shared_path
+        try:
+            if os.path.exists(path):
+                with open(path, 'r', encoding='utf-8') as f:
+                    self._data = json.load(f)
+        except (OSError, json.JSONDecodeError) as e:
+            logger.warning(f"{self.LOG_TAG} 讀取 {path} 失敗，重新開始: {e}")
+            self._data = {}
+
+    def _changed(self):
+        """子類別修改 self._data 之後呼叫（不需持有 self._lock），超過節流時間時寫檔"""
+        with self._lock:
+            self._dirty = True
+        if time.time() - self._last_save >= self.SAVE_INTERVAL:
+            self.save()
+
+    def save(self, force=False):
+        """寫入索引檔（暫存檔 + 取代，避免寫到一半被中斷）"""
+        with self._lock:
+            if not self._dirty and not force:
+                return
+            data = json.dumps(self._data, ensure_ascii=False, indent=2, sort_keys=True)
+            self._dirty = False
+            self._last_save = time.time()
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            tmp_path = f"{self.path}.{os.getpid()}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                f.write(data)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            logger.warning(f"{self.LOG_TAG} 寫入 {self.path} 失敗: {e}")
+
+    def reset(self, keys=None):
+        """清除指定鍵（或全部）的學習結果"""
+        with self._lock:
+            if keys:
+                for key in keys:
+                    self._data.pop(key, None)
+            else:
+                self._data = {}
+            self._dirty = True
+        self.save()
+
+    def entries(self):
+        """目前資料的深拷貝"""
+        with self._lock:
+            return json.loads(json.dumps(self._data))
+
+
+def run_cli(index_class, description, keys_help, show):
+    """show / reset 命令列
+
+    Args:
+        index_class: PersistedIndex 子類別
+        show: show(index, keys) 輸出指定鍵（空列表 = 全部）的內容
+    """
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument('command', choices=['show', 'reset'])
+    parser.add_argument('keys', nargs='*', help=f'{keys_help}（不指定則為全部）')
+    parser.add_argument('--device', help='多開模式的設備序號，例如 127.0.0.1:16384（不指定則為共用檔案）')
+    args = parser.parse_args()
+
+    index = index_class(device=args.device)
+    if args.command == 'reset':
+        index.reset(args.keys)
+        print(f"已清除: {', '.join(args.keys) if args.keys else '全部'} ({index.path})")
+        return
+    show(index, args.keys)
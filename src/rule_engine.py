@@ -0,0 +1,195 @@
+"""
+宣告式狀態規則 (resources/state_rules.json)
+
+每個狀態處理函數的畫面偵測寫成資料：模板、搜索區域、閾值、優先順序、檢查頻率與動作名稱。
+處理函數只負責實作動作，偵測順序與頻率可直接改 JSON 調整，不需要修改 script.py。
+規則檔沒有某個狀態（或格式錯誤）時，使用處理函數提供的內建規則。
+
+規則欄位:
+    name        規則名稱（統計與日誌用）
+    templates   模板名稱列表（依序檢查，第一個匹配者為準）；或
+    detector    偵測函數名稱（由處理函數提供，返回位置 / True 表示命中）
+    region      搜索區域 [[x, y, w, h], ...]（CheckIf 的 roi 格式），預設全螢幕 / 比對清單的區域
+    threshold   閾值，預設使用比對清單或 0.80
+    priority    數字越小越先檢查（預設為檔案中的順序）
+    every       每幾次循環檢查一次（預設 1 = 每次），offset 為相位
+    interval    至少間隔幾秒檢查一次（預設 0 = 不限制），run(urgent=True) 時忽略
+    group       同一 group 只執行第一個命中的規則（if / elif 鏈）
+    report_miss 沒有命中時也交給動作處理（例如連續確認計數）
+    action      動作名稱，由處理函數實作
+
+IdentifyState 的畫面分類規則 ("IdentifyState" 區段) 只使用 name / threshold，依檔案中的順序為優先順序。
+"""
+import json
+import threading
+import time
+
+from utils import logger, ResourcePath
+
+STATE_RULES_FILE = "resources/state_rules.json"
+
+NEXT_RULE = None          # 動作返回值：繼續檢查下一條規則
+NEXT_LOOP = 'next_loop'   # 動作返回值：結束本次循環（重新截圖）
+
+
+class Exit:
+    """動作返回值：離開狀態處理函數並返回 value"""
+
+    def __init__(self, value=None):
+        self.value = value
+
+
+class StateRule:
+    """一條畫面規則"""
+
+    def __init__(self, spec, order=0):
+        self.name = spec['name']
+        self.templates = list(spec.get('templates') or [])
+        self.detector = spec.get('detector')
+        if not self.templates and not self.detector:
+            raise ValueError(f"規則 {self.name} 沒有指定 templates 或 detector")
+        self.region = spec.get('region')
+        self.threshold = spec.get('threshold')
+        self.priority = spec.get('priority', order)
+        self.every = max(1, int(spec.get('every', 1)))
+        self.interval = float(spec.get('interval', 0))
+        self.offset = int(spec.get('offset', 0))
+        self.group = spec.get('group')
+        self.report_miss = bool(spec.get('report_miss', False))
+        self.action = spec.get('action', self.name)
+
+    def due(self, tick):
+        return tick % self.every == self.offset % self.every
+
+
+class RuleSet:
+    """一個狀態的規則（依優先順序），附帶每條規則的成本統計"""
+
+    def __init__(self, state, rules):
+        self.state = state
+        self.rules = sorted(rules, key=lambda rule: rule.priority)
+        self._lock = threading.Lock()
+        self._stats = {rule.name: {'evals': 0, 'hits': 0, 'ms': 0.0} for rule in self.rules}
+        self._last_run = {}  # 規則名稱 -> 上次檢查的時間（interval 用）
+
+    def run(self, screen, tick, check, detectors=None, urgent=False):
+        """依優先順序逐條檢查本次循環需要檢查的規則（惰性：呼叫端停止迭代後不再比對）
+
+        Args:
+            screen: 截圖
+            tick: 循環次數（決定 every / offset 的檢查頻率）
+            check: 模板比對函數 check(screen, templates, region, threshold) -> (模板名稱, 位置)
+            detectors: {偵測函數名稱: func(screen) -> 位置 / bool}
+            urgent: 忽略 interval，所有本次循環需要檢查的規則都檢查（例如視覺線程回報了事件）
+
+        Yields:
+            tuple: (rule, hit)，hit 為 (模板名稱或偵測函數名稱, 結果)；
+                   沒有命中時只有 report_miss 的規則會被交出，hit 為 None
+        """
+        detectors = detectors or {}
+        matched_groups = set()
+        now = time.time()
+        for rule in self.rules:
+            if not rule.due(tick) or (rule.group is not None and rule.group in matched_groups):
+                continue
+            if rule.interval:
+                if not urgent and now - self._last_run.get(rule.name, 0.0) < rule.interval:
+                    continue
+                self._last_run[rule.name] = now
+            start = time.time()
+            if rule.detector:
+                result = detectors[rule.detector](screen)
+                hit = (rule.detector, result) if result else None
+            else:
+                target, pos = check(screen, rule.templates, rule.region, rule.threshold)
+                hit = (target, pos) if target else None
+            self._account(rule, (time.time() - start) * 1000, hit is not None)
+            if hit is not None and rule.group is not None:
+                matched_groups.add(rule.group)
+            if hit is not None or rule.report_miss:
+                yield rule, hit
+
+    def _account(self, rule, ms, hit):
+        with self._lock:
+            stats = self._stats[rule.name]
+            stats['evals'] += 1
+            stats['ms'] += ms
+            if hit:
+                stats['hits'] += 1
+
+    def stats(self):
+        """Returns: {規則名稱: {'evals', 'hits', 'ms', 'avg_ms'}}"""
+        with self._lock:
+            return {name: dict(s, avg_ms=s['ms'] / s['evals'] if s['evals'] else 0.0) for name, s in self._stats.items()}
+
+    def format_stats(self):
+        stats = self.stats()
+        ranked = sorted(stats.items(), key=lambda item: item[1]['ms'], reverse=True)
+        return " | ".join(
+            f"{name} {s['ms']:.0f}ms/{s['evals']}次 (命中 {s['hits']}, 平均 {s['avg_ms']:.1f}ms)"
+            for name, s in ranked if s['evals']
+        )
+
+
+_state_rules = None
+
+
+def LoadStateRules(path=None):
+    """讀取規則檔
+
+    Returns:
+        dict: {狀態名稱: 規則定義列表}（原始 JSON），讀取失敗時返回空字典
+    """
+    path = path or ResourcePath(STATE_RULES_FILE)
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f).get('states', {})
+    except (OSError, json.JSONDecodeError, AttributeError) as e:
+        logger.warning(f"[狀態規則] 無法讀取 {path}: {e}")
+        return {}
+
+
+def _build_rule_set(state, specs):
+    return RuleSet(state, [StateRule(spec, order) for order, spec in enumerate(specs)])
+
+
+def get_state_rules(state, default=None):
+    """取得某個狀態的 RuleSet（第一次呼叫時讀檔，之後共用同一份統計）
+
+    Args:
+        default: 內建規則定義列表，規則檔沒有這個狀態（或讀取 / 格式錯誤）時使用
+    """
+    global _state_rules
+    if _state_rules is None:
+        _state_rules = {}
+        for name, specs in LoadStateRules().items():
+            if name == 'IdentifyState':
+                continue
+            try:
+                _state_rules[name] = _build_rule_set(name, specs)
+            except (KeyError, TypeError, ValueError) as e:
+                logger.error(f"[狀態規則] {name} 的規則格式錯誤: {e}")
+    rule_set = _state_rules.get(state)
+    if rule_set is None:
+        if default is None:
+            raise KeyError(f"{STATE_RULES_FILE} 沒有定義狀態 {state} 的規則")
+        logger.warning(f"[狀態規則] {STATE_RULES_FILE} 沒有可用的 {state} 規則，使用內建規則")
+        rule_set = _state_rules[state] = _build_rule_set(state, default)
+    return rule_set
+
+
+def all_state_rules():
+    """已載入的所有 RuleSet（輸出成本統計用）"""
+    return dict(_state_rules or {})
+
+
+def LoadScreenRules(default):
+    """IdentifyState 的畫面分類規則 [(規則名稱, 閾值), ...]，規則檔沒有定義時使用 default"""
+    specs = LoadStateRules().get('IdentifyState')
+    if not specs:
+        return list(default)
+    try:
+        return [(spec['name'], float(spec['threshold'])) for spec in specs]
+    except (KeyError, TypeError, ValueError) as e:
+        logger.error(f"[狀態規則] IdentifyState 規則格式錯誤，使用內建規則: {e}")
+        return list(default)
@@ -0,0 +1,74 @@
+"""
+畫面轉移統計（IdentifyState 的 Markov 先驗）
+
+記錄「離開某個狀態後，下一次畫面分類的結果」的次數，依任務分開統計，
+存成 resources/screen_transitions.json。ClassifyScreen 依目前的狀態
+（MonitorState.current_state / current_dungeon_state）預測最可能的下一個畫面，
+先比對那幾條規則，高信心命中時提早結束。
+
+檢視 / 重置統計:
+    python src/screen_prior.py show [任務名稱...]
+    python src/screen_prior.py reset [任務名稱...]   # 不指定名稱則全部清除
+    python src/screen_prior.py show --device 127.0.0.1:16384   # 多開模式下某台設備的索引
+"""
+from persisted_index import PersistedIndex, run_cli
+
+SCREEN_TRANSITION_FILE = "resources/screen_transitions.json"
+NO_MATCH = "-"  # 沒有任何規則命中
+
+
+class ScreenTransitionIndex(PersistedIndex):
+    """每個任務的狀態轉移次數: {任務: {前一狀態: {分類結果: 次數}}}"""
+
+    FILE = SCREEN_TRANSITION_FILE
+    LOG_TAG = "[轉移統計]"
+    MIN_SAMPLES = 10        # 前一狀態至少累積幾次分類才使用預測
+    MIN_PROBABILITY = 0.25  # 機率低於此值的結果不列入預測
+    MAX_PREDICTIONS = 2     # 最多先比對幾條預測的規則
+
+    def predict(self, quest, context):
+        """最可能的分類結果（機率由高到低）
+
+        Returns:
+            list: [(分類結果, 機率), ...]，樣本不足時返回空列表
+        """
+        with self._lock:
+            outcomes = self._data.get(quest, {}).get(context)
+            if not outcomes:
+                return []
+            total = sum(outcomes.values())
+            if total < self.MIN_SAMPLES:
+                return []
+            ranked = sorted(outcomes.items(), key=lambda item: item[1], reverse=True)
+        return [(outcome, count / total) for outcome, count in ranked[:self.MAX_PREDICTIONS]
+                if outcome != NO_MATCH and count / total >= self.MIN_PROBABILITY]
+
+    def record(self, quest, context, outcome):
+        """記錄一次轉移（outcome 為 None 時記為沒有命中）"""
+        with self._lock:
+            outcomes = self._data.setdefault(quest, {}).setdefault(context, {})
+            key = outcome or NO_MATCH
+            outcomes[key] = outcomes.get(key, 0) + 1
+        self._changed()
+
+
+def show(index, quests):
+    entries = index.entries()
+    quests = quests or sorted(entries)
+    print(f"統計: {index.path} ({len(entries)} 個任務)")
+    for quest in quests:
+        contexts = entries.get(quest)
+        if contexts is None:
+            print(f"  {quest}: (沒有統計)")
+            continue
+        print(f"  {quest}:")
+        for context in sorted(contexts):
+            outcomes = contexts[context]
+            total = sum(outcomes.values())
+            ranked = sorted(outcomes.items(), key=lambda item: item[1], reverse=True)
+            summary = ", ".join(f"{outcome} {count / total * 100:.0f}%" for outcome, count in ranked[:5])
+            print(f"    {context} (n={total}): {summary}")
+
+
+if __name__ == "__main__":
+    run_cli(ScreenTransitionIndex, '檢視或重置畫面轉移統計', '任務名稱', show)
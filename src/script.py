@@ -9,9 +9,19 @@ import subprocess
 from utils import *
 import random
 from threading import Thread,Event
+import threading
+import queue
+from collections import deque, OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from pathlib import Path
 import numpy as np
 import copy
+from session_recorder import SessionRecorder, ReplayFrameSource
+from search_regions import SearchRegionIndex
+from screen_prior import ScreenTransitionIndex
+from rule_engine import get_state_rules, all_state_rules, LoadScreenRules, NEXT_LOOP, Exit
+from vision_bus import VisionBus, VisionWorker
+from frame_context import FrameContext, FrameGray, FrameHSV, FrameMean, FramePHash, PHashDistance
 
 # pyscrcpy 串流支援
 try:
@@ -23,27 +33,110 @@ except ImportError:
     ScrcpyClient = None
     logger.info("pyscrcpy 不可用，將使用傳統 ADB 截圖")
 
+def frame_diff_ratio(frame_a, frame_b, roi=None):
+    """計算兩幀的灰階平均差異比例 (0~1)
+
+    Args:
+        frame_a, frame_b: BGR 圖像
+        roi: 可選的比較區域 [x, y, w, h]，None 表示全畫面
+    Returns:
+        float: 差異比例，尺寸不一致時視為完全不同 (1.0)
+    """
+    if frame_a is None or frame_b is None or frame_a.shape != frame_b.shape:
+        return 1.0
+    if roi is not None:
+        x, y, w, h = roi
+        if frame_a[max(0, y):y+h, max(0, x):x+w].size == 0:
+            return 0.0
+    # 灰階透過 FrameGray 取得：ScreenShot 返回的幀同一幀只轉換一次
+    return cv2.absdiff(FrameGray(frame_a, roi), FrameGray(frame_b, roi)).mean() / 255
+
 class ScrcpyStreamManager:
-    """pyscrcpy 串流管理器"""
+    """pyscrcpy 串流管理器
 
-    def __init__(self, max_fps=60, max_size=1600, bitrate=32000000):
+    解碼後的幀依序編號後存入固定長度的環形緩衝區 (ring buffer)，
+    每一幀附帶序號 (seq) 與接收時間戳，並設為唯讀。
+    讀取端預設取得唯讀視圖 (零複製)，需要修改像素時才呼叫 copy。
+    """
+
+    FRAME_BUFFER_SIZE = 8  # 環形緩衝區保留的幀數
+    STALE_TIMEOUT = 10  # 超過此秒數沒有新幀視為串流失效
+    SUPERVISOR_INTERVAL = 1.0  # 監管線程檢查間隔
+    RESTART_BACKOFF_MIN = 1.0  # 重連退避下限（秒）
+    RESTART_BACKOFF_MAX = 30.0  # 重連退避上限（秒）
+
+    # 串流參數檔位：解碼是每個模擬器實例最大的 CPU 開銷，非關鍵狀態降低幀率與比特率
+    STREAM_PROFILES = {
+        'high': {'max_fps': 60, 'bitrate': 32000000},  # 戰鬥、寶箱、地城移動：需要即時反應
+        'low': {'max_fps': 15, 'bitrate': 8000000},    # 城鎮、旅館、選單流程
+    }
+    # MonitorState.current_state -> 檔位；未列出的狀態（如 Connecting、Idle）維持目前檔位
+    # 任務結束時 Farm 會先停止監管線程再停止串流，因此不需要「暫停」檔位
+    STATE_PROFILES = {
+        'Combat': 'high',
+        'Chest': 'high',
+        'Dungeon': 'high',
+        'Harken': 'high',
+        'Inn': 'low',
+        'EoT': 'low',
+        'Starting': 'low',
+    }
+    # 切換到各檔位前狀態需穩定多久（秒）：pyscrcpy 只能在建立連線時指定 max_fps / bitrate，
+    # 每次切換都是一次完整重連（期間截圖退回 ADB）。
+    # 進入戰鬥、寶箱、地城立即切回 high（之後在地城中途重連的代價更高）；
+    # 只有長時間停留的旅館 / 城鎮才降為 low，短暫的流程維持原檔位
+    PROFILE_SWITCH_DELAY = {
+        'high': 0.0,
+        'low': 60.0,
+    }
+
+    def __init__(self, max_fps=60, max_size=1600, bitrate=32000000, serial=None):
+        self.serial = serial  # 綁定的 ADB 序號（None = 由 pyscrcpy 自動選擇唯一設備）
         self.max_fps = max_fps
         self.max_size = max_size
         self.bitrate = bitrate  # 比特率，預設 32Mbps（提高圖像質量）
         self.client = None
         self.latest_frame = None
         self.frame_count = 0
+        self.frame_seq = 0  # 最新一幀的序號（單調遞增，重啟串流不歸零）
+        self.last_frame_time = 0.0  # 最新一幀的接收時間戳
         self.running = False
         self._lock = Event()
-    
+        self._frames = deque(maxlen=self.FRAME_BUFFER_SIZE)  # (seq, timestamp, frame)
+        self._frame_cond = threading.Condition()
+        self._control_lock = threading.Lock()  # 控制通道寫入需序列化
+        self.healthy = threading.Event()  # 由監管線程發布的串流可用狀態
+        self.on_healthy = None  # 串流（重新）變為可用時在監管線程呼叫的函數（例如啟動視覺線程）
+        self._supervisor = None
+        self._supervisor_stop = threading.Event()
+        self._restart_requested = threading.Event()
+        self.profile = None  # 目前套用的檔位（None = 初始參數）
+        self._pending_profile = None
+        self._pending_since = 0.0
+
+    def _push_frame(self, frame):
+        """將一幀放入環形緩衝區（不複製，只設為唯讀）"""
+        frame.setflags(write=False)
+        with self._frame_cond:
+            self.frame_seq += 1
+            self.frame_count += 1
+            self.last_frame_time = time.time()
+            self.latest_frame = frame
+            self._frames.append((self.frame_seq, self.last_frame_time, frame))
+            self._frame_cond.notify_all()
+
     def _on_frame(self, client, frame):
         """幀回調"""
         if frame is not None:
-            self.latest_frame = frame.copy()
-            self.frame_count += 1
-    
-    def start(self):
-        """啟動串流"""
+            # 解碼器每次回調都產生新的陣列，直接持有即可，不需要再複製
+            self._push_frame(frame)
+
+    def start(self, stop_event=None):
+        """啟動串流
+
+        Args:
+            stop_event: 監管線程的停止事件；啟動途中被設置時放棄並關閉連線（任務已結束，不應再把串流帶起來）
+        """
         if not PYSCRCPY_AVAILABLE:
             logger.warning("pyscrcpy 不可用，無法啟動串流")
             return False
@@ -52,20 +145,31 @@ class ScrcpyStreamManager:
             return True
         
         try:
-            logger.info(f"啟動 pyscrcpy 串流 (max_fps={self.max_fps}, max_size={self.max_size}, bitrate={self.bitrate})")
+            logger.info(f"啟動 pyscrcpy 串流 (serial={self.serial}, max_fps={self.max_fps}, max_size={self.max_size}, bitrate={self.bitrate})")
+            client_kwargs = {}
+            if self.serial:
+                # 多開時必須指定設備，否則 pyscrcpy 會連到第一台
+                client_kwargs['device'] = self.serial
             self.client = ScrcpyClient(
                 max_fps=self.max_fps,
                 max_size=self.max_size,
                 bitrate=self.bitrate,
+                **client_kwargs,
             )
+            seq_before_start = self.frame_seq
             self.client.on_frame(self._on_frame)
             self.client.start(threaded=True)
             
             # 等待第一幀
             for i in range(50):  # 最多等 5 秒
+                if stop_event is not None and stop_event.is_set():
+                    logger.info("pyscrcpy 串流啟動途中收到停止要求，放棄啟動")
+                    self.stop()
+                    return False
                 if self.client.last_frame is not None:
-                    self.latest_frame = self.client.last_frame.copy()
-                    self.frame_count += 1
+                    if self.frame_seq == seq_before_start:
+                        # 回調尚未送達任何幀時，先以 client.last_frame 填入緩衝區
+                        self._push_frame(self.client.last_frame.copy())
                     self.running = True
                     logger.info(f"✓ pyscrcpy 串流已啟動！")
                     return True
@@ -78,26 +182,136 @@ class ScrcpyStreamManager:
             logger.error(f"pyscrcpy 串流啟動失敗: {e}")
             return False
     
-    def get_frame(self):
-        """獲取最新幀"""
+    def get_frame(self, copy=True):
+        """獲取最新幀
+
+        Args:
+            copy: True 時返回可寫入的副本；False 時返回唯讀視圖（零複製）
+        """
         try:
-            if self.client and self.client.last_frame is not None:
-                frame = self.client.last_frame.copy()
-                return frame
+            with self._frame_cond:
+                latest = self._frames[-1] if self._frames else None
+            if latest is not None:
+                frame = latest[2]
+                return frame.copy() if copy else frame
         except Exception as e:
             # 串流可能已斷開
             logger.warning(f"pyscrcpy 獲取幀失敗: {e}，標記為不可用")
             self.running = False
         return None
-    
+
+    def get_latest(self):
+        """獲取最新幀及其序號與時間戳
+
+        Returns:
+            tuple: (seq, timestamp, frame)，frame 為唯讀視圖；沒有幀時返回 None
+        """
+        with self._frame_cond:
+            return self._frames[-1] if self._frames else None
+
+    def get_buffered_frames(self):
+        """獲取環形緩衝區內所有幀（由舊到新）
+
+        Returns:
+            list: [(seq, timestamp, frame), ...]，frame 皆為唯讀視圖
+        """
+        with self._frame_cond:
+            return list(self._frames)
+
+    def wait_for_frame(self, after_seq, timeout=1.0):
+        """阻塞等待序號大於 after_seq 的新幀
+
+        Args:
+            after_seq: 參考序號，只接受比它新的幀
+            timeout: 最長等待秒數
+        Returns:
+            tuple: (seq, timestamp, frame)；超時或串流停止時返回 None
+        """
+        with self._frame_cond:
+            self._frame_cond.wait_for(lambda: self.frame_seq > after_seq or not self.running, timeout)
+            if self._frames and self.frame_seq > after_seq:
+                return self._frames[-1]
+        return None
+
+    def wait_for_change(self, reference, threshold=0.02, roi=None, timeout=1.0):
+        """阻塞等待畫面相對於參考幀發生變化
+
+        Args:
+            reference: 參考幀 (BGR)
+            threshold: 灰階平均差異比例超過此值視為變化
+            roi: 可選的比較區域 [x, y, w, h]
+            timeout: 最長等待秒數
+        Returns:
+            tuple: (seq, timestamp, frame)；超時或串流停止時返回 None
+        """
+        deadline = time.time() + timeout
+        latest = self.get_latest()
+        if latest is None:
+            return None
+        if frame_diff_ratio(reference, latest[2], roi) > threshold:
+            return latest
+        seq = latest[0]
+        while True:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return None
+            latest = self.wait_for_frame(seq, remaining)
+            if latest is None:
+                return None
+            seq = latest[0]
+            if frame_diff_ratio(reference, latest[2], roi) > threshold:
+                return latest
+
+    # ---------- 控制通道（觸控/按鍵注入） ----------
+    # scrcpy 控制訊息的動作常數 (android MotionEvent / KeyEvent)
+    ACTION_DOWN = 0
+    ACTION_UP = 1
+    ACTION_MOVE = 2
+    KEYCODE_BACK = 4
+
+    def supports_control(self):
+        """串流連線是否提供控制通道"""
+        control = getattr(self.client, 'control', None) if self.client else None
+        return control is not None and hasattr(control, 'touch') and hasattr(control, 'keycode')
+
+    def tap(self, x, y):
+        """經由控制通道點擊"""
+        with self._control_lock:
+            control = self.client.control
+            control.touch(x, y, self.ACTION_DOWN)
+            time.sleep(0.01)
+            control.touch(x, y, self.ACTION_UP)
+
+    def swipe(self, start, end, duration=300):
+        """經由控制通道滑動（duration 單位為毫秒，與 input swipe 一致）"""
+        steps = max(1, int(duration / 16))  # 約 60Hz 送出 MOVE
+        step_delay = duration / 1000 / steps
+        with self._control_lock:
+            control = self.client.control
+            control.touch(start[0], start[1], self.ACTION_DOWN)
+            for i in range(1, steps + 1):
+                time.sleep(step_delay)
+                x = start[0] + (end[0] - start[0]) * i // steps
+                y = start[1] + (end[1] - start[1]) * i // steps
+                control.touch(x, y, self.ACTION_MOVE)
+            control.touch(end[0], end[1], self.ACTION_UP)
+
+    def key(self, keycode):
+        """經由控制通道送出按鍵"""
+        with self._control_lock:
+            control = self.client.control
+            control.keycode(keycode, self.ACTION_DOWN)
+            control.keycode(keycode, self.ACTION_UP)
+
     def stop(self):
         """停止串流（帶超時保護，防止阻塞）"""
         self.running = False
+        with self._frame_cond:
+            self._frame_cond.notify_all()  # 喚醒所有等待新幀的線程
         if self.client:
             try:
                 # NOTE: pyscrcpy.client.stop() 可能會阻塞
                 # 使用線程和超時機制確保不會無限等待
-                import threading
                 stop_event = threading.Event()
                 
                 def _stop_client():
@@ -131,30 +345,142 @@ class ScrcpyStreamManager:
                 self.running = False
                 return False
             
-            # 檢查最後一幀是否過舊 (10秒未更新視為失效)
-            if hasattr(self.client, 'last_frame'):
-                if self.client.last_frame is None:
-                    return False
-                return True
-            return False
+            # 檢查最後一幀是否過舊 (STALE_TIMEOUT 秒未更新視為失效)
+            if self.last_frame_time == 0 or time.time() - self.last_frame_time > self.STALE_TIMEOUT:
+                return False
+            return True
         except:
             self.running = False
             return False
     
-    def restart(self):
-        """重新啟動串流（斷開後重連）"""
+    def restart(self, stop_event=None):
+        """重新啟動串流（斷開後重連）；stop_event 見 start()"""
         logger.info("嘗試重新啟動 pyscrcpy 串流...")
         self.stop()
-        return self.start()
+        if stop_event is not None and stop_event.is_set():
+            return False
+        started = self.start(stop_event)
+        if started and stop_event is not None and stop_event.is_set():
+            # 啟動完成的同時任務已結束：關閉剛建立的連線
+            self.stop()
+            return False
+        return started
+
+    # ---------- 背景監管線程 ----------
+    def ensure_supervisor(self):
+        """確保背景監管線程已啟動（非阻塞）
+
+        監管線程負責串流的整個生命週期：啟動、過期偵測、帶退避的重連。
+        截圖端只需查詢 is_available()，不會在重連上阻塞。
+        """
+        if self._supervisor is not None and self._supervisor.is_alive() and not self._supervisor_stop.is_set():
+            return
+        # 每個監管線程使用自己的停止與重連事件，舊線程收尾時不會影響新線程
+        # （stop_supervisor 為喚醒舊線程設置的重連事件不會被新線程當成重連要求）
+        self._supervisor_stop = threading.Event()
+        self._restart_requested = threading.Event()
+        self._supervisor = threading.Thread(target=self._supervise, args=(self._supervisor_stop, self._restart_requested),
+                                            name="ScrcpySupervisor", daemon=True)
+        self._supervisor.start()
+
+    def request_restart(self):
+        """要求監管線程立即重連（例如 ADB 重連之後），不等待退避時間"""
+        self.ensure_supervisor()
+        self._restart_requested.set()
+
+    def stop_supervisor(self):
+        """停止背景監管線程"""
+        self._supervisor_stop.set()
+        self._restart_requested.set()  # 喚醒等待中的監管線程
+
+    def _supervise(self, stop_event, restart_requested):
+        backoff = self.RESTART_BACKOFF_MIN
+        next_attempt = 0
+        while not stop_event.is_set():
+            if restart_requested.is_set():
+                restart_requested.clear()
+                if stop_event.is_set():
+                    break
+                self.healthy.clear()
+                self.running = False  # 標記舊連線失效，下方立即重連
+                backoff = self.RESTART_BACKOFF_MIN
+                next_attempt = 0
+
+            self._follow_state_profile(stop_event)
+            if stop_event.is_set():
+                break
+
+            if self.is_available():
+                if not self.healthy.is_set():
+                    logger.info("[串流監管] 串流恢復正常")
+                    self._mark_healthy()
+                backoff = self.RESTART_BACKOFF_MIN
+            else:
+                if self.healthy.is_set():
+                    stale = time.time() - self.last_frame_time if self.last_frame_time else 0
+                    logger.warning(f"[串流監管] 串流失效 (距上一幀 {stale:.1f} 秒)，截圖改用 ADB")
+                    self.healthy.clear()
+                if time.time() >= next_attempt:
+                    if self.restart(stop_event):
+                        self._mark_healthy()
+                        backoff = self.RESTART_BACKOFF_MIN
+                    else:
+                        logger.info(f"[串流監管] 重連失敗，{backoff:.0f} 秒後重試")
+                        next_attempt = time.time() + backoff
+                        backoff = min(backoff * 2, self.RESTART_BACKOFF_MAX)
+
+            restart_requested.wait(timeout=self.SUPERVISOR_INTERVAL)
+        logger.debug("[串流監管] 監管線程已結束")
+
+    def _mark_healthy(self):
+        self.healthy.set()
+        callback = self.on_healthy
+        if callback is not None:
+            try:
+                callback()
+            except Exception as e:
+                logger.warning(f"[串流監管] 串流恢復回呼發生錯誤: {e}")
 
-# 全局串流管理器
+    def _follow_state_profile(self, stop_event=None):
+        """依 MonitorState.current_state 切換串流檔位（由監管線程呼叫）"""
+        state = MonitorState.current_state
+        profile = self.STATE_PROFILES.get(state)
+        if profile is None:
+            return
+        now = time.time()
+        if profile != self._pending_profile:
+            self._pending_profile = profile
+            self._pending_since = now
+        if profile == self.profile or now - self._pending_since < self.PROFILE_SWITCH_DELAY[profile]:
+            return
+
+        self.profile = profile
+        params = self.STREAM_PROFILES[profile]
+        if params['max_fps'] == self.max_fps and params['bitrate'] == self.bitrate and self.running:
+            return
+        self.max_fps = params['max_fps']
+        self.bitrate = params['bitrate']
+        logger.info(f"[串流監管] 狀態 {state}，串流切換為 {profile} ({self.max_fps} fps, {self.bitrate // 1000000} Mbps)")
+        # 參數只能在建立連線時指定，重連期間截圖使用 ADB
+        self.healthy.clear()
+        self.restart(stop_event)
+
+# 全局串流管理器（每個進程一個；多開時每個 worker 進程各自綁定一台設備）
 _scrcpy_stream = None
+_scrcpy_serial = None
+
+def configure_scrcpy_stream(serial):
+    """指定本進程串流管理器綁定的 ADB 序號（需在第一次 get_scrcpy_stream 之前呼叫）"""
+    global _scrcpy_serial
+    _scrcpy_serial = serial
+    if _scrcpy_stream is not None and _scrcpy_stream.serial != serial:
+        logger.warning(f"串流管理器已綁定 {_scrcpy_stream.serial}，新的序號 {serial} 需重建後才生效")
 
 def get_scrcpy_stream():
     """獲取或創建串流管理器"""
     global _scrcpy_stream
     if _scrcpy_stream is None and PYSCRCPY_AVAILABLE:
-        _scrcpy_stream = ScrcpyStreamManager()
+        _scrcpy_stream = ScrcpyStreamManager(serial=_scrcpy_serial)
     return _scrcpy_stream
 
 def cleanup_scrcpy_stream():
@@ -192,6 +518,7 @@ def cleanup_scrcpy_stream():
         
         if _scrcpy_stream is not None:
             logger.info("正在停止 pyscrcpy 串流...")
+            _scrcpy_stream.stop_supervisor()
             _scrcpy_stream.stop()
             logger.info("pyscrcpy 串流已清理")
             _scrcpy_stream = None
@@ -203,6 +530,130 @@ def cleanup_scrcpy_stream():
         _scrcpy_cleanup_lock.release()
 
 
+class AdbInputShell:
+    """常駐 adb shell 輸入通道
+
+    每台設備維持一條長連線的 shell session，輸入指令經由佇列依序送出，
+    避免每次點擊都開新線程和新的 adb shell。
+    一次送出的多條指令（含指令間的 sleep）會合併為一行在設備端執行，只需一次往返。
+    """
+
+    COMMAND_TIMEOUT = 5  # 單條指令在 socket 上的讀取超時（與 DeviceShell 的 shell timeout 一致）
+
+    def __init__(self, device):
+        self.device = device
+        self._conn = None
+        self._buffer = b""
+        self._queue = queue.Queue()
+        self._thread = None
+        self._marker_seq = 0
+
+    def _open(self):
+        """開啟 shell session"""
+        conn = self.device.create_connection(timeout=self.COMMAND_TIMEOUT)
+        conn.send("shell:")
+        self._conn = conn
+        self._buffer = b""
+        logger.debug(f"[AdbInputShell] 已建立常駐 shell: {self.device.serial}")
+
+    def _close(self):
+        """關閉 shell session（下一條指令會自動重連）"""
+        conn, self._conn = self._conn, None
+        if conn is not None:
+            try:
+                conn.close()
+            except Exception:
+                pass
+
+    def _run(self, script):
+        """在 session 上執行一行腳本，並等待結束標記"""
+        if self._conn is None:
+            self._open()
+        self._marker_seq += 1
+        # 標記拆成兩段輸出，避免 pty 回顯的指令本身被誤判為執行完成
+        marker = f"__WVD_DONE_{self._marker_seq}__".encode()
+        self._conn.write(f'{script}; echo __WVD_DONE_""{self._marker_seq}__\n'.encode())
+        while marker not in self._buffer:
+            data = self._conn.read(4096)
+            if not data:
+                raise ConnectionResetError("adb shell 連線已關閉")
+            self._buffer += data
+        self._buffer = self._buffer.split(marker, 1)[1]
+
+    def _worker(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            script, done, result = item
+            try:
+                self._run(script)
+            except Exception as e:
+                result['error'] = e
+                self._close()
+            finally:
+                done.set()
+
+    def execute(self, commands, delays=None, timeout=7):
+        """送出輸入指令並等待執行完成
+
+        Args:
+            commands: 單條指令字串，或指令列表
+            delays: 指令之間的間隔秒數（數值或與指令數相同長度的列表）
+            timeout: 等待逾時秒數（會再加上指令間隔總和）
+        Raises:
+            TimeoutError: 未在時限內完成
+            RuntimeError / ConnectionResetError: 連線失敗
+        """
+        if isinstance(commands, str):
+            commands = [commands]
+        if not isinstance(delays, (list, tuple)):
+            delays = [delays or 0] * len(commands)
+        parts = []
+        for i, cmd in enumerate(commands):
+            parts.append(cmd)
+            if i < len(commands) - 1 and delays[i] > 0:
+                parts.append(f"sleep {delays[i]}")
+        script = "; ".join(parts)
+
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = Thread(target=self._worker, daemon=True)
+            self._thread.start()
+
+        done = Event()
+        result = {}
+        self._queue.put((script, done, result))
+        if not done.wait(timeout=timeout + sum(delays[:-1])):
+            # 關閉連線讓阻塞中的讀取立即失敗，後續指令會重新建立 session
+            self._close()
+            raise TimeoutError(f"輸入指令在{timeout}秒內未完成")
+        if 'error' in result:
+            e = result['error']
+            if isinstance(e, (TimeoutError, ConnectionResetError)):
+                raise e
+            raise RuntimeError(f"{type(e).__name__}: {e}")
+
+    def close(self):
+        """停止背景線程並關閉連線"""
+        if self._thread is not None and self._thread.is_alive():
+            self._queue.put(None)
+        self._close()
+
+# 每台設備一條常駐輸入通道
+_input_shells = {}
+
+def get_input_shell(device):
+    """獲取設備的常駐輸入通道（設備物件更換時重建）"""
+    serial = device.serial
+    shell = _input_shells.get(serial)
+    if shell is None or shell.device is not device:
+        if shell is not None:
+            shell.close()
+        shell = AdbInputShell(device)
+        _input_shells[serial] = shell
+    return shell
+
+
 # ==================== 技能分類與載入 ====================
 
 # 技能類別與施放方式對應
@@ -344,6 +795,91 @@ PARTY_POSITIONS = {
     6: [774, 1345],   # 後排右 (whowillopenit=5)
 }
 
+# 找不到 next 按鈕時，依序點擊這六個點位選擇敵人（覆蓋不同位置與大小的敵人）
+ENEMY_FALLBACK_POSITIONS = [[150, 750], [300, 750], [450, 750], [550, 750], [650, 750], [750, 750]]
+
+# IdentifyState 的畫面分類規則，依優先順序排列：(規則名稱, 閾值)
+# 'combatActive' 會比對所有 combatActive* 模板，其餘規則比對同名模板
+# 實際使用 resources/state_rules.json 的 "IdentifyState" 區段，檔案沒有定義時使用此內建規則
+DEFAULT_SCREEN_RULES = [
+    ('combatActive',      0.70),
+    ('RiseAgain',         0.80),
+    ('someonedead',       0.80),
+    ('AUTO',              0.70),
+    ('chestFlag',         0.80),   # 寶箱優先
+    ('whowillopenit',     0.80),
+    ('dungFlag',          0.75),   # 串流品質問題，使用較低閾值
+    ('mapFlag',           0.80),
+    ('returnText',        0.80),
+    ('returntoTown',      0.80),
+    ('openworldmap',      0.80),
+    ('RoyalCityLuknalia', 0.80),
+    ('fortressworldmap',  0.80),
+    ('Deepsnow',          0.70),
+    ('worldmapflag',      0.80),
+    ('Inn',               0.80),
+]
+SCREEN_RULES = LoadScreenRules(DEFAULT_SCREEN_RULES)
+# 可由 pHash 快取的分類結果：畫面靜態、反覆出現，且不會與更高優先的規則（戰鬥、寶箱、地城）同時出現。
+# 快取命中時只重新確認該規則本身，不檢查較高優先的規則：
+# whowillopenit（寶箱畫面）與 returnText（地城內）會與戰鬥、死亡、地城 Flag 同時出現，因此不快取
+SCREEN_CACHEABLE_RULES = frozenset([
+    'returntoTown', 'openworldmap',
+    'RoyalCityLuknalia', 'fortressworldmap', 'worldmapflag', 'Inn',
+])
+SCREEN_RULE_INDEX = {name: index for index, (name, _) in enumerate(SCREEN_RULES)}
+# 依轉移統計先比對的規則高信心命中後，仍需確認沒有命中的較高優先規則（可能同時出現在畫面上）。
+# 未列出的規則需確認所有較高優先的規則；城鎮、世界地圖等靜態畫面不會與戰鬥、寶箱、地城畫面同時出現
+SCREEN_RULE_GUARDS = {name: () for name in SCREEN_CACHEABLE_RULES}
+# 寶箱開啟者選擇與地城內的返回文字：可能與戰鬥、死亡、自動戰鬥及寶箱 / 地城 / 地圖 Flag 同時出現
+SCREEN_RULE_GUARDS.update({
+    name: ('combatActive', 'RiseAgain', 'someonedead', 'AUTO', 'chestFlag', 'dungFlag', 'mapFlag')
+    for name in ('whowillopenit', 'returnText')
+})
+SCREEN_PRIOR_CONFIDENT = 0.90  # 預測的規則達到此分數（且不低於規則閾值）才提早結束
+
+# StateChest 的內建規則（resources/state_rules.json 沒有 "StateChest" 區段或格式錯誤時使用）
+DEFAULT_CHEST_RULES = [
+    {'name': 'abnormal', 'every': 20, 'action': 'abnormal', 'templates': [
+        'ambush', 'ignore', 'sandman_recover', 'cursedWheel_timeLeap', 'multipeopledead', 'startdownload',
+        'totitle', 'Deepsnow', 'adventurersbones', 'halfBone', 'nothanks', 'strange_things', 'blessing',
+        'DontBuyIt', 'donthelp', 'buyNothing', 'Nope', 'ignorethequest', 'dontGiveAntitoxin', 'pass',
+        'returnText', 'ReturnText']},
+    {'name': 'combat',        'every': 5, 'templates': ['combatActive*'], 'threshold': 0.70, 'action': 'combat'},
+    {'name': 'death',         'every': 5, 'templates': ['RiseAgain'], 'threshold': 0.80, 'action': 'death'},
+    {'name': 'network_retry', 'every': 10, 'detector': 'retry', 'action': 'network_retry'},
+    {'name': 'dungFlag',      'templates': ['dungFlag'], 'threshold': 0.75, 'report_miss': True, 'action': 'dung_flag'},
+    {'name': 'whowillopenit', 'templates': ['whowillopenit'], 'group': 'interaction', 'action': 'pick_opener'},
+    {'name': 'chestOpening',  'templates': ['chestOpening'], 'group': 'interaction', 'action': 'opening'},
+    {'name': 'chestFlag',     'templates': ['chestFlag'], 'group': 'interaction', 'action': 'open_chest'},
+    {'name': 'fastForward',   'every': 2, 'detector': 'fast_forward_off', 'action': 'fast_forward'},
+    {'name': 'retry',         'every': 2, 'detector': 'retry', 'action': 'retry'},
+    {'name': 'blackout',      'detector': 'blackout', 'action': 'blackout'},
+    {'name': 'burstClick',    'detector': 'always', 'action': 'burst_click'},
+    {'name': 'AUTO',          'templates': ['AUTO'], 'threshold': 0.80, 'action': 'auto'},
+]
+# DungeonMover 移動監控的內建規則（同上，"DungeonMover" 區段）
+DEFAULT_MOVER_RULES = [
+    {'name': 'monitorFlags',  'detector': 'always', 'interval': 0.8, 'action': 'update_flags'},
+    {'name': 'visibility',    'templates': ['visibliityistoopoor'], 'interval': 0.8, 'action': 'low_visibility'},
+    {'name': 'death',         'detector': 'rise_again', 'interval': 0.8, 'action': 'death'},
+    {'name': 'lowHP',         'detector': 'low_hp_recover', 'interval': 0.8, 'action': 'low_hp'},
+    {'name': 'network_retry', 'detector': 'retry', 'action': 'network_retry'},
+    {'name': 'returnText',    'templates': ['returnText'], 'action': 'dismiss_dialog'},
+    {'name': 'specialDialog', 'detector': 'special_dialog', 'action': 'special_dialog'},
+]
+
+# 視覺線程更新的監控相似度：監控名稱 -> (模板, MonitorState 屬性)
+VISION_FLAGS = {
+    'dungFlag':     ('dungFlag',      'flag_dungFlag'),
+    'mapFlag':      ('mapFlag',       'flag_mapFlag'),
+    'chestFlag':    ('chestFlag',     'flag_chestFlag'),
+    'worldMap':     ('worldmapflag',  'flag_worldMap'),
+    'chest_auto':   ('chest_auto',    'flag_chest_auto'),
+    'AUTO':         ('AUTO',          'flag_auto_text'),
+    'combatActive': ('combatActive*', 'flag_combatActive'),
+}
+
 
 DUNGEON_TARGETS = BuildQuestReflection()
 
@@ -387,6 +923,13 @@ CONFIG_VAR_LIST = [
             ["skill_preset_names_var",       tk.Variable,   "_SKILL_PRESET_NAMES",        ["配置 " + str(i+1) for i in range(10)]],
             # Debug 截圖（測試用）
             ["debug_screenshot_var",         tk.BooleanVar, "_DEBUG_SCREENSHOT",          False],
+            # Session 錄製/回放（離線重現與效能測試）
+            ["record_session_var",           tk.BooleanVar, "_RECORD_SESSION",            False],
+            ["replay_session_path_var",      tk.StringVar,  "_REPLAY_SESSION_PATH",       ""],   # 非空時以錄製的幀取代設備
+            ["match_workers_var",            tk.IntVar,     "_MATCH_WORKERS",             0],    # 模板比對線程數：0=自動，1=不並行
+            ["screen_cache_size_var",        tk.IntVar,     "_SCREEN_CACHE_SIZE",         64],   # 畫面分類快取筆數：0=停用
+            ["screen_cache_distance_var",    tk.IntVar,     "_SCREEN_CACHE_DISTANCE",     4],    # 視為同一畫面的 pHash 距離上限 (0~64)
+            ["vision_worker_var",            tk.BooleanVar, "_VISION_WORKER",             True], # 串流模式下由背景視覺線程偵測死亡/重試/血量/異常狀態
             ]
 
 
@@ -410,6 +953,9 @@ class FarmConfig:
         self._MSGQUEUE = None
         #### 底層接口
         self._ADBDEVICE = None
+        self._FLEET_MODE = False  # 多開模式：ADB 服務與模擬器進程由所有 worker 共用，只能處理自己的設備
+        #### 執行結果
+        self._FARM_ERROR = None  # Farm 因錯誤結束時為錯誤內容（停止信號與正常結束為 None）
 
     def get_skill_for_character(self, char_name, battle_num):
         """取得角色的技能配置
@@ -452,6 +998,113 @@ class FarmConfig:
     def __getattr__(self, name):
         # 當訪問不存在的屬性時，拋出AttributeError
         raise AttributeError(f"FarmConfig對象沒有屬性'{name}'")
+class LatencyTracker:
+    """擷取管線延遲統計：每個擷取層級保留最近 WINDOW 筆樣本，計算滾動百分位數"""
+
+    WINDOW = 500
+
+    def __init__(self):
+        self._samples = {}
+        self._lock = threading.Lock()
+
+    def add(self, name, ms):
+        """加入一筆延遲樣本（毫秒）"""
+        with self._lock:
+            samples = self._samples.get(name)
+            if samples is None:
+                samples = self._samples[name] = deque(maxlen=self.WINDOW)
+            samples.append(ms)
+
+    def summary(self):
+        """Returns: {name: {'p50', 'p95', 'p99', 'count'}}（毫秒）"""
+        with self._lock:
+            snapshot = {name: list(samples) for name, samples in self._samples.items() if samples}
+        result = {}
+        for name, samples in snapshot.items():
+            p50, p95, p99 = np.percentile(samples, [50, 95, 99])
+            result[name] = {'p50': float(p50), 'p95': float(p95), 'p99': float(p99), 'count': len(samples)}
+        return result
+
+    def format_summary(self, summary=None):
+        summary = self.summary() if summary is None else summary
+        return " | ".join(
+            f"{name} p50={v['p50']:.0f} p95={v['p95']:.0f} p99={v['p99']:.0f}ms (n={v['count']})"
+            for name, v in sorted(summary.items())
+        )
+
+class ScreenClassCache:
+    """畫面分類結果的 LRU 快取
+
+    鍵為畫面的 64 位元 pHash（FramePHash）與當次略過的規則；pHash 距離在 max_distance 以內
+    視為同一畫面。命中時只需重新確認快取的那一條規則，不必跑完整個分類流程。
+    只快取 SCREEN_CACHEABLE_RULES 的結果（旅館、世界地圖等靜態畫面）。
+    """
+
+    def __init__(self, size=64, max_distance=4):
+        self._entries = OrderedDict()  # (pHash, 略過的規則) -> {'index', 'elapsed_ms'}
+        self._lock = threading.Lock()
+        self.size = size
+        self.max_distance = max_distance
+        self.stats = {'hits': 0, 'misses': 0, 'stale': 0, 'saved_ms': 0.0}
+
+    def configure(self, size, max_distance):
+        with self._lock:
+            self.size = max(0, int(size))
+            self.max_distance = max(0, int(max_distance))
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+    @property
+    def enabled(self):
+        return self.size > 0
+
+    def lookup(self, phash, skip):
+        """Returns: (鍵, 快取內容)，沒有相近的畫面時返回 (None, None)"""
+        with self._lock:
+            best_key, best_distance = None, self.max_distance + 1
+            for key in self._entries:
+                if key[1] != skip:
+                    continue
+                distance = PHashDistance(phash, key[0])
+                if distance < best_distance:
+                    best_key, best_distance = key, distance
+                    if distance == 0:
+                        break
+            if best_key is None:
+                self.stats['misses'] += 1
+                return None, None
+            self._entries.move_to_end(best_key)
+            return best_key, self._entries[best_key]
+
+    def store(self, phash, skip, index, elapsed_ms):
+        with self._lock:
+            if self.size <= 0:
+                return
+            key = (phash, skip)
+            self._entries[key] = {'index': index, 'elapsed_ms': elapsed_ms}
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+    def record_hit(self, saved_ms):
+        with self._lock:
+            self.stats['hits'] += 1
+            self.stats['saved_ms'] += max(0.0, saved_ms)
+
+    def discard(self, key):
+        """確認失敗（畫面看起來相同但規則已不成立）時移除"""
+        with self._lock:
+            self._entries.pop(key, None)
+            self.stats['stale'] += 1
+
+    def snapshot(self):
+        with self._lock:
+            stats = dict(self.stats)
+            stats['entries'] = len(self._entries)
+        lookups = stats['hits'] + stats['misses'] + stats['stale']
+        stats['hit_rate'] = stats['hits'] / lookups if lookups else 0.0
+        return stats
+
 class MonitorState:
     """即時監控狀態類別，供 GUI 讀取顯示"""
     # 當前狀態
@@ -509,6 +1162,35 @@ class MonitorState:
     # 警告列表
     warnings: list = []
 
+    # 同一幀比對結果快取的累計次數：{'hits', 'misses', 'uncached'}
+    match_memo: dict = {}
+
+    # 最近一次畫面分類：{規則名稱: 匹配度 0-100}（只含實際評估過的規則）
+    screen_scores: dict = {}
+    screen_match: str = ""
+    # 畫面分類快取：{'hits', 'misses', 'stale', 'saved_ms', 'entries', 'hit_rate'}
+    screen_cache: dict = {}
+    # 畫面分類的模板數：{'count', 'avg_templates', 'avg_baseline', 'prior_hits'}
+    # avg_baseline = 依固定順序比對時平均需要的模板數，avg_templates = 實際比對的平均模板數
+    screen_prior: dict = {}
+    # 狀態規則的成本：{狀態: {規則名稱: {'evals', 'hits', 'ms', 'avg_ms'}}}
+    rule_costs: dict = {}
+    # 視覺線程：{'frames', 'fps', 'detectors': {偵測器: {'runs', 'avg_ms'}}}，未啟動時為空
+    vision: dict = {}
+
+    # 擷取延遲 (毫秒)：{層級: {'p50','p95','p99','count'}}
+    # 層級: stream / adb_raw / adb_png = 幀交給 ScreenShot 時的年齡；*_match = 比對完成時的幀年齡
+    #       classify = IdentifyState 每次畫面分類的耗時；classify_cached = pHash 快取命中時的耗時
+    capture_latency: dict = {}
+
+    # 最近一次狀態循環前進的時間（多開模式的心跳依據：卡在單一呼叫中時不會更新）
+    last_progress: float = 0
+
+    @classmethod
+    def mark_progress(cls):
+        """狀態循環每前進一次呼叫一次"""
+        cls.last_progress = time.time()
+
     @classmethod
     def reset(cls):
         """重置所有監控狀態"""
@@ -544,6 +1226,14 @@ class MonitorState:
         cls.flag_updates = {}
         cls.current_character = "未找到"
         cls.warnings = []
+        cls.capture_latency = {}
+        cls.screen_scores = {}
+        cls.screen_match = ""
+        cls.screen_cache = {}
+        cls.screen_prior = {}
+        cls.rule_costs = {}
+        cls.vision = {}
+        cls.match_memo = {}
 
     @classmethod
     def update_warnings(cls):
@@ -701,7 +1391,39 @@ class TargetInfo:
         self._roi = value
 
 ##################################################################
+def ADBSerial(setting):
+    return f"127.0.0.1:{setting._ADBPORT}"
+
+def DisconnectADBSerial(setting, adb_path):
+    """只斷開本設備的 ADB 連線（不影響 ADB 服務與其他設備），之後重新 connect"""
+    serial = ADBSerial(setting)
+    logger.info(f"斷開設備 {serial} 的 ADB 連線...")
+    try:
+        CMDLine(f"\"{adb_path}\" disconnect {serial}")
+    except Exception as e:
+        logger.error(f"斷開 {serial} 時出錯: {e}")
+
+def GetADBDeviceState(devices_output, serial):
+    """從 `adb devices` 的輸出取得指定設備的狀態（device / offline / unauthorized），不在列表中時返回 None"""
+    for line in devices_output.splitlines():
+        parts = line.split()
+        if len(parts) >= 2 and parts[0] == serial:
+            return parts[1]
+    return None
+
+def ResetADBConnection(setting, adb_path):
+    """連接失敗後的清理：多開模式只斷開本設備；單開模式關閉模擬器與 adb"""
+    if getattr(setting, '_FLEET_MODE', False):
+        DisconnectADBSerial(setting, adb_path)
+        return
+    KillEmulator(setting)
+    KillAdb(setting)
+
 def KillAdb(setting : FarmConfig):
+    if getattr(setting, '_FLEET_MODE', False):
+        # 多開模式：adb 服務由所有 worker 共用，關閉會中斷其他設備
+        logger.info("多開模式，跳過關閉adb")
+        return
     adb_path = GetADBPath(setting)
     try:
         logger.info(f"正在檢查並關閉adb...")
@@ -739,6 +1461,10 @@ def KillAdb(setting : FarmConfig):
         logger.error(f"終止模擬器進程時出錯: {str(e)}")
     
 def KillEmulator(setting : FarmConfig):
+    if getattr(setting, '_FLEET_MODE', False):
+        # 多開模式：taskkill 以進程名稱關閉，會連同其他 worker 的模擬器一起關閉
+        logger.info("多開模式，跳過關閉模擬器")
+        return
     emulator_name = os.path.basename(setting._EMUPATH)
     emulator_SVC = "MuMuVMMSVC.exe"
     try:
@@ -829,6 +1555,7 @@ def StartEmulator(setting):
         if hasattr(setting, '_FORCESTOPING') and setting._FORCESTOPING and setting._FORCESTOPING.is_set():
             logger.info("模擬器啓動等待中收到停止信號")
             return False
+        MonitorState.mark_progress()  # 恢復中的等待也算進展，多開 supervisor 不會把它當成卡死
         time.sleep(0.5)
     return True
 def GetADBPath(setting):
@@ -850,6 +1577,8 @@ def CheckRestartConnectADB(setting: FarmConfig):
     MAXRETRIES = 20
 
     adb_path = GetADBPath(setting)
+    serial = ADBSerial(setting)
+    fleet_mode = getattr(setting, '_FLEET_MODE', False)
 
     for attempt in range(MAXRETRIES):
         # 檢查停止信號
@@ -858,10 +1587,15 @@ def CheckRestartConnectADB(setting: FarmConfig):
             return None
 
         logger.info(f"-----------------------\n開始嘗試連接adb. 次數:{attempt + 1}/{MAXRETRIES}...")
+        MonitorState.mark_progress()  # 每次重試都算進展（多開心跳），重試本身有次數上限
 
         if attempt == 3:
-            logger.info(f"失敗次數過多, 嘗試關閉adb.")
-            KillAdb(setting)
+            if fleet_mode:
+                logger.info(f"失敗次數過多, 重新連接設備 {serial}.")
+                DisconnectADBSerial(setting, adb_path)
+            else:
+                logger.info(f"失敗次數過多, 嘗試關閉adb.")
+                KillAdb(setting)
 
             # 我們不起手就關, 但是如果2次鏈接還是嘗試失敗, 那就觸發一次強制重啓.
 
@@ -871,23 +1605,33 @@ def CheckRestartConnectADB(setting: FarmConfig):
             logger.debug(f"adb鏈接返回(輸出信息):{result.stdout}")
             logger.debug(f"adb鏈接返回(錯誤信息):{result.stderr}")
 
-            if ("daemon not running" in result.stderr) or ("offline" in result.stdout):
-                logger.warning(f"偵測到 ADB 異常狀態 (offline={('offline' in result.stdout)})")
-                
+            # 只看本設備的狀態（其他設備 offline 不代表本設備有問題）
+            offline = GetADBDeviceState(result.stdout, serial) == 'offline'
+            if ("daemon not running" in result.stderr) or offline:
+                logger.warning(f"偵測到 ADB 異常狀態 ({serial} offline={offline})")
+
                 # 如果是 offline，通常代表模擬器底層當機
-                if "offline" in result.stdout and attempt >= 1:
-                    logger.error("模擬器長時間處於 offline 狀態，判定為當機，準備強制重啟...")
-                    KillEmulator(setting)
-                    KillAdb(setting)
+                if offline and attempt >= 1:
+                    if fleet_mode:
+                        logger.error(f"設備 {serial} 長時間處於 offline 狀態，斷開後重新連接...")
+                    else:
+                        logger.error("模擬器長時間處於 offline 狀態，判定為當機，準備強制重啟...")
+                    ResetADBConnection(setting, adb_path)
                     time.sleep(2)
                     continue
 
-                logger.info("重啟 ADB 服務...")
-                CMDLine(f"\"{adb_path}\" kill-server")
-                CMDLine(f"\"{adb_path}\" start-server")
+                if fleet_mode:
+                    # 多開模式：ADB 服務由所有 worker 共用，不重啟；start-server 在服務已運行時不做任何事
+                    if offline:
+                        DisconnectADBSerial(setting, adb_path)
+                    CMDLine(f"\"{adb_path}\" start-server")
+                else:
+                    logger.info("重啟 ADB 服務...")
+                    CMDLine(f"\"{adb_path}\" kill-server")
+                    CMDLine(f"\"{adb_path}\" start-server")
 
             logger.debug(f"嘗試連接到adb...")
-            result = CMDLine(f"\"{adb_path}\" connect 127.0.0.1:{setting._ADBPORT}")
+            result = CMDLine(f"\"{adb_path}\" connect {serial}")
             logger.debug(f"adb鏈接返回(輸出信息):{result.stdout}")
             logger.debug(f"adb鏈接返回(錯誤信息):{result.stderr}")
 
@@ -896,8 +1640,7 @@ def CheckRestartConnectADB(setting: FarmConfig):
                 break
             if ("refused" in result.stderr) or ("cannot connect" in result.stdout):
                 logger.info("模擬器連接失敗，先確保舊實例已關閉...")
-                KillEmulator(setting)
-                KillAdb(setting)
+                ResetADBConnection(setting, adb_path)
                 # 等待進程關閉（2秒 = 4 x 0.5秒）
                 for _ in range(4):
                     if hasattr(setting, '_FORCESTOPING') and setting._FORCESTOPING and setting._FORCESTOPING.is_set():
@@ -907,7 +1650,7 @@ def CheckRestartConnectADB(setting: FarmConfig):
                 logger.info("嘗試啟動模擬器...")
                 StartEmulator(setting)
                 logger.info("嘗試連接到模擬器...")
-                result = CMDLine(f"\"{adb_path}\" connect 127.0.0.1:{setting._ADBPORT}")
+                result = CMDLine(f"\"{adb_path}\" connect {serial}")
                 if result.returncode == 0 and ("connected" in result.stdout or "already" in result.stdout):
                     logger.info("成功連接到模擬器")
                     break
@@ -922,8 +1665,7 @@ def CheckRestartConnectADB(setting: FarmConfig):
                     return None
                 time.sleep(0.5)
 
-            KillEmulator(setting)
-            KillAdb(setting)
+            ResetADBConnection(setting, adb_path)
 
             # 再次檢查停止信號的 sleep（2秒拆成4次）
             for _ in range(4):
@@ -941,8 +1683,7 @@ def CheckRestartConnectADB(setting: FarmConfig):
                     return None
                 time.sleep(0.5)
 
-            KillEmulator(setting)
-            KillAdb(setting)
+            ResetADBConnection(setting, adb_path)
 
             # 再次檢查停止信號的 sleep（2秒拆成4次）
             for _ in range(4):
@@ -960,9 +1701,8 @@ def CheckRestartConnectADB(setting: FarmConfig):
         devices = client.devices()
 
         # 查找匹配的設備
-        target_device = f"127.0.0.1:{setting._ADBPORT}"
         for device in devices:
-            if device.serial == target_device:
+            if device.serial == serial:
                 logger.info(f"成功獲取設備對象: {device.serial}")
                 return device
     except Exception as e:
@@ -970,6 +1710,43 @@ def CheckRestartConnectADB(setting: FarmConfig):
 
     return None
 ##################################################################
+# screencap 原始幀格式 (android PixelFormat)
+RAW_SCREENCAP_FORMATS = {
+    1: cv2.COLOR_RGBA2BGR,  # RGBA_8888
+    2: cv2.COLOR_RGBA2BGR,  # RGBX_8888
+    5: cv2.COLOR_BGRA2BGR,  # BGRA_8888
+}
+
+def decode_raw_screencap(data):
+    """解析 `screencap`（不帶 -p）輸出的原始幀為 BGR 圖像
+
+    原始輸出為 header + 像素資料，header 為小端序 uint32：
+    width, height, format（Android 9 以上額外帶 colorspace，共 16 bytes）。
+
+    Args:
+        data: screencap 的原始輸出 (bytes/bytearray)
+    Returns:
+        np.ndarray: BGR 圖像 (高, 寬, 3)
+    Raises:
+        ValueError: header 或資料長度不符、像素格式不支援
+    """
+    if data is None or len(data) < 12:
+        raise ValueError("原始幀資料過短")
+    width, height, pixel_format = np.frombuffer(data, dtype='<u4', count=3)
+    width, height, pixel_format = int(width), int(height), int(pixel_format)
+    pixel_bytes = width * height * 4
+    # 依總長度判斷 header 是 12 bytes（舊版）還是 16 bytes（含 colorspace）
+    for header_size in (12, 16):
+        if len(data) == header_size + pixel_bytes:
+            break
+    else:
+        raise ValueError(f"原始幀長度不符: {len(data)} bytes, 尺寸 {width}x{height}")
+    if pixel_format not in RAW_SCREENCAP_FORMATS:
+        raise ValueError(f"不支援的像素格式: {pixel_format}")
+    pixels = np.frombuffer(data, dtype=np.uint8, count=pixel_bytes, offset=header_size)
+    return cv2.cvtColor(pixels.reshape(height, width, 4), RAW_SCREENCAP_FORMATS[pixel_format])
+
+##################################################################
 def CutRoI(screenshot,roi):
     if roi is None:
         return screenshot
@@ -1010,6 +1787,127 @@ def CutRoI(screenshot,roi):
 
     # cv2.imwrite(f'CutRoI_{time.time()}.png', screenshot)
     return screenshot
+
+def CropRoI(screenshot, roi):
+    """裁切出 ROI 的搜索區域（模板比對用）
+
+    與 CutRoI 相同的 roi 格式：第一個矩形為搜索範圍，其餘矩形為排除區域。
+    只裁切出第一個矩形（視圖，不複製），排除區域僅在與裁切範圍相交時
+    才複製裁切區並塗黑相交部分；不會修改傳入的截圖。
+
+    Returns:
+        tuple: (search_area, (offset_x, offset_y))，比對座標加上 offset 即為螢幕座標
+    """
+    if roi is None:
+        return screenshot, (0, 0)
+
+    img_height, img_width = screenshot.shape[:2]
+    x1, y1, w1, h1 = roi[0]
+    x_start, y_start = max(0, x1), max(0, y1)
+    x_end, y_end = min(img_width, x1 + w1), min(img_height, y1 + h1)
+    if x_start >= x_end or y_start >= y_end:
+        # 搜索範圍完全在畫面外：返回空區域，比對會失敗並被跳過
+        return screenshot[0:0, 0:0], (0, 0)
+
+    search_area = screenshot[y_start:y_end, x_start:x_end]
+    copied = False
+    for x2, y2, w2, h2 in roi[1:]:
+        ex_x_start, ex_y_start = max(x_start, x2), max(y_start, y2)
+        ex_x_end, ex_y_end = min(x_end, x2 + w2), min(y_end, y2 + h2)
+        if ex_x_start < ex_x_end and ex_y_start < ex_y_end:
+            if not copied:
+                search_area = search_area.copy()
+                copied = True
+            search_area[ex_y_start - y_start:ex_y_end - y_start, ex_x_start - x_start:ex_x_end - x_start] = 0
+
+    return search_area, (x_start, y_start)
+
+PYRAMID_CANDIDATES = 3        # 粗比對取幾個候選位置做精比對
+PYRAMID_COARSE_SLACK = 0.15   # 多目標比對時，粗比對閾值比原閾值寬鬆多少
+PYRAMID_MIN_AREA_RATIO = 16   # 搜索區域至少為模板面積的多少倍才值得使用金字塔
+
+def _PyramidApplicable(search_area, template):
+    th, tw = template.shape[:2]
+    ah, aw = search_area.shape[:2]
+    return ah >= th and aw >= tw and ah * aw >= th * tw * PYRAMID_MIN_AREA_RATIO
+
+def _RefineWindow(search_area, template, mask, x, y, pad, span_w=0, span_h=0):
+    """在原解析度的小視窗內比對：候選位置為 (x, y) 起 span_w × span_h 的範圍，四周再加 pad 像素
+
+    Returns:
+        tuple: (比對結果矩陣, (視窗左上角 x, y))
+    """
+    th, tw = template.shape[:2]
+    ah, aw = search_area.shape[:2]
+    x0, y0 = max(0, x - pad), max(0, y - pad)
+    x1, y1 = min(aw, x + span_w + tw + pad), min(ah, y + span_h + th + pad)
+    window = search_area[y0:y1, x0:x1]
+    if mask is not None:
+        result = cv2.matchTemplate(window, template, cv2.TM_CCOEFF_NORMED, mask=mask)
+        np.nan_to_num(result, copy=False, nan=0.0, posinf=0.0, neginf=0.0)
+    else:
+        result = cv2.matchTemplate(window, template, cv2.TM_CCOEFF_NORMED)
+    return result, (x0, y0)
+
+def PyramidMatchTemplate(search_area, small_area, template, small_template, scale, mask=None, small_mask=None):
+    """金字塔比對（粗到細）
+
+    先在縮小 scale 倍的搜索區域比對縮小的模板，取分數最高的 PYRAMID_CANDIDATES 個位置
+    （每取一個就抑制其周圍一個模板大小的範圍），再於原解析度的小視窗內精比對。
+    分數為原解析度的 TM_CCOEFF_NORMED，與完整比對相同；只有最佳位置不在候選內時才會不同。
+
+    Returns:
+        tuple: (max_val, max_loc)，與 cv2.minMaxLoc 相同的格式；不適用（區域太小）時返回 None
+    """
+    if not _PyramidApplicable(search_area, template) or not _PyramidApplicable(small_area, small_template):
+        return None
+    if small_mask is not None:
+        coarse = cv2.matchTemplate(small_area, small_template, cv2.TM_CCOEFF_NORMED, mask=small_mask)
+        np.nan_to_num(coarse, copy=False, nan=-1.0, posinf=-1.0, neginf=-1.0)
+    else:
+        coarse = cv2.matchTemplate(small_area, small_template, cv2.TM_CCOEFF_NORMED)
+
+    sh, sw = small_template.shape[:2]
+    best_val, best_loc = -1.0, (0, 0)
+    for _ in range(PYRAMID_CANDIDATES):
+        _, coarse_val, _, (cx, cy) = cv2.minMaxLoc(coarse)
+        if coarse_val <= -1.0:
+            break
+        coarse[max(0, cy - sh // 2):cy + sh // 2 + 1, max(0, cx - sw // 2):cx + sw // 2 + 1] = -1.0
+        result, (x0, y0) = _RefineWindow(search_area, template, mask, cx * scale, cy * scale, 2 * scale)
+        _, max_val, _, (mx, my) = cv2.minMaxLoc(result)
+        if max_val > best_val:
+            best_val, best_loc = max_val, (mx + x0, my + y0)
+    return best_val, best_loc
+
+def PyramidMatchAll(search_area, small_area, template, small_template, scale, threshold, mask=None, small_mask=None):
+    """金字塔版本的多目標比對：返回原解析度比對分數 >= threshold 的所有位置
+
+    粗比對以 threshold - PYRAMID_COARSE_SLACK 找出候選區塊，
+    每個連通區塊只在原解析度的對應視窗內精比對。
+
+    Returns:
+        list: [(x, y), ...] 模板左上角在搜索區域中的座標；不適用時返回 None
+    """
+    if not _PyramidApplicable(search_area, template) or not _PyramidApplicable(small_area, small_template):
+        return None
+    if small_mask is not None:
+        coarse = cv2.matchTemplate(small_area, small_template, cv2.TM_CCOEFF_NORMED, mask=small_mask)
+        np.nan_to_num(coarse, copy=False, nan=-1.0, posinf=-1.0, neginf=-1.0)
+    else:
+        coarse = cv2.matchTemplate(small_area, small_template, cv2.TM_CCOEFF_NORMED)
+
+    hits = (coarse >= threshold - PYRAMID_COARSE_SLACK).astype(np.uint8)
+    count, _, stats, _ = cv2.connectedComponentsWithStats(hits)
+    locations = []
+    for label in range(1, count):
+        cx, cy, cw, ch = (int(v) for v in stats[label][:4])
+        # 視窗涵蓋整個區塊內的所有候選點
+        result, (x0, y0) = _RefineWindow(search_area, template, mask, cx * scale, cy * scale, 2 * scale,
+                                         (cw - 1) * scale, (ch - 1) * scale)
+        ys, xs = np.where(result >= threshold)
+        locations.extend((int(x) + x0, int(y) + y0) for x, y in zip(xs, ys))
+    return locations
 ##################################################################
 
 def Factory():
@@ -1018,14 +1916,18 @@ def Factory():
     quest = None
     runtimeContext = None
     
-    # [新增] 模板緩存字典，避免重複從磁碟讀取圖片
-    _template_cache = {}
+    # 模板註冊表：啟動時掃描一次，比對時不再讀取磁碟或掃描資料夾
+    template_registry = get_template_registry()
     
     # ==================== 停止信號異常機制 ====================
     class StopSignalException(Exception):
         """用戶請求停止時拋出的異常，會自動向上冒泡到主循環"""
         pass
 
+    class _MatchCancelled(Exception):
+        """並行比對的工作被取消（已找到結果或收到停止信號），只在比對線程內拋出"""
+        pass
+
     def check_stop_signal():
         """檢查停止信號與遊戲崩潰標記"""
         if setting._FORCESTOPING and setting._FORCESTOPING.is_set():
@@ -1056,15 +1958,6 @@ def Factory():
         return wrapper
     # ==================== 停止信號異常機制 END ====================
     
-    def _get_cached_template(template_name):
-        """從緩存獲取模板，如果不存在則從磁碟讀取並緩存"""
-        if template_name not in _template_cache:
-            template = LoadTemplateImage(template_name)
-            _template_cache[template_name] = template
-            if template is not None:
-                logger.trace(f"[TemplateCache] 緩存模板: {template_name}")
-        return _template_cache.get(template_name)
-    
     def LoadQuest(farmtarget):
         # 構建文件路徑
         jsondict = LoadJson(ResourcePath(QUEST_FILE))
@@ -1098,6 +1991,9 @@ def Factory():
     def ResetADBDevice():
         nonlocal setting # 修改device
 
+        if replay_source is not None:
+            _EndReplay("回放中需要重連 ADB")
+
         # [Fix] 如果遊戲已崩潰，直接觸發重啟流程，不嘗試恢復 ADB
         # 避免 ADB 重連過程清除崩潰標記，導致重啟流程無法正確觸發
         if hasattr(setting, '_GAME_CRASHED') and setting._GAME_CRASHED.is_set():
@@ -1112,13 +2008,11 @@ def Factory():
             setting._ADBDEVICE = device
             logger.info("ADB服務成功啓動，設備已連接.")
 
-            # ADB 重連後，嘗試重啟 pyscrcpy 串流
+            # ADB 重連後，交由串流監管線程在背景重啟 pyscrcpy 串流（期間使用 ADB 截圖）
             stream = get_scrcpy_stream()
             if stream:
-                if stream.restart():
-                    logger.info("pyscrcpy 串流重啟成功")
-                else:
-                    logger.warning("pyscrcpy 串流重啟失敗，將使用傳統 ADB 截圖")
+                stream.request_restart()
+                logger.info("已要求重啟 pyscrcpy 串流，重連期間使用傳統 ADB 截圖")
             
             # NOTE: ADB 重連後，清除舊的崩潰標記（避免舊 GameMonitor 線程的誤判）
             if hasattr(setting, '_GAME_CRASHED'):
@@ -1165,6 +2059,9 @@ def Factory():
                 logger.warning(f"檢查/啟動遊戲失敗: {e}")
     def DeviceShell(cmdStr):
         logger.trace(f"[DeviceShell] {cmdStr}")
+        _RecordInput('shell', cmd=cmdStr)
+        if replay_source is not None:
+            return ""
         MAX_ADB_RETRIES = 5  # 最大重試次數
         adb_retry_count = 0
 
@@ -1217,8 +2114,70 @@ def Factory():
                 logger.error(f"非預期的ADB異常: {type(e).__name__}: {e}")
                 raise
     
+    def _RecordInput(kind, **data):
+        """錄製中時記錄一次輸入"""
+        if session_recorder is not None:
+            session_recorder.record_input(kind, **data)
+
+    def InputShell(commands, delays=None):
+        """經由常駐 shell 送出輸入指令（tap/swipe/keyevent）
+
+        與 DeviceShell 相同的超時 (7 秒) 與重連語義：失敗時重置 ADB 並重試，最多 5 次。
+
+        Args:
+            commands: 單條指令字串，或指令列表
+            delays: 指令之間的間隔秒數（數值或列表），在設備端執行
+        """
+        logger.trace(f"[InputShell] {commands}")
+        if replay_source is not None:
+            return
+        MAX_ADB_RETRIES = 5  # 最大重試次數
+        adb_retry_count = 0
+
+        while True:
+            if setting._FORCESTOPING and setting._FORCESTOPING.is_set():
+                return
+            try:
+                get_input_shell(setting._ADBDEVICE).execute(commands, delays, timeout=7)
+                return
+            except (TimeoutError, RuntimeError, ConnectionResetError) as e:
+                adb_retry_count += 1
+                logger.warning(f"輸入通道失敗 ({type(e).__name__}): {e} (重試 {adb_retry_count}/{MAX_ADB_RETRIES})")
+
+                if adb_retry_count >= MAX_ADB_RETRIES:
+                    logger.error(f"ADB 連續失敗 {MAX_ADB_RETRIES} 次，放棄重試")
+                    raise RuntimeError(f"ADB 連續失敗 {MAX_ADB_RETRIES} 次: {commands}")
+
+                logger.info("嘗試重啓ADB服務...")
+                runtimeContext._COUNTERADBRETRY += 1
+                ResetADBDevice()
+                time.sleep(1)
+
+    def PressBatch(positions, interval=0.1):
+        """送出多個點擊：優先經由 scrcpy 控制通道逐一點擊；
+        串流不可用時剩下的點擊一次交給 adb shell（間隔在設備端執行，只需一次 ADB 往返）
+
+        Args:
+            positions: 座標列表 [[x, y], ...]，None 會被略過
+            interval: 點擊之間的間隔秒數
+        """
+        positions = [pos for pos in positions if pos]
+        if not positions:
+            return False
+        _RecordInput('press_batch', positions=positions, interval=interval)
+        for index, pos in enumerate(positions):
+            if not _StreamInput(lambda stream, pos=pos: stream.tap(pos[0], pos[1])):
+                InputShell([f"input tap {p[0]} {p[1]}" for p in positions[index:]], interval)
+                return True
+            if index < len(positions) - 1:
+                Sleep(interval)
+        return True
+
     def Sleep(t=1):
         """可響應停止信號和遊戲崩潰的 sleep 函數"""
+        if replay_source is not None:
+            # 回放模式：畫面由錄製幀驅動，不需要真的等待
+            return
         # 將長時間 sleep 分割成小段，每段檢查停止標誌
         interval = 0.1  # 每 0.1 秒檢查一次，確保快速響應停止信號
         elapsed = 0
@@ -1276,29 +2235,128 @@ def Factory():
                 pass  # 忽略更新錯誤
 
     _adb_mode_logged = False  # 追蹤是否已輸出 ADB 模式日誌
+    _adb_frame_seq = 0  # ADB 截圖的序號
+    _adb_capture_tier = None  # 目前 ADB 截圖層級: 'raw' (原始幀) / 'png'
+    _raw_capture_failures = 0  # 原始幀截圖連續失敗次數
+    RAW_CAPTURE_MAX_FAILURES = 3  # 連續失敗達此次數後停用原始幀截圖，改用 PNG
+    _last_frame_info = {'source': None, 'tier': None, 'seq': 0, 'timestamp': 0.0}  # 最近一次 ScreenShot 返回的幀資訊
+    session_recorder = None  # 錄製中時為 SessionRecorder
+    latency_tracker = LatencyTracker()  # 擷取管線延遲統計
+    search_regions = SearchRegionIndex(device=_scrcpy_serial)  # 每個模板學到的搜索區域（多開時每台設備一個檔案）
+    MATCH_MEMO_FRAMES = 4  # 比對結果快取保留最近幾幀
+    _match_memo = deque(maxlen=MATCH_MEMO_FRAMES)  # [{'frame', 'key': (來源, 序號), 'results': {(模板, ROI): (val, loc)}}]
+    _match_memo_stats = {'hits': 0, 'misses': 0, 'uncached': 0, 'pyramid': 0}  # 命中 / 未命中 / 不可快取（衍生圖片）/ 金字塔比對次數
+    MATCH_CERTAIN = 0.97  # 多模板比對時達到此分數即視為確定匹配，不再比對剩下的模板
+    MATCH_POOL_MAX_WORKERS = 4  # _MATCH_WORKERS = 0（自動）時的線程數上限
+    _match_pool = None  # 模板比對線程池（第一次需要並行時建立）
+    _match_local = threading.local()  # 比對線程內的取消旗標
+    screen_cache = ScreenClassCache()  # 畫面分類結果的 pHash 快取
+    screen_transitions = ScreenTransitionIndex(device=_scrcpy_serial)  # 每個任務的畫面轉移統計（分類先驗）
+    vision_bus = VisionBus()  # 視覺線程發布的畫面事件
+    vision_worker = None  # 視覺線程（串流可用時啟動：Farm 開始時，或監管線程回報串流恢復時）
+    vision_lock = threading.Lock()  # Farm 與串流監管線程都會啟動 / 停止視覺線程
+    vision_allowed = False  # 只在 Farm 執行期間允許啟動
+    _classify_stats = {'count': 0, 'templates': 0, 'baseline': 0, 'prior_hits': 0}  # 分類次數 / 實際比對的模板數 / 依序比對需要的模板數 / 預測命中
+    LATENCY_PUBLISH_INTERVAL = 1.0  # 更新 MonitorState 的間隔（秒）
+    LATENCY_LOG_INTERVAL = 60.0  # 延遲摘要寫入日誌的間隔（秒）
+    _latency_published = 0.0
+    _latency_logged = time.time()
+    _last_frame_ref = None  # 最近一次 ScreenShot 返回的幀物件（判斷比對的是否為最新幀）
+    replay_source = None  # 回放模式時為 ReplayFrameSource（取代設備）
+
+    def LastFrameInfo():
+        """獲取最近一次 ScreenShot 返回的幀資訊
+
+        Returns:
+            dict: {'source': 'stream'/'adb', 'tier': 擷取層級, 'seq': 幀序號, 'timestamp': 幀擷取時間}
+                  同一 source 下 seq 單調遞增，可用 (source, seq) 判斷是否為同一幀
+        """
+        return dict(_last_frame_info)
+
+    def _PublishLatency(force=False):
+        """節流地把延遲百分位數寫入 MonitorState，並定期輸出摘要到日誌"""
+        nonlocal _latency_published, _latency_logged
+        now = time.time()
+        if not force and now - _latency_published < LATENCY_PUBLISH_INTERVAL:
+            return
+        _latency_published = now
+        summary = latency_tracker.summary()
+        MonitorState.capture_latency = summary
+        MonitorState.match_memo = dict(_match_memo_stats)
+        MonitorState.screen_cache = screen_cache.snapshot()
+        count = _classify_stats['count']
+        MonitorState.screen_prior = {
+            'count': count,
+            'avg_templates': _classify_stats['templates'] / count if count else 0.0,
+            'avg_baseline': _classify_stats['baseline'] / count if count else 0.0,
+            'prior_hits': _classify_stats['prior_hits'],
+        }
+        MonitorState.rule_costs = {state: rule_set.stats() for state, rule_set in all_state_rules().items()}
+        MonitorState.vision = vision_worker.snapshot() if vision_worker is not None else {}
+        if summary and (force or now - _latency_logged >= LATENCY_LOG_INTERVAL):
+            _latency_logged = now
+            logger.info(f"[延遲統計] {latency_tracker.format_summary(summary)}")
+            cached = _match_memo_stats['hits'] + _match_memo_stats['misses']
+            if cached:
+                logger.info(f"[比對快取] 命中 {_match_memo_stats['hits']} / 未命中 {_match_memo_stats['misses']} "
+                            f"({_match_memo_stats['hits'] / cached * 100:.0f}%)，不可快取 {_match_memo_stats['uncached']}，"
+                            f"金字塔比對 {_match_memo_stats['pyramid']}")
+            cache_stats = MonitorState.screen_cache
+            if cache_stats['hits'] + cache_stats['misses'] + cache_stats['stale']:
+                logger.info(f"[分類快取] 命中 {cache_stats['hits']} / 未命中 {cache_stats['misses']} / 失效 {cache_stats['stale']} "
+                            f"({cache_stats['hit_rate'] * 100:.0f}%)，節省 {cache_stats['saved_ms'] / 1000:.1f} 秒，"
+                            f"快取 {cache_stats['entries']} 筆")
+            prior_stats = MonitorState.screen_prior
+            if prior_stats['count']:
+                logger.info(f"[分類先驗] 每次分類平均比對 {prior_stats['avg_templates']:.1f} 個模板 "
+                            f"(固定順序 {prior_stats['avg_baseline']:.1f})，預測命中 {prior_stats['prior_hits']}/{prior_stats['count']}")
+            for state, rule_set in all_state_rules().items():
+                costs = rule_set.format_stats()
+                if costs:
+                    logger.info(f"[規則成本] {state}: {costs}")
+            vision_stats = MonitorState.vision
+            if vision_stats:
+                detectors = ", ".join(f"{kind} {d['avg_ms']:.1f}ms×{d['runs']}" for kind, d in vision_stats['detectors'].items())
+                logger.info(f"[視覺線程] 處理 {vision_stats['frames']} 幀 ({vision_stats['fps']:.1f} 幀/秒)，{detectors}")
+
+    def _RecordMatchLatency(screenImage):
+        """比對完成時記錄幀年齡（只統計最新一幀，避免舊截圖重複比對拉高數字）"""
+        if screenImage is _last_frame_ref and _last_frame_info['tier']:
+            latency_tracker.add(f"{_last_frame_info['tier']}_match", (time.time() - _last_frame_info['timestamp']) * 1000)
 
     def ScreenShot():
-        """截圖函數：優先使用 pyscrcpy 串流，失敗時退回 ADB 截圖"""
-        nonlocal _adb_mode_logged
+        """截圖函數：優先使用 pyscrcpy 串流，失敗時退回 ADB 截圖
+
+        串流幀為唯讀視圖（零複製），需要修改像素時請先 copy()。
+        幀序號與時間戳可透過 LastFrameInfo() 取得。
+        返回的幀為 FrameContext（ndarray 子類別），灰階、HSV、平均亮度等衍生資料
+        請透過 FrameGray / FrameHSV / FrameMean 取得，同一幀只計算一次。
+        """
+        nonlocal _adb_mode_logged, _last_frame_ref
 
         # 檢查停止信號
         if setting._FORCESTOPING and setting._FORCESTOPING.is_set():
             logger.info("ScreenShot 檢測到停止信號，停止截圖")
             raise RuntimeError("截圖已停止")
+
+        if replay_source is not None:
+            final_img = _WrapFrame(_ScreenShot_Replay())
+            _last_frame_ref = final_img
+            _RegisterMemoFrame(final_img)
+            return final_img
         
         final_img = None
         
         # 嘗試使用 pyscrcpy 串流（極快：~1ms）
         stream = get_scrcpy_stream()
         if stream:
-            # 如果串流存在但不可用，嘗試重連（放寬條件：只要不可用就嘗試重連）
-            if not stream.is_available():
-                logger.info("串流不可用，嘗試重新連接...")
-                stream.restart()
+            # 串流的啟動與重連由背景監管線程負責，這裡不阻塞；不可用時直接使用 ADB 截圖
+            stream.ensure_supervisor()
 
             if stream.is_available():
-                frame = stream.get_frame()
-                if frame is not None:
+                latest = stream.get_latest()
+                if latest is not None:
+                    frame_seq, frame_time, frame = latest
                     h, w = frame.shape[:2]
 
                     # 檢查是否接近預期尺寸 (允許 ±10 像素差異)
@@ -1331,16 +2389,68 @@ def Factory():
                             final_img = frame[:1600, :900]
                     else:
                         logger.warning(f"串流幀尺寸異常: {frame.shape}，使用 ADB 截圖")
+                    if final_img is not None:
+                        _last_frame_info.update(source='stream', tier='stream', seq=frame_seq, timestamp=frame_time)
+                        # 串流幀年齡 = 交給 ScreenShot 的時間 - 解碼完成時間
+                        latency_tracker.add('stream', (time.time() - frame_time) * 1000)
         
         # 退回 ADB 截圖（較慢：~150-570ms）
         if final_img is None:
             final_img = _ScreenShot_ADB()
 
+        # ADB 幀也設為唯讀，與串流幀一致（需要修改像素時請先 copy()），才能安全快取比對結果
+        final_img.setflags(write=False)
+        final_img = _WrapFrame(final_img)
+        _last_frame_ref = final_img
+        _RegisterMemoFrame(final_img)
+        _PublishLatency()
+
+        if session_recorder is not None:
+            session_recorder.record_frame(final_img, _last_frame_info['source'], _last_frame_info['seq'],
+                                          _last_frame_info['timestamp'], MonitorState.current_state,
+                                          MonitorState.current_dungeon_state)
         return final_img
+
+    def _WrapFrame(img):
+        """包成 FrameContext（衍生資料快取）
+
+        與上一次 ScreenShot 是同一幀（相同來源與序號）時返回同一個物件，共用已算過的灰階、HSV 等資料。
+        """
+        key = (_last_frame_info['source'], _last_frame_info['seq'])
+        if isinstance(_last_frame_ref, FrameContext) and _last_frame_ref.key == key and _last_frame_ref.shape == img.shape:
+            return _last_frame_ref
+        return FrameContext.wrap(img, key)
+
+    def _EndReplay(reason):
+        """結束回放：設置停止信號並拋出 StopSignalException（回放不接觸真實設備）"""
+        logger.info(f"[回放] {reason} (共 {replay_source.frame_index} 幀)，停止任務")
+        setting._FORCESTOPING.set()
+        raise StopSignalException()
+
+    def _ScreenShot_Replay():
+        """回放模式：依錄製順序返回下一幀，播放完畢時停止任務"""
+        result = replay_source.next_frame()
+        if result is None:
+            _EndReplay("錄製幀已全部播放完畢")
+        frame, meta = result
+        _last_frame_info.update(source='replay', tier=None, seq=meta['index'], timestamp=meta['timestamp'])
+        return frame
     
+    def _ScreenCap_Raw():
+        """透過 `screencap`（不帶 -p）取得原始幀，跳過裝置端 PNG 編碼與本地解碼"""
+        conn = setting._ADBDEVICE.create_connection(timeout=10)
+        with conn:
+            conn.send("shell:/system/bin/screencap")
+            data = conn.read_all()
+        return decode_raw_screencap(data)
+
     def _ScreenShot_ADB():
-        """使用 ADB 截圖（原始方式）"""
-        nonlocal _adb_mode_logged
+        """使用 ADB 截圖
+
+        分兩層：優先取原始幀 (raw，無壓縮)，失敗時退回 PNG 截圖 (screencap -p + imdecode)。
+        原始幀連續失敗 RAW_CAPTURE_MAX_FAILURES 次後，本次運行改用 PNG。
+        """
+        nonlocal _adb_mode_logged, _adb_frame_seq, _adb_capture_tier, _raw_capture_failures
         max_retries = 5
         retry_count = 0
 
@@ -1356,12 +2466,22 @@ def Factory():
                 # 關鍵點：ADB screencap 調用，使用超時機制防止無限阻塞
                 logger.trace('[ScreenShot] 調用 ADB screencap...')
                 screenshot = None
+                image = None
                 exception = None
+                raw_exception = None
+                use_raw = _raw_capture_failures < RAW_CAPTURE_MAX_FAILURES
                 completed = Event()
+                capture_start = time.time()
 
                 def screencap_thread():
-                    nonlocal exception, screenshot
+                    nonlocal exception, screenshot, image, raw_exception
                     try:
+                        if use_raw:
+                            try:
+                                image = _ScreenCap_Raw()
+                                return
+                            except Exception as e:
+                                raw_exception = e
                         screenshot = setting._ADBDEVICE.screencap()
                     except Exception as e:
                         exception = e
@@ -1376,29 +2496,41 @@ def Factory():
                     logger.error('ADB screencap 超時（10秒），可能連接有問題')
                     raise RuntimeError("screencap 超時")
 
+                if raw_exception is not None:
+                    _raw_capture_failures += 1
+                    logger.debug(f"[ScreenShot] 原始幀截圖失敗 ({_raw_capture_failures}/{RAW_CAPTURE_MAX_FAILURES}): {raw_exception}")
+                    if _raw_capture_failures >= RAW_CAPTURE_MAX_FAILURES:
+                        logger.warning("[截圖模式] 原始幀截圖連續失敗，改用 PNG 截圖")
+
                 if exception is not None:
                     raise exception
 
-                if screenshot is None:
-                    raise RuntimeError("screencap 返回 None")
+                if image is not None:
+                    capture_tier = 'raw'
+                    _raw_capture_failures = 0
+                else:
+                    capture_tier = 'png'
+                    if screenshot is None:
+                        raise RuntimeError("screencap 返回 None")
 
-                logger.trace(f'[ScreenShot] ADB 完成，{len(screenshot)} bytes')
+                    logger.trace(f'[ScreenShot] ADB 完成，{len(screenshot)} bytes')
 
-                screenshot_np = np.frombuffer(screenshot, dtype=np.uint8)
-                logger.trace(f'[ScreenShot] numpy 陣列大小: {screenshot_np.size}')
+                    screenshot_np = np.frombuffer(screenshot, dtype=np.uint8)
+                    logger.trace(f'[ScreenShot] numpy 陣列大小: {screenshot_np.size}')
 
-                if screenshot_np.size == 0:
-                    logger.error("截圖數據爲空！")
-                    raise RuntimeError("截圖數據爲空")
+                    if screenshot_np.size == 0:
+                        logger.error("截圖數據爲空！")
+                        raise RuntimeError("截圖數據爲空")
 
-                logger.trace('[ScreenShot] 解碼圖像...')
-                image = cv2.imdecode(screenshot_np, cv2.IMREAD_COLOR)
+                    logger.trace('[ScreenShot] 解碼圖像...')
+                    image = cv2.imdecode(screenshot_np, cv2.IMREAD_COLOR)
 
-                if image is None:
-                    logger.error("OpenCV解碼失敗：圖像數據損壞")
-                    raise RuntimeError("圖像解碼失敗")
+                    if image is None:
+                        logger.error("OpenCV解碼失敗：圖像數據損壞")
+                        raise RuntimeError("圖像解碼失敗")
 
-                logger.trace(f'[ScreenShot] 解碼完成，尺寸: {image.shape}')
+                capture_ms = (time.time() - capture_start) * 1000
+                logger.trace(f'[ScreenShot] 截圖完成 ({capture_tier}, {capture_ms:.0f} ms)，尺寸: {image.shape}')
 
                 if image.shape != (1600, 900, 3):  # OpenCV格式爲(高, 寬, 通道)
                     if image.shape == (900, 1600, 3):
@@ -1411,10 +2543,16 @@ def Factory():
 
                 #cv2.imwrite('screen.png', image)
                 logger.trace('[ScreenShot] 成功')
-                # 首次使用 ADB 截圖時輸出日誌
-                if not _adb_mode_logged:
-                    logger.info("[截圖模式] 使用 ADB 截圖 (~150-570ms)")
+                # 首次使用 ADB 截圖或截圖層級切換時輸出日誌
+                if not _adb_mode_logged or capture_tier != _adb_capture_tier:
+                    tier_name = "原始幀" if capture_tier == 'raw' else "PNG"
+                    logger.info(f"[截圖模式] 使用 ADB {tier_name}截圖 (本次 {capture_ms:.0f} ms)")
                     _adb_mode_logged = True
+                    _adb_capture_tier = capture_tier
+                _adb_frame_seq += 1
+                # ADB 幀年齡 = 交給 ScreenShot 的時間 - 發出截圖請求的時間
+                _last_frame_info.update(source='adb', tier=f'adb_{capture_tier}', seq=_adb_frame_seq, timestamp=capture_start)
+                latency_tracker.add(f'adb_{capture_tier}', (time.time() - capture_start) * 1000)
                 return image
             except RestartSignal:
                 # RestartSignal 不應被截圖捕獲，直接拋出讓外層處理
@@ -1434,55 +2572,102 @@ def Factory():
                 else:
                     logger.error(f"截圖遇到未預期的錯誤: {type(e).__name__}: {e}")
                     raise
+    def _get_waitable_stream():
+        """返回可用於阻塞等待的串流（不可用時返回 None，不觸發重連）"""
+        stream = get_scrcpy_stream()
+        if stream and stream.is_available():
+            return stream
+        return None
+
+    def WaitForNextFrame(timeout=0.5):
+        """等待一幀比上一次 ScreenShot 更新的畫面並返回
+
+        取代固定的 Sleep 輪詢：串流模式下新幀一到就返回；
+        串流不可用時退回 Sleep(timeout) 後截圖。
+
+        Args:
+            timeout: 最長等待秒數
+        Returns:
+            np.ndarray: 新的截圖
+        """
+        if replay_source is not None:
+            # 回放模式：每次等待恰好前進一幀，結果不受處理速度影響
+            return ScreenShot()
+        stream = _get_waitable_stream()
+        if stream is None:
+            Sleep(timeout)
+            return ScreenShot()
+
+        if _last_frame_info['source'] == 'stream':
+            after_seq = _last_frame_info['seq']
+        else:
+            after_seq = stream.frame_seq
+        deadline = time.time() + timeout
+        while True:
+            check_stop_signal()
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+            # 分段等待，確保停止信號能被快速響應
+            if stream.wait_for_frame(after_seq, min(0.1, remaining)) is not None:
+                break
+        return ScreenShot()
+
+    def WaitForChange(reference, threshold=0.02, roi=None, timeout=0.5, min_interval=0.0):
+        """等待畫面相對於參考幀發生變化並返回最新截圖
+
+        Args:
+            reference: 參考截圖，None 時等同 WaitForNextFrame
+            threshold: 灰階平均差異比例超過此值視為變化
+            roi: 可選的比較區域 [x, y, w, h]
+            timeout: 最長等待秒數，超時後返回當下的截圖
+            min_interval: 畫面變化時至少等到呼叫後這麼多秒才返回
+                （畫面持續變化時每一幀都算變化，用來限制呼叫端的檢測頻率）
+        Returns:
+            np.ndarray: 最新截圖
+        """
+        if reference is None or replay_source is not None:
+            # 回放模式：與 WaitForNextFrame 相同，恰好前進一幀（不連續截圖比對，避免跳過的幀數取決於時間）
+            return WaitForNextFrame(timeout)
+
+        start = time.time()
+        deadline = start + timeout
+        stream = _get_waitable_stream()
+        scn = None
+        if stream is None:
+            # ADB 模式：截圖本身就是延遲，直接連續截圖比對
+            while True:
+                check_stop_signal()
+                scn = ScreenShot()
+                if frame_diff_ratio(reference, scn, roi) > threshold or time.time() >= deadline:
+                    break
+        else:
+            while True:
+                check_stop_signal()
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                if stream.wait_for_change(reference, threshold, roi, min(0.1, remaining)) is not None:
+                    break
+
+        wait = start + min_interval - time.time()
+        if wait > 0:
+            Sleep(wait)
+            scn = None
+        return scn if scn is not None else ScreenShot()
+
     # 多模板映射：某些目標需要嘗試多個模板，選擇匹配度最高的
     # 使用函數動態獲取模板列表，支持自動掃描資料夾
     def get_multi_templates(target_name):
-        """獲取目標的所有可用模板，支持動態掃描 harken, harken2, harken3... 等"""
-        import glob
-        import re
-        
-        # 對於 harken，動態掃描所有 harken 或 harken+數字 的檔案
-        if target_name == 'harken':
-            harken_path = ResourcePath(os.path.join(IMAGE_FOLDER, 'harken*.png'))
-            harken_files = glob.glob(harken_path)
-            if harken_files:
-                templates = []
-                # 只匹配 harken.png 或 harken+數字.png（如 harken2.png, harken3.png）
-                pattern = re.compile(r'^harken\d*$')
-                for f in harken_files:
-                    name = os.path.splitext(os.path.basename(f))[0]
-                    if pattern.match(name):
-                        templates.append(name)
-                if templates:
-                    return templates
-        
-        # 對於 spellskill 路徑，掃描對應資料夾的所有技能圖片
-        if target_name.startswith('spellskill/'):
-            parts = target_name.split('/')
-            if len(parts) == 2:  # 例如: spellskill/單體 (僅當只指定類別時才掃描整個資料夾)
-                category_folder = parts[1]  # 取得類別資料夾名稱
-                skill_folder_path = ResourcePath(os.path.join(IMAGE_FOLDER, 'spellskill', category_folder))
-                
-                if os.path.isdir(skill_folder_path):
-                    templates = []
-                    # 掃描資料夾內所有 .png 檔案
-                    for filename in sorted(os.listdir(skill_folder_path)):
-                        if filename.lower().endswith('.png'):
-                            # 構建相對路徑: spellskill/類別/檔名(不含.png)
-                            name_without_ext = filename.rsplit('.', 1)[0]
-                            template_path = f'spellskill/{category_folder}/{name_without_ext}'
-                            templates.append(template_path)
-                    
-                    if templates:
-                        logger.debug(f"[多模板] 找到 {len(templates)} 個技能模板於 {category_folder} 資料夾")
-                        return templates
-        
-        # 預設只返回原始目標
-        return [target_name]
+        """獲取目標的所有可用模板（harken → harken, harken2…；spellskill/類別 → 資料夾內所有技能）
+
+        由模板註冊表提供，不掃描資料夾
+        """
+        return template_registry.variants(target_name)
 
     # [新增] 本地緩存包裝函數，確保腳本能正確調用 utils 的緩存邏輯
     def _get_cached_template(shortPathOfTarget):
-        return LoadTemplateImage(shortPathOfTarget)
+        return template_registry.get(shortPathOfTarget)
 
     def IsScreenBlack(screen, threshold=15):
         """檢測螢幕是否全黑（或接近全黑）
@@ -1496,36 +2681,20 @@ def Factory():
         Returns:
             bool: 是否為黑屏
         """
-        mean_brightness = np.mean(screen)
+        mean_brightness = FrameMean(screen)
         is_black = mean_brightness < threshold
         return is_black
 
-    def GetMatchValue(screenImage, shortPathOfTarget, roi=None):
+    def GetMatchValue(screenImage, shortPathOfTarget, roi=None, threshold=0.70):
         """獲取模板匹配的相似度值（0-100%）
         
-        用於監控面板即時顯示 Flag 匹配度
+        用於監控面板即時顯示 Flag 匹配度。
+        與 CheckIf 共用比對流程與同一幀的比對快取（學到的區域內達到 threshold 即不再搜索全螢幕），
+        但不會更新搜索區域索引。
         """
-        templates_to_try = get_multi_templates(shortPathOfTarget)
-        best_val = 0
-        
-        for template_name in templates_to_try:
-            # 停止信號檢查：在遍歷大量模板時確保能快速響應停止請求
-            if setting._FORCESTOPING and setting._FORCESTOPING.is_set():
-                return 0
-            template = _get_cached_template(template_name)
-            if template is None:
-                continue
-            
-            screenshot = screenImage.copy()
-            search_area = CutRoI(screenshot, roi)
-            try:
-                result = cv2.matchTemplate(search_area, template, cv2.TM_CCOEFF_NORMED)
-                _, max_val, _, _ = cv2.minMaxLoc(result)
-                if max_val > best_val:
-                    best_val = max_val
-            except:
-                continue
-        
+        if setting._FORCESTOPING and setting._FORCESTOPING.is_set():
+            return 0
+        best_val, _, _ = _BestMatch(screenImage, get_multi_templates(shortPathOfTarget), roi, threshold, learn=False)
         return int(best_val * 100)
 
     def CheckLowHP(screenImage):
@@ -1553,7 +2722,7 @@ def Factory():
                 continue
                 
             roi = screenImage[y:y+h, x:x+w]
-            hsv = cv2.cvtColor(roi, cv2.COLOR_BGR2HSV)
+            hsv = FrameHSV(screenImage, (x, y, w, h))
             
             # 紅色偵測 (HSV 範圍)
             red_lower1 = np.array([0, 100, 100])
@@ -1633,6 +2802,7 @@ def Factory():
                         top_left = max_loc
                         h_t, w_t = template.shape[:2]
                         matched_area = roi_img[top_left[1]:top_left[1]+h_t, top_left[0]:top_left[0]+w_t]
+                        matched_rect = (x + top_left[0], y + top_left[1], w_t, h_t)  # 螢幕座標
                         
                         is_valid = False
                         
@@ -1641,7 +2811,7 @@ def Factory():
                             
                         elif check_type == 1: # 劇毒 (Venom)
                         # Hue ~130 紫色, Sat > 50
-                            hsv = cv2.cvtColor(matched_area, cv2.COLOR_BGR2HSV)
+                            hsv = FrameHSV(screenImage, matched_rect)
                             avg_hue = np.mean(hsv[:,:,0])
                             avg_sat = np.mean(hsv[:,:,1])
                             if abs(avg_hue - 130) < 20 and avg_sat > 50:
@@ -1649,7 +2819,7 @@ def Factory():
                                 
                         elif check_type == 2: # 中毒 (Poison)
                         # Hue: 118±20, Sat > 30 (Center 127 -> 118 for better coverage)
-                            hsv = cv2.cvtColor(matched_area, cv2.COLOR_BGR2HSV)
+                            hsv = FrameHSV(screenImage, matched_rect)
                             avg_hue = np.mean(hsv[:,:,0])
                             avg_sat = np.mean(hsv[:,:,1])
                             if abs(avg_hue - 118) < 20 and avg_sat > 30:
@@ -1657,8 +2827,7 @@ def Factory():
                                 
                         elif check_type == 3: # 石化 (Stone)
                         # 使用 HSV 檢測上半部白色像素 (50 < n < 130)
-                            top_half = matched_area[:h_t//2, :]
-                            top_hsv = cv2.cvtColor(top_half, cv2.COLOR_BGR2HSV)
+                            top_hsv = FrameHSV(screenImage, (matched_rect[0], matched_rect[1], w_t, h_t//2))
                             white_mask = cv2.inRange(top_hsv, np.array([0, 0, 180]), np.array([180, 40, 255]))
                             white_count = cv2.countNonZero(white_mask)
                             if 50 < white_count < 130:
@@ -1728,25 +2897,12 @@ def Factory():
         # 裁切 ROI 區域
         cropped = screenImage[roi_y:roi_y+roi_h, roi_x:roi_x+roi_w]
         
-        # 取得角色圖片資料夾
-        character_dir = ResourcePath("resources/images/character")
-        if not os.path.isdir(character_dir):
-            return "未找到"
-        
-        # 掃描角色圖片
+        # 角色圖片由模板註冊表提供（不重複掃描資料夾與解碼）
         best_match = "未找到"
         best_val = 0.80  # 最低門檻
         
-        for filename in os.listdir(character_dir):
-            if not filename.lower().endswith('.png'):
-                continue
-            
-            template_path = os.path.join(character_dir, filename)
-            # 使用 numpy 讀取以支援中文檔名
-            try:
-                template = cv2.imdecode(np.fromfile(template_path, dtype=np.uint8), cv2.IMREAD_COLOR)
-            except:
-                continue
+        for name in template_registry.variants('character/'):
+            template = template_registry.get(name)
             if template is None:
                 continue
             
@@ -1756,72 +2912,269 @@ def Factory():
                 
                 if max_val > best_val:
                     best_val = max_val
-                    best_match = os.path.splitext(filename)[0]
+                    best_match = name.split('/', 1)[1]
             except:
                 continue
         
         return best_match
 
 
-    def CheckIf(screenImage, shortPathOfTarget, roi = None, outputMatchResult = False, threshold = 0.80):
-        # 檢查是否需要多模板匹配
-        templates_to_try = get_multi_templates(shortPathOfTarget)
-        
+    def _MatchWorkers():
+        workers = int(getattr(setting, '_MATCH_WORKERS', 0) or 0) if setting else 1
+        if workers <= 0:
+            workers = max(1, min(MATCH_POOL_MAX_WORKERS, (os.cpu_count() or 1) - 1))
+        return workers
+
+    def _GetMatchPool():
+        nonlocal _match_pool
+        if _match_pool is None:
+            workers = _MatchWorkers()
+            _match_pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="MatchWorker")
+            logger.debug(f"[並行比對] 建立比對線程池: {workers} 個線程")
+        return _match_pool
+
+    def _ShutdownMatchPool():
+        nonlocal _match_pool
+        if _match_pool is not None:
+            _match_pool.shutdown(wait=False, cancel_futures=True)
+            _match_pool = None
+
+    def _CheckMatchCancel():
+        """比對迴圈中的停止檢查
+
+        呼叫端線程：等同 check_stop_signal()（停止信號、崩潰重啟都在呼叫端處理）。
+        比對線程：只檢查取消旗標與停止信號，拋出 _MatchCancelled 由呼叫端收拾。
+        """
+        cancel = getattr(_match_local, 'cancel', None)
+        if cancel is None:
+            check_stop_signal()
+            return
+        if cancel.is_set() or (setting._FORCESTOPING and setting._FORCESTOPING.is_set()):
+            raise _MatchCancelled()
+
+    def _RunMatches(func, items, done):
+        """對每個 item 執行 func(item)（互相獨立的比對），依 items 順序把結果交給 done(index, result)
+
+        done 返回 True 時取消剩下的工作。結果與依序執行完全相同：
+        只有排在前面的工作都完成後，後面的結果才會交給 done。
+        cv2.matchTemplate 會釋放 GIL，多個模板可以在線程池中同時比對；
+        線程數為 1、只有一個 item、或已經在比對線程內（巢狀呼叫）時依序執行。
+        """
+        if len(items) <= 1 or _MatchWorkers() <= 1 or getattr(_match_local, 'cancel', None) is not None:
+            for index, item in enumerate(items):
+                _CheckMatchCancel()
+                if done(index, func(item)):
+                    return
+            return
+
+        cancel = threading.Event()
+
+        def run(item):
+            _match_local.cancel = cancel
+            try:
+                if cancel.is_set():
+                    raise _MatchCancelled()
+                return func(item)
+            finally:
+                _match_local.cancel = None
+
+        pool = _GetMatchPool()
+        futures = [pool.submit(run, item) for item in items]
+        index_of = {future: index for index, future in enumerate(futures)}
+        pending = set(futures)
+        completed = {}
+        next_index = 0
+        try:
+            while next_index < len(futures):
+                finished, pending = wait(pending, timeout=0.05, return_when=FIRST_COMPLETED)
+                check_stop_signal()
+                for future in finished:
+                    completed[index_of[future]] = future
+                while next_index in completed:
+                    try:
+                        result = completed.pop(next_index).result()
+                    except _MatchCancelled:
+                        # 比對線程先看到停止信號：在呼叫端拋出 StopSignalException
+                        check_stop_signal()
+                        raise
+                    if done(next_index, result):
+                        return
+                    next_index += 1
+        finally:
+            cancel.set()
+            for future in pending:
+                future.cancel()
+
+    def _MatchTemplate(search_area, template, template_name):
+        """在搜索區域內比對單一模板
+
+        template 為註冊表的 entry，search_area 需已轉成與 template['match'] 相同的表示
+        （見 _MatchArea）。比對模式由模板比對清單決定：gray / bgr / edge 為標準比對，
+        masked 帶 Alpha 遮罩（僅技能圖等背景會變動的圖示使用）。
+
+        Returns:
+            tuple: (max_val, max_loc)，比對失敗（例如區域小於模板）時返回 None
+        """
+        try:
+            if template['match_mask'] is not None:
+                result = cv2.matchTemplate(search_area, template['match'], cv2.TM_CCOEFF_NORMED, mask=template['match_mask'])
+            else:
+                result = cv2.matchTemplate(search_area, template['match'], cv2.TM_CCOEFF_NORMED)
+        except Exception as e:
+            logger.error(f"[CheckIf] 匹配異常 (Template: {template_name}): {e}")
+            return None
+
+        _, max_val, _, max_loc = cv2.minMaxLoc(result)
+        return max_val, max_loc
+
+    def _RegisterMemoFrame(frame):
+        """登記 ScreenShot 返回的幀，之後對這一幀的比對結果會被快取
+
+        同一個 (來源, 序號) 的幀即使是不同物件（例如串流幀補邊後的新陣列），也共用同一份結果。
+        """
+        key = (_last_frame_info['source'], _last_frame_info['seq'])
+        if _match_memo and _match_memo[-1]['key'] == key:
+            if _match_memo[-1]['frame'] is frame:
+                return
+            results = _match_memo[-1]['results']
+        else:
+            results = {}
+        _match_memo.append({'frame': frame, 'key': key, 'results': results})
+
+    def _MemoResults(screenImage):
+        """ScreenShot 登記過的幀的快取字典，未登記的幀返回 None"""
+        # 複製一份再走訪：視覺線程比對時，主線程可能同時登記新幀
+        for entry in reversed(list(_match_memo)):
+            if entry['frame'] is screenImage:
+                return entry['results']
+        return None
+
+    def _MatchArea(screenImage, roi, mode, results, scale=1):
+        """裁切 ROI 並轉成比對模式的表示（scale > 1 時為金字塔比對用的縮小版本），
+        同一幀同一 (模式, ROI, 倍率) 只轉換一次
+
+        Returns:
+            tuple: (search_area, (offset_x, offset_y))，offset 為原解析度的螢幕座標
+        """
+        key = ('__area__', mode, None if roi is None else tuple(tuple(rect) for rect in roi), scale)
+        if results is not None and key in results:
+            return results[key]
+        if roi is None and scale == 1 and mode in ('gray', 'edge'):
+            # 全螢幕灰階與其他偵測共用同一份（FrameContext 快取）
+            gray = FrameGray(screenImage)
+            area = (gray if mode == 'gray' else EdgeMap(gray), (0, 0))
+        else:
+            search_area, offset = CropRoI(screenImage, roi)
+            if scale > 1 and search_area.size:
+                search_area = DownscaleForMatch(search_area, scale)
+            area = (ConvertForMatch(search_area, mode), offset)
+        if results is not None:
+            results[key] = area
+        return area
+
+    def _MatchEntry(screenImage, template, template_name, roi, results):
+        """依模板設定比對（金字塔或原解析度），返回區域內座標與區域偏移"""
+        search_area, offset = _MatchArea(screenImage, roi, template['mode'], results)
+        if template['pyramid'] is not None:
+            small_area, _ = _MatchArea(screenImage, roi, template['mode'], results, template['pyramid'])
+            try:
+                match = PyramidMatchTemplate(search_area, small_area, template['match'], template['match_small'],
+                                             template['pyramid'], template['match_mask'], template['match_small_mask'])
+            except Exception as e:
+                logger.error(f"[CheckIf] 金字塔匹配異常 (Template: {template_name}): {e}")
+                match = None
+            if match is not None:
+                _match_memo_stats['pyramid'] += 1
+                return match, offset
+        return _MatchTemplate(search_area, template, template_name), offset
+
+    def _CachedMatch(screenImage, template, template_name, roi):
+        """在 roi 內比對單一模板（加上同一幀的結果快取）
+
+        只快取 ScreenShot 登記過的唯讀幀（WrapImage 等衍生圖片每次都是新陣列，不快取）。
+        快取鍵 = (幀來源, 幀序號) + (模板, ROI)，值為 (max_val, max_loc)。
+
+        Returns:
+            tuple: (max_val, max_loc)，max_loc 為模板左上角的螢幕座標；比對失敗時返回 None
+        """
+        results = _MemoResults(screenImage)
+        if results is None:
+            _match_memo_stats['uncached'] += 1
+        else:
+            key = (template_name, None if roi is None else tuple(tuple(rect) for rect in roi))
+            if key in results:
+                _match_memo_stats['hits'] += 1
+                return results[key]
+            _match_memo_stats['misses'] += 1
+
+        match, (offset_x, offset_y) = _MatchEntry(screenImage, template, template_name, roi, results)
+        if match is not None:
+            match = (match[0], (match[1][0] + offset_x, match[1][1] + offset_y))
+        if results is not None:
+            results[key] = match
+        return match
+
+    def _BestMatch(screenImage, templates_to_try, roi, threshold, learn=True):
+        """在多個模板中找出匹配度最高者（CheckIf、GetMatchValue 與 ClassifyScreen 共用）
+
+        呼叫端沒有指定 roi 時，依序使用學到的搜索區域、比對清單的預設區域（沒有則為全螢幕）。
+        多個模板（變體、資料夾）在比對線程池中並行比對；任一模板達到 MATCH_CERTAIN 時不再比對剩下的模板。
+        learn: 匹配成功時是否記錄到搜索區域索引（只在呼叫端沒有指定 ROI 時）
+
+        Returns:
+            tuple: (best_val, best_pos, best_template_name)，best_pos 為模板中心的螢幕座標
+        """
         best_pos = None
         best_val = 0
         best_template_name = None
-        match_details = []  # 收集匹配詳情用於摘要
-        
-        # [優化] 預先處理截圖，避免在多模板循環中重複執行
-        screenshot = screenImage.copy()
-        search_area = CutRoI(screenshot, roi)
 
-        for template_name in templates_to_try:
-            # 停止信號檢查：在遍歷大量模板時確保能快速響應停止請求
-            check_stop_signal() 
-            
-            template = _get_cached_template(template_name)  # [優化] 使用緩存
-            if template is None:
+        def evaluate(template_name):
+            template_entry = template_registry.entry(template_name)  # [優化] 使用註冊表快取
+            if template_entry is None:
                 # 如果模板加載失敗（例如文件不存在），跳過該模板
                 logger.trace(f"[CheckIf] 模板加載失敗或為 None: {template_name}，跳過")
-                continue
-
-            try:
-                # NOTE: 僅對技能圖片 (spellskill) 啟用透明遮罩比對模式
-                # 其他圖片（dungFlag, mapFlag 等）維持標準 BGR 比對
-                is_skill = "spellskill" in template_name
-                
-                if is_skill and len(template.shape) == 3 and template.shape[2] == 4:
-                    # 技能圖片且帶有 Alpha 通道，使用遮罩比對
-                    tpl_bgr = template[:, :, :3]
-                    tpl_mask = template[:, :, 3]
-                    result = cv2.matchTemplate(search_area, tpl_bgr, cv2.TM_CCOEFF_NORMED, mask=tpl_mask)
+                return None
+            template_h, template_w = template_entry['shape'][:2]
+
+            match = None
+            from_region = False
+            # [優化] 呼叫端沒有指定 ROI 時，先在學到的區域內搜索，未達閾值才退回預設區域 / 全螢幕
+            learned_roi = search_regions.region(template_name, screenImage.shape) if roi is None else None
+            if learned_roi is not None:
+                match = _CachedMatch(screenImage, template_entry, template_name, learned_roi)
+                if match is not None and match[0] >= threshold:
+                    from_region = True
                 else:
-                    # 一般圖片或無 Alpha 通道，使用標準比對
-                    # 如果是 4 通道但非技能圖，僅取 BGR 部分
-                    if len(template.shape) == 3 and template.shape[2] == 4:
-                        tpl_bgr = template[:, :, :3]
-                        result = cv2.matchTemplate(search_area, tpl_bgr, cv2.TM_CCOEFF_NORMED)
-                    else:
-                        result = cv2.matchTemplate(search_area, template, cv2.TM_CCOEFF_NORMED)
-            except Exception as e:
-                logger.error(f"[CheckIf] 匹配異常 (Template: {template_name}): {e}")
-                if isinstance(e, (cv2.error)):
-                    continue 
-
-            _, max_val, _, max_loc = cv2.minMaxLoc(result)
+                    match = None
+            if match is None:
+                match = _CachedMatch(screenImage, template_entry, template_name, roi if roi is not None else template_entry['region'])
+                if match is None:
+                    return None
+            max_val, max_loc = match
             
             # 詳細日誌放到 TRACE（只輸出到詳細文件）
-            logger.trace(f"[CheckIf] {template_name}: {max_val*100:.2f}%")
-            match_details.append(f"{template_name}:{max_val*100:.0f}%")
-            
+            logger.trace(f"[CheckIf] {template_name}: {max_val*100:.2f}% ({template_entry['mode']}){' (學習區域)' if from_region else ''}")
+            return max_val, [max_loc[0] + template_w//2, max_loc[1] + template_h//2]
+
+        def done(index, result):
+            nonlocal best_val, best_pos, best_template_name
             # 記錄最佳匹配
-            if max_val > best_val:
-                best_val = max_val
-                best_pos = [max_loc[0] + template.shape[1]//2, max_loc[1] + template.shape[0]//2]
-                best_template_name = template_name
+            if result is not None and result[0] > best_val:
+                best_val, best_pos = result
+                best_template_name = templates_to_try[index]
+            return best_val >= max(MATCH_CERTAIN, threshold)
+
+        _RunMatches(evaluate, templates_to_try, done)
+
+        if learn and roi is None and best_pos is not None and best_val >= threshold:
+            template = _get_cached_template(best_template_name)
+            h, w = template.shape[:2]
+            search_regions.record(best_template_name, best_pos[0] - w//2, best_pos[1] - h//2, w, h)
 
-        # [Monitor Update] 循環結束後，確保 MonitorState 存的是最佳匹配值 (如果是目標 Flag)
+        return best_val, best_pos, best_template_name
+
+    def _UpdateFlagMonitor(shortPathOfTarget, best_val):
+        """[Monitor Update] 確保 MonitorState 存的是最佳匹配值 (如果是目標 Flag)"""
         if shortPathOfTarget in ['dungFlag', 'mapFlag', 'chestFlag', 'combatActive', 'worldMap', 'chest_auto', 'AUTO']:
             flag_attr = f"flag_{shortPathOfTarget}" if shortPathOfTarget != 'AUTO' else 'flag_auto_text'
             if hasattr(MonitorState, flag_attr):
@@ -1830,6 +3183,17 @@ def Factory():
                 if hasattr(MonitorState, 'flag_updates'):
                     MonitorState.flag_updates[shortPathOfTarget] = time.time()
 
+    def CheckIf(screenImage, shortPathOfTarget, roi = None, outputMatchResult = False, threshold = None):
+        # 未指定閾值時使用模板比對清單的預設閾值（沒有則為 0.80）
+        if threshold is None:
+            threshold = template_registry.spec(shortPathOfTarget)['threshold'] or 0.80
+        # 檢查是否需要多模板匹配
+        templates_to_try = get_multi_templates(shortPathOfTarget)
+        best_val, best_pos, best_template_name = _BestMatch(screenImage, templates_to_try, roi, threshold)
+
+        _RecordMatchLatency(screenImage)
+        _UpdateFlagMonitor(shortPathOfTarget, best_val)
+
         if outputMatchResult and best_pos:
             cv2.imwrite("origin.png", screenImage)
             screenshot_copy = screenImage.copy()
@@ -1854,17 +3218,177 @@ def Factory():
             logger.trace(f"[CheckIf] 多模板匹配: 選擇 {best_template_name} (匹配度 {best_val*100:.2f}%)")
 
         return best_pos
-    def CheckIf_MultiRect(screenImage, shortPathOfTarget):
-        template = LoadTemplateImage(shortPathOfTarget)
-        screenshot = screenImage
-        result = cv2.matchTemplate(screenshot, template, cv2.TM_CCOEFF_NORMED)
+    def CheckRuleTemplates(screen, templates, region, threshold):
+        """狀態規則的模板比對（RuleSet.run 的 check）：'combatActive*' 之類的名稱展開為所有變體"""
+        targets = [variant for name in templates for variant in (get_multi_templates(name) if '*' in name else [name])]
+        return CheckIfAny(screen, targets, roi=region, threshold=threshold)
 
-        threshold = 0.8
-        ys, xs = np.where(result >= threshold)
-        h, w = template.shape[:2]
+    def CheckIfAny(screenImage, targets, roi = None, threshold = None):
+        """依序檢查多個目標，返回第一個匹配的目標（等同逐一呼叫 CheckIf，但各目標在比對線程池中並行比對）
+
+        Returns:
+            tuple: (目標名稱, 位置)，都沒有匹配時返回 (None, None)
+        """
+        found = [None, None]
+
+        def done(index, pos):
+            if pos:
+                found[0], found[1] = targets[index], pos
+                return True
+            return False
+
+        _RunMatches(lambda target: CheckIf(screenImage, target, roi=roi, threshold=threshold), targets, done)
+        return tuple(found)
+
+    def _RuleTemplates(name):
+        return get_combat_active_templates() if name == 'combatActive' else get_multi_templates(name)
+
+    def _TransitionContext():
+        """目前所在的狀態（轉移統計的「前一狀態」）"""
+        return f"{MonitorState.current_state or '-'}/{MonitorState.current_dungeon_state or '-'}"
+
+    def ClassifyScreen(screen, rules=SCREEN_RULES, skip=(), start=0, result=None):
+        """單次畫面分類：依優先順序評估規則，第一個達到閾值的規則即停止
+
+        所有規則共用同一張畫面（不複製）與各模板學到的搜索區域。
+        處理完命中規則後若需要繼續往下判斷，傳入 start=result['index'] + 1
+        與原本的 result 即可接續。
+
+        完整分類（SCREEN_RULES 從頭開始）時:
+            1. 先查 pHash 快取：相近的畫面之前分類為靜態畫面（SCREEN_CACHEABLE_RULES）時，
+               只重新確認那一條規則，成立即返回。
+            2. 依轉移統計（目前狀態 → 下一個畫面）先比對最可能的規則，達到 SCREEN_PRIOR_CONFIDENT
+               且 SCREEN_RULE_GUARDS 中的較高優先規則都沒有命中時提早結束；結果與依序比對相同。
+            3. 否則依序比對（已比對過的規則直接沿用分數）。
+
+        Returns:
+            dict: {
+                'match':  命中的規則名稱（沒有則為 None）,
+                'pos':    命中位置（模板中心的螢幕座標）,
+                'score':  命中的匹配度 (0-100),
+                'index':  命中規則在 rules 中的索引,
+                'scores': {規則名稱: 匹配度}，只含評估過的規則,
+                'elapsed_ms': 累計分類耗時,
+            }
+        """
+        classify_start = time.time()
+        full_classify = rules is SCREEN_RULES and start == 0 and result is None
+        use_cache = full_classify and screen_cache.enabled
+        if result is None:
+            result = {'match': None, 'pos': None, 'score': 0, 'index': -1, 'scores': {}, 'elapsed_ms': 0.0}
+        else:
+            result.update({'match': None, 'pos': None, 'score': 0, 'index': -1})
+        quest_key = getattr(setting, '_FARMTARGET', None) or '-'
+        context = _TransitionContext()
+        evaluated = {}  # 規則索引 -> (best_val, best_pos)
+        templates_used = 0
+
+        def evaluate(index):
+            nonlocal templates_used
+            name, threshold = rules[index]
+            check_stop_signal()
+            templates = _RuleTemplates(name)
+            templates_used += len(templates)
+            best_val, best_pos, _ = _BestMatch(screen, templates, None, threshold)
+            result['scores'][name] = int(best_val * 100)
+            _UpdateFlagMonitor(name, best_val)
+            evaluated[index] = (best_val, best_pos)
+            return best_val, best_pos
+
+        def finish(source):
+            elapsed_ms = (time.time() - classify_start) * 1000
+            result['elapsed_ms'] += elapsed_ms
+            latency_tracker.add('classify_cached' if source == 'cache' else 'classify', elapsed_ms)
+            _RecordMatchLatency(screen)
+            # 依固定順序比對到命中規則（或全部規則）需要的模板數
+            last = result['index'] if result['match'] else len(rules) - 1
+            baseline = sum(len(_RuleTemplates(rules[i][0])) for i in range(start, last + 1) if rules[i][0] not in skip)
+            _classify_stats['count'] += 1
+            _classify_stats['templates'] += templates_used
+            _classify_stats['baseline'] += baseline
+            if full_classify:
+                screen_transitions.record(quest_key, context, result['match'])
+            MonitorState.screen_scores = dict(result['scores'])
+            MonitorState.screen_match = result['match'] or ""
+            logger.trace(f"[畫面分類] {result['match']} ({result['score']}%) 耗時 {elapsed_ms:.0f} ms, "
+                         f"評估 {len(result['scores'])} 條規則 / {templates_used} 個模板 ({source})")
+            return elapsed_ms
+
+        if use_cache:
+            phash = FramePHash(screen)
+            skip_key = frozenset(skip)
+            cache_key, cached = screen_cache.lookup(phash, skip_key)
+            if cached is not None:
+                index = cached['index']
+                name, threshold = rules[index]
+                best_val, best_pos = evaluate(index)
+                if best_val >= threshold:
+                    result.update({'match': name, 'pos': best_pos, 'score': int(best_val * 100), 'index': index})
+                    screen_cache.record_hit(cached['elapsed_ms'] - finish('cache'))
+                    return result
+                screen_cache.discard(cache_key)
+
+        source = 'cascade'
+        if full_classify:
+            for name, _ in screen_transitions.predict(quest_key, context):
+                index = SCREEN_RULE_INDEX.get(name)
+                if index is None or name in skip:
+                    continue
+                threshold = rules[index][1]
+                best_val, best_pos = evaluated[index] if index in evaluated else evaluate(index)
+                if best_val < max(threshold, SCREEN_PRIOR_CONFIDENT):
+                    continue
+                guards = SCREEN_RULE_GUARDS.get(name)
+                guard_indices = range(index) if guards is None else [
+                    SCREEN_RULE_INDEX[g] for g in guards if SCREEN_RULE_INDEX.get(g, index) < index]
+                if any(rules[g][0] not in skip and (evaluated[g] if g in evaluated else evaluate(g))[0] >= rules[g][1]
+                       for g in guard_indices):
+                    break  # 較高優先的規則命中：交給依序比對決定
+                result.update({'match': name, 'pos': best_pos, 'score': int(best_val * 100), 'index': index})
+                _classify_stats['prior_hits'] += 1
+                source = 'prior'
+                break
+
+        if result['match'] is None:
+            for index in range(start, len(rules)):
+                name, threshold = rules[index]
+                if name in skip:
+                    continue
+                best_val, best_pos = evaluated[index] if index in evaluated else evaluate(index)
+                if best_val >= threshold:
+                    result.update({'match': name, 'pos': best_pos, 'score': int(best_val * 100), 'index': index})
+                    break
+
+        elapsed_ms = finish(source)
+        if use_cache and result['match'] in SCREEN_CACHEABLE_RULES:
+            screen_cache.store(phash, skip_key, result['index'], elapsed_ms)
+        return result
+
+    def CheckIf_MultiRect(screenImage, shortPathOfTarget):
+        template = template_registry.entry(shortPathOfTarget)
+        if template is None:
+            return []
+        results = _MemoResults(screenImage)
+        screenshot, _ = _MatchArea(screenImage, None, template['mode'], results)
+
+        threshold = template['threshold'] or 0.8
+        h, w = template['shape'][:2]
+        locations = None
+        if template['pyramid'] is not None:
+            # [優化] 金字塔比對：只在粗比對找到的候選區塊內做原解析度比對
+            small, _ = _MatchArea(screenImage, None, template['mode'], results, template['pyramid'])
+            locations = PyramidMatchAll(screenshot, small, template['match'], template['match_small'], template['pyramid'],
+                                        threshold, template['match_mask'], template['match_small_mask'])
+        if locations is None:
+            if template['match_mask'] is not None:
+                result = cv2.matchTemplate(screenshot, template['match'], cv2.TM_CCOEFF_NORMED, mask=template['match_mask'])
+            else:
+                result = cv2.matchTemplate(screenshot, template['match'], cv2.TM_CCOEFF_NORMED)
+            ys, xs = np.where(result >= threshold)
+            locations = zip(xs, ys)
         rectangles = list([])
 
-        for (x, y) in zip(xs, ys):
+        for (x, y) in locations:
             rectangles.append([x, y, w, h])
             rectangles.append([x, y, w, h]) # 複製兩次, 這樣groupRectangles可以保留那些單獨的矩形.
         rectangles, _ = cv2.groupRectangles(rectangles, groupThreshold=1, eps=0.5)
@@ -1889,18 +3413,13 @@ def Factory():
             if max_val<=0.9:
                 logger.trace(f"[CheckIf_FocusCursor] {shortPathOfTarget} 邊界值 (80-90%)")
 
-            cropped = screenshot[max_loc[1]:max_loc[1]+template.shape[0], max_loc[0]:max_loc[0]+template.shape[1]]
             SIZE = 15 # size of cursor 光標就是這麼大
             left = (template.shape[1] - SIZE) // 2
             right =  left+ SIZE
             top = (template.shape[0] - SIZE) // 2
             bottom =  top + SIZE
-            midimg_scn = cropped[top:bottom, left:right]
-            miding_ptn = template[top:bottom, left:right]
-            # cv2.imwrite("miding_scn.png", midimg_scn)
-            # cv2.imwrite("miding_ptn.png", miding_ptn)
-            gray1 = cv2.cvtColor(midimg_scn, cv2.COLOR_BGR2GRAY)
-            gray2 = cv2.cvtColor(miding_ptn, cv2.COLOR_BGR2GRAY)
+            gray1 = FrameGray(screenImage, (max_loc[0] + left, max_loc[1] + top, SIZE, SIZE))
+            gray2 = template_registry.entry(shortPathOfTarget)['gray'][top:bottom, left:right]
             mean_diff = cv2.absdiff(gray1, gray2).mean()/255
             logger.trace(f"[CheckIf_FocusCursor] 中心匹配:{mean_diff:.2f}")
 
@@ -2012,18 +3531,41 @@ def Factory():
             logger.info(f"快進未開啓, 即將開啓.{pos}")
             return pos
         return None
+    def _StreamInput(action):
+        """串流可用且有控制通道時，經由 scrcpy 控制通道注入輸入
+
+        Returns:
+            bool: True 表示已送出；False 表示需退回 adb shell
+        """
+        if replay_source is not None:
+            return True  # 回放模式不送出任何輸入
+        stream = get_scrcpy_stream()
+        if not (stream and stream.is_available() and stream.supports_control()):
+            return False
+        try:
+            action(stream)
+            return True
+        except Exception as e:
+            logger.warning(f"[輸入] scrcpy 控制通道失敗: {e}，改用 ADB 輸入")
+            return False
     def Press(pos):
         if pos!=None:
-            DeviceShell(f"input tap {pos[0]} {pos[1]}")
+            _RecordInput('press', pos=list(pos))
+            if not _StreamInput(lambda stream: stream.tap(pos[0], pos[1])):
+                InputShell(f"input tap {pos[0]} {pos[1]}")
             return True
         return False
     def Swipe(start, end, duration=300):
         if start and end:
-            DeviceShell(f"input swipe {start[0]} {start[1]} {end[0]} {end[1]} {duration}")
+            _RecordInput('swipe', start=list(start), end=list(end), duration=duration)
+            if not _StreamInput(lambda stream: stream.swipe(start, end, duration)):
+                InputShell(f"input swipe {start[0]} {start[1]} {end[0]} {end[1]} {duration}")
             return True
         return False
     def PressReturn():
-        DeviceShell('input keyevent KEYCODE_BACK')
+        _RecordInput('key', key='KEYCODE_BACK')
+        if not _StreamInput(lambda stream: stream.key(stream.KEYCODE_BACK)):
+            InputShell('input keyevent KEYCODE_BACK')
     def WrapImage(image,r,g,b):
         scn_b = image * np.array([b, g, r])
         return np.clip(scn_b, 0, 255).astype(np.uint8)
@@ -2036,6 +3578,217 @@ def Factory():
             logger.info("發現並點擊了\"重試\". 你遇到了網絡波動.")
             return True
         return False
+
+    # ---------- 視覺線程 ----------
+    VISION_MAX_AGE = 1.0  # 視覺線程的結果超過此秒數視為過期，改在呼叫端線程偵測
+    VISION_INTERVALS = {  # 各偵測器的最短間隔（秒）
+        'rise_again': 0.2,
+        'retry': 0.3,
+        'flags': 0.5,
+        'low_hp': 0.5,
+        'abnormal_status': 1.0,
+    }
+
+    def _VisionFrame(after_seq, timeout):
+        """視覺線程取幀：等待比 after_seq 新的串流幀（尺寸需要補邊或旋轉的幀交給 ScreenShot，不處理）"""
+        stream = get_scrcpy_stream()
+        if stream is None or not stream.is_available():
+            time.sleep(timeout)
+            return None
+        latest = stream.wait_for_frame(after_seq, timeout)
+        if latest is None:
+            return None
+        seq, timestamp, frame = latest
+        if frame.shape[:2] != (1600, 900):
+            return seq, timestamp, None
+        return seq, timestamp, FrameContext.wrap(frame, ('stream', seq))
+
+    def _VisionThreadInit():
+        # 比對在視覺線程內依序執行，停止檢查只拋出 _MatchCancelled（不在背景線程觸發重啟流程）
+        _match_local.cancel = threading.Event()
+
+    def _VisionFlags(frame):
+        """監控面板的 Flag 相似度 (0-100)"""
+        scores = {}
+        for name, (template, _) in VISION_FLAGS.items():
+            templates = get_multi_templates(template) if '*' in template else [template]
+            scores[name] = max((GetMatchValue(frame, t) for t in templates), default=0)
+        now = time.time()
+        for name, score in scores.items():
+            setattr(MonitorState, VISION_FLAGS[name][1], score)
+            MonitorState.flag_updates[name] = now
+        return scores
+
+    def _VisionLowHP(frame):
+        MonitorState.flag_low_hp = CheckLowHP(frame)
+        return MonitorState.flag_low_hp
+
+    def _StartVisionWorker():
+        """串流可用時啟動視覺線程：在背景對每個新幀執行偵測器，結果發布到 vision_bus
+
+        Farm 開始時串流已可用就直接呼叫；否則由串流監管線程在串流恢復時呼叫（stream.on_healthy）。
+        """
+        nonlocal vision_worker
+        with vision_lock:
+            if not vision_allowed or vision_worker is not None or not getattr(setting, '_VISION_WORKER', True):
+                return
+            vision_worker = VisionWorker(vision_bus, _VisionFrame, thread_init=_VisionThreadInit, cancelled=(_MatchCancelled,))
+            vision_worker.register('rise_again', lambda frame: bool(CheckIf(frame, 'RiseAgain')), VISION_INTERVALS['rise_again'])
+            vision_worker.register('retry', lambda frame: bool(CheckIf(frame, 'retry') or CheckIf(frame, 'retry_blank')), VISION_INTERVALS['retry'])
+            vision_worker.register('flags', _VisionFlags, VISION_INTERVALS['flags'])
+            vision_worker.register('low_hp', _VisionLowHP, VISION_INTERVALS['low_hp'])
+            vision_worker.register('abnormal_status', lambda frame: tuple(CheckAbnormalStatus(frame, setting)[1]), VISION_INTERVALS['abnormal_status'])
+            vision_worker.start()
+
+    def _EnableVisionWorker(stream):
+        """Farm 開始時呼叫：允許啟動視覺線程，串流之後（重新）可用時由監管線程啟動"""
+        nonlocal vision_allowed
+        with vision_lock:
+            vision_allowed = True
+        if stream:
+            stream.on_healthy = _StartVisionWorker
+
+    def _StopVisionWorker():
+        nonlocal vision_worker, vision_allowed
+        stream = get_scrcpy_stream()
+        if stream and stream.on_healthy is _StartVisionWorker:
+            stream.on_healthy = None
+        with vision_lock:
+            vision_allowed = False
+            worker, vision_worker = vision_worker, None
+        if worker is not None:
+            worker.stop()
+
+    def VisionActive():
+        """視覺線程是否在運行（否則狀態處理函數需要自己偵測）"""
+        return vision_worker is not None and vision_worker.running
+
+    def VisionValue(kind, compute, screen):
+        """視覺線程有新鮮的結果時直接使用，否則在目前線程計算 compute(screen)
+
+        Args:
+            kind: 偵測器名稱 ('rise_again', 'retry', 'flags', 'low_hp', 'abnormal_status')
+            compute: 視覺線程沒有結果時的偵測函數
+            screen: 目前的截圖
+        """
+        if VisionActive():
+            event = vision_bus.latest(kind, max_age=VISION_MAX_AGE)
+            if event is not None:
+                return event.value
+        return compute(screen)
+
+    def PressRetryIfSeen(screen):
+        """視覺線程確認畫面上沒有 Retry 時略過比對，否則（或視覺線程未運行）等同 TryPressRetry"""
+        if not VisionValue('retry', lambda _: True, screen):
+            return False
+        return TryPressRetry(screen)
+
+    def WaitForChangeOrEvent(reference, events, threshold=0.02, roi=None, timeout=0.5, min_interval=0.0):
+        """等待畫面相對於參考幀發生變化，或訂閱的視覺事件發生，先發生者為準
+
+        視覺線程沒有運行時等同 WaitForChange。
+        min_interval 只延後畫面變化的返回（同 WaitForChange），事件仍立即返回。
+
+        Args:
+            events: vision_bus.subscribe() 返回的訂閱
+        Returns:
+            tuple: (最新截圖, 事件或 None)
+        """
+        if not VisionActive():
+            return WaitForChange(reference, threshold=threshold, roi=roi, timeout=timeout, min_interval=min_interval), None
+        start = time.time()
+        deadline = start + timeout
+        changed = False
+        while True:
+            check_stop_signal()
+            event = events.get()
+            now = time.time()
+            if event is not None or now >= deadline or (changed and now >= start + min_interval):
+                return ScreenShot(), event
+            if changed:
+                # 畫面已變化，只剩事件需要即時處理
+                Sleep(min(0.1, start + min_interval - now))
+                continue
+            screen = WaitForChange(reference, threshold=threshold, roi=roi, timeout=min(0.1, deadline - now))
+            if reference is None or frame_diff_ratio(reference, screen, roi) > threshold:
+                if time.time() >= start + min_interval:
+                    return screen, events.get()
+                changed = True
+
+    AWAIT_POLL = 0.3  # TapAndAwait 畫面靜止時重新檢查的間隔（秒）
+
+    def TapAndAwait(target, appear=None, disappear=None, change_roi=None, change_threshold=0.02,
+                    timeout=3.0, retries=0, screen=None, threshold=None, handle_retry=False):
+        """點擊目標後等待效果出現，觀察到效果就立即返回（取代 Press + 固定 Sleep + 截圖檢查）
+
+        效果（任一成立即返回）:
+            appear:     模板出現（名稱或列表，任一出現即可）
+            disappear:  模板消失（名稱或列表，全部消失）
+            change_roi: 此區域 [x, y, w, h] 的畫面相對於點擊前發生變化；
+                        沒有指定 appear / disappear 時預設等待整個畫面變化
+
+        Args:
+            target: [x, y] 座標、模板名稱（在點擊前的畫面上尋找）、無參數的函數（例如 PressReturn）
+                    或 None（不點擊，只等待效果；此時第一張畫面就會檢查）
+            timeout: 每次點擊後最長等待秒數
+            retries: 超時後重新點擊的次數
+            screen: 點擊前的截圖（沒有則重新截圖）
+            threshold: appear / disappear 的比對閾值（預設使用比對清單或 0.80）
+            handle_retry: 等待期間出現網路 Retry 時點擊重試並延長等待
+        Returns:
+            tuple: (最新截圖, 效果)；效果為出現的模板位置、True（消失或畫面變化），
+                   超時或找不到點擊目標時為 None
+        """
+        appear = [appear] if isinstance(appear, str) else list(appear or [])
+        disappear = [disappear] if isinstance(disappear, str) else list(disappear or [])
+        watch_change = change_roi is not None or not (appear or disappear)
+
+        def observed(scn, before):
+            for name in appear:
+                if pos := CheckIf(scn, name, threshold=threshold):
+                    return pos
+            if disappear and not any(CheckIf(scn, name, threshold=threshold) for name in disappear):
+                return True
+            if watch_change and before is not None and frame_diff_ratio(before, scn, change_roi) > change_threshold:
+                return True
+            return None
+
+        scn = screen
+        for attempt in range(retries + 1):
+            check_stop_signal()
+            if scn is None:
+                scn = ScreenShot()
+            before = scn
+            if target is None:
+                before = None
+                if effect := observed(scn, before):
+                    return scn, effect
+            elif callable(target):
+                target()
+            else:
+                pos = CheckIf(scn, target) if isinstance(target, str) else target
+                if not pos:
+                    logger.debug(f"[TapAndAwait] 找不到點擊目標 {target}")
+                    return scn, None
+                Press(pos)
+
+            deadline = time.time() + timeout
+            while True:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                # 畫面有變化就立即檢查，靜止時每 AWAIT_POLL 秒檢查一次
+                scn = WaitForChange(scn, timeout=min(AWAIT_POLL, remaining))
+                if handle_retry and PressRetryIfSeen(scn):
+                    Sleep(2)
+                    deadline += 2
+                    scn = ScreenShot()
+                    continue
+                if effect := observed(scn, before):
+                    return scn, effect
+            if attempt < retries:
+                logger.debug(f"[TapAndAwait] 點擊 {target} 後 {timeout} 秒內沒有效果，重試 ({attempt + 1}/{retries})")
+        return scn, None
     def AddImportantInfo(str):
         nonlocal runtimeContext
         if runtimeContext._IMPORTANTINFO == "":
@@ -2100,7 +3853,8 @@ def Factory():
                             logger.debug("錯誤: 非法的目標.")
                             setting._FORCESTOPING.set()
                             return None
-                Sleep(waitTime) # and wait
+                # and wait：目標一出現就進入下一輪，最多等 waitTime 秒
+                TapAndAwait(None, appear=targetPattern, timeout=waitTime)
 
             logger.info(f"{runtimeContext._MAXRETRYLIMIT}次截圖依舊沒有找到目標{targetPattern}, 疑似卡死. 重啓遊戲.")
             Sleep()
@@ -2128,6 +3882,9 @@ def Factory():
             
         package_name = "jp.co.drecom.wizardry.daphne"
         while not (setting._FORCESTOPING and setting._FORCESTOPING.is_set()):
+            if replay_source is not None:
+                logger.debug("[GameMonitor] 回放模式，監控線程結束")
+                return
             try:
                 # 1. 檢查進程是否存在
                 result = setting._ADBDEVICE.shell(f"pidof {package_name}", timeout=3)
@@ -2165,6 +3922,8 @@ def Factory():
             grace_period: 寬限期（秒）
         """
         nonlocal _game_monitor_thread
+        if replay_source is not None:
+            return  # 回放模式沒有遊戲進程可監控
         # 確保 Event 存在
         if not hasattr(setting, '_GAME_CRASHED'):
             setting._GAME_CRASHED = Event()
@@ -2181,6 +3940,9 @@ def Factory():
 
     def restartGame(skipScreenShot = False):
         nonlocal runtimeContext
+        if replay_source is not None:
+            # 回放模式：重啟遊戲 / 模擬器會接觸真實設備，改為結束回放
+            _EndReplay("回放中觸發重啟遊戲")
         runtimeContext._IN_RESTART = True # [關鍵] 標記開始重啟
         if hasattr(setting, '_GAME_CRASHED'):
             setting._GAME_CRASHED.clear() # 啟動前先清除
@@ -2242,6 +4004,7 @@ def Factory():
         process_found = False
         
         while waited < max_wait:
+            MonitorState.mark_progress()  # 等待遊戲載入最多 180 秒，期間維持多開心跳
             # 1. 基礎進程檢查
             try:
                 pid_result = DeviceShell(f"pidof {package_name}")
@@ -2427,7 +4190,7 @@ def Factory():
                 return
             if CSC_symbol != None:
                 FindCoordsOrElseExecuteFallbackAndWait(CSC_symbol,'CSC',1)
-                last_scn = CutRoI(ScreenShot(), [[77,349,757,1068]])
+                last_scn = CutRoI(ScreenShot().copy(), [[77,349,757,1068]])
                 # 先關閉所有因果
                 csc_swipe_count = 0
                 while csc_swipe_count < MAX_CSC_SWIPES:
@@ -2442,7 +4205,7 @@ def Factory():
                     Press(CheckIf(WrapImage(ScreenShot(),2,0,0),'didnottakethequest'))
                     DeviceShell(f"input swipe 150 500 150 400")
                     Sleep(1)
-                    scn = CutRoI(ScreenShot(), [[77,349,757,1068]])
+                    scn = CutRoI(ScreenShot().copy(), [[77,349,757,1068]])
                     logger.debug(f"因果: 滑動後的截圖誤差={cv2.absdiff(scn, last_scn).mean()/255:.6f}")
                     if cv2.absdiff(scn, last_scn).mean()/255 < 0.006:
                         break
@@ -2453,7 +4216,7 @@ def Factory():
                     logger.warning(f"因果關閉循環超過 {MAX_CSC_SWIPES} 次，強制退出")
                 # 然後調整每個因果
                 if CSC_setting!=None:
-                    last_scn = CutRoI(ScreenShot(), [[77,349,757,1068]])
+                    last_scn = CutRoI(ScreenShot().copy(), [[77,349,757,1068]])
                     csc_adjust_count = 0
                     while csc_adjust_count < MAX_CSC_SWIPES:
                         if setting._FORCESTOPING and setting._FORCESTOPING.is_set():
@@ -2469,7 +4232,7 @@ def Factory():
                             Sleep(1)
                         DeviceShell(f"input swipe 150 400 150 500")
                         Sleep(1)
-                        scn = CutRoI(ScreenShot(), [[77,349,757,1068]])
+                        scn = CutRoI(ScreenShot().copy(), [[77,349,757,1068]])
                         logger.debug(f"因果: 滑動後的截圖誤差={cv2.absdiff(scn, last_scn).mean()/255:.6f}")
                         if cv2.absdiff(scn, last_scn).mean()/255 < 0.006:
                             break
@@ -2501,14 +4264,19 @@ def Factory():
     def IdentifyState():
         nonlocal setting # 修改因果
         counter = 0
+        screen = None
+        state_check_start = 0.0
         while 1:
             check_stop_signal()  # 每次迭代開始時檢查停止信號
-            # [串流優化] 節流延遲，避免檢測太快導致遊戲來不及響應
+            # [串流優化] 節流：等待畫面更新（首輪等新幀，之後等畫面變化），最多 500ms
+            # 畫面持續變化（移動、動畫）時每一幀都算變化，仍保留兩次檢測之間至少 500ms，
+            # 避免檢測太快導致遊戲來不及響應
             if PYSCRCPY_AVAILABLE:
-                Sleep(0.5)  # 串流模式下每次檢測間隔 500ms
+                screen = WaitForChange(screen, timeout=0.5, min_interval=0.5 - (time.time() - state_check_start))
+            else:
+                screen = ScreenShot()
             
             state_check_start = time.time()
-            screen = ScreenShot()
             logger.debug(f'狀態機檢查中...(第{counter+1}次)')
 
             if setting._FORCESTOPING.is_set():
@@ -2585,52 +4353,14 @@ def Factory():
                 # 如果都沒找到，看看是否在移動中（不應該立即返回 Dungeon 狀態）
                 logger.debug(f"哈肯樓層選擇: 未找到 {floor_target} 或 returnText，繼續等待...")
 
-            # [Optimization] 預先計算 combatActive (戰鬥偵測)
-            # 這是最耗時的部分，透過只計算一次並同時用於 Monitor 和 邏輯判斷 來優化效能
-            combat_templates = get_combat_active_templates()
-            max_combat_val = 0
-            best_combat_pos = None
-            
-            if combat_templates:
-                for t in combat_templates:
-                    # 停止信號檢查：在遍歷模板時確保能快速響應停止請求
-                    check_stop_signal()
-
-                    template = _get_cached_template(t)
-                    if template is None: continue
-                    
-                    try:
-                        # [修復] 支援技能圖片的透明遮罩比對
-                        is_skill = "spellskill" in t
-                        if is_skill and len(template.shape) == 3 and template.shape[2] == 4:
-                            tpl_bgr = template[:, :, :3]
-                            tpl_mask = template[:, :, 3]
-                            res = cv2.matchTemplate(screen, tpl_bgr, cv2.TM_CCOEFF_NORMED, mask=tpl_mask)
-                        else:
-                            # 即使是 4 通道，如果不是技能圖或一般比對，也只取 BGR
-                            if len(template.shape) == 3 and template.shape[2] == 4:
-                                tpl_bgr = template[:, :, :3]
-                                res = cv2.matchTemplate(screen, tpl_bgr, cv2.TM_CCOEFF_NORMED)
-                            else:
-                                res = cv2.matchTemplate(screen, template, cv2.TM_CCOEFF_NORMED)
-
-                        _, val, _, loc = cv2.minMaxLoc(res)
-                        if val > max_combat_val:
-                            max_combat_val = val
-                            best_combat_pos = [loc[0] + template.shape[1]//2, loc[1] + template.shape[0]//2]
-                    except Exception as e:
-                        logger.trace(f"[IdentifyState] 戰鬥模板 {t} 比對異常: {e}")
-                        continue
-            
-
-            MonitorState.flag_combatActive = int(max_combat_val * 100)
-            MonitorState.flag_updates['combatActive'] = time.time()
-
+            # [單次分類] 依優先順序評估整組規則（戰鬥 → 復活 → 寶箱 → 地城 → 城鎮/世界地圖），第一個命中即停止
+            # 設定了哈肯樓層目標時，returnText 已由上方處理，也不走回城流程
+            skip_rules = ('returnText', 'returntoTown') if runtimeContext._HARKEN_FLOOR_TARGET is not None else ()
+            classification = ClassifyScreen(screen, skip=skip_rules)
+            matched = classification['match']
 
-            # 如果預先計算發現是戰鬥狀態 (>0.7)，直接返回，不用再跑後面的迴圈
-            if max_combat_val >= 0.70:
-                 elapsed_ms = (time.time() - state_check_start) * 1000
-                 logger.debug(f"[狀態識別] 匹配成功(預計算): combatActive -> Combat (耗時 {elapsed_ms:.0f} ms)")
+            if matched == 'combatActive':
+                 logger.debug(f"[狀態識別] 匹配成功: combatActive -> Combat (分類耗時 {classification['elapsed_ms']:.0f} ms)")
                  
                  if not runtimeContext._DUNGEON_CONFIRMED:
                      runtimeContext._DUNGEON_CONFIRMED = True
@@ -2641,13 +4371,13 @@ def Factory():
                  return State.Dungeon, DungeonState.Combat, screen
 
             # [Fix] 檢查復活相關狀態 (恢復原Upstream順序: 戰鬥檢測後)
-            if CheckIf(screen, 'RiseAgain'):
+            if matched == 'RiseAgain':
                 logger.info("[狀態識別] 偵測到 RiseAgain")
                 RiseAgainReset(reason='combat')
                 counter += 1
                 continue
 
-            if CheckIf(screen, 'someonedead'):
+            if matched == 'someonedead':
                 AddImportantInfo("他們活了,活了!")
                 runtimeContext._COUNTERDEATH += 1
                 MonitorState.death_count = runtimeContext._COUNTERDEATH
@@ -2658,19 +4388,15 @@ def Factory():
                 # 點擊後繼續循環，重新截圖判斷狀態
                 continue
 
-            # 偵測到 AUTO 時，持續點擊直到消失
-            MonitorState.flag_auto_text = GetMatchValue(screen, 'AUTO')
-            MonitorState.flag_updates['AUTO'] = time.time()
-            if MonitorState.flag_auto_text >= 70: # 門檻降低至 70
+            # 偵測到 AUTO 時，持續點擊直到消失（門檻 70，分類時已更新 flag_auto_text）
+            if matched == 'AUTO':
                 logger.info("[AUTO] 偵測到 AUTO，開始連續點擊")
                 click_count = 0
                 while click_count < 5:
                     if setting._FORCESTOPING and setting._FORCESTOPING.is_set():
                         return State.Quit, DungeonState.Quit, screen
-                    # 連點 3 下清戰利品
-                    for _ in range(3):
-                        Press([1, 1])
-                        Sleep(0.05)
+                    # 連點 3 下清戰利品（一次送出）
+                    PressBatch([[1, 1]] * 3, interval=0.05)
                     Sleep(0.1)
                     shot_start = time.time()
                     screen = ScreenShot()
@@ -2731,6 +4457,9 @@ def Factory():
                             else:
                                 logger.debug("[AUTO] 低血量檢查: 未偵測到低血量")
 
+                        # 畫面已換成新截圖，從 AUTO 之後的規則接續分類
+                        classification = ClassifyScreen(screen, skip=skip_rules, start=classification['index'] + 1)
+                        matched = classification['match']
                         break
                     click_count += 1
                 else:
@@ -2819,13 +4548,12 @@ def Factory():
                     # NOTE: 當 ACTIVE_CSC 關閉或設定為 0 時，不主動選擇善惡選項
                     
                     if not found_any_option:
-                        for op in dialogOption:
-                            if Press(CheckIf(screen, op)):
-                                logger.info(f"[AUTO] 偵測到對話選項 {op}，點擊處理")
-                                Sleep(2)
-                                counter += 1
-                                found_any_option = True
-                                break
+                        op, pos = CheckIfAny(screen, dialogOption)
+                        if Press(pos):
+                            logger.info(f"[AUTO] 偵測到對話選項 {op}，點擊處理")
+                            Sleep(2)
+                            counter += 1
+                            found_any_option = True
                     
                     if found_any_option:
                         continue
@@ -2837,58 +4565,39 @@ def Factory():
                     counter += 1
                     continue
 
-            # 移除 combatActive 相關的配置，因為上面已經檢查過了
-            identifyConfig = [
-                ('chestFlag',     DungeonState.Chest),   # 寶箱優先
-                ('whowillopenit', DungeonState.Chest),   # 寶箱優先
-                ('dungFlag',      DungeonState.Dungeon),
-                ('mapFlag',       DungeonState.Map),
-                ]
-
-            for pattern, state in identifyConfig:
-                # combatActive 和 dungFlag 使用較低閾值（串流品質問題）
-                if pattern.startswith('combatActive'):
-                    result = CheckIf(screen, pattern, threshold=0.70)
-                elif pattern == 'dungFlag':
-                    result = CheckIf(screen, pattern, threshold=0.75)
-                else:
-                    result = CheckIf(screen, pattern)
-                if result:
-                    elapsed_ms = (time.time() - state_check_start) * 1000
-                    logger.debug(f"[狀態識別] 匹配成功: {pattern} -> {state} (耗時 {elapsed_ms:.0f} ms)")
-                    # 如果設置了樓層選擇但檢測到 dungFlag，不要立即返回，繼續等待傳送完成
-                    if runtimeContext._HARKEN_FLOOR_TARGET is not None and pattern == 'dungFlag':
-                        logger.debug(f"哈肯樓層選擇: 檢測到 dungFlag 但正在等待傳送，繼續等待...")
-                        continue
-                    # 確認已進入地城（用於黑屏偵測）
-                    if not runtimeContext._DUNGEON_CONFIRMED:
-                        runtimeContext._DUNGEON_CONFIRMED = True
-                        logger.info("[狀態識別] 已確認進入地城")
-                    
-                    if not runtimeContext._DUNGEON_CONFIRMED:
-                        runtimeContext._DUNGEON_CONFIRMED = True
-                        logger.info("[狀態識別] 已確認進入地城")
-                    
-                    MonitorState.current_state = "Dungeon"
-                    MonitorState.current_dungeon_state = state.name if state else None
-                    return State.Dungeon, state, screen
-
-            if CheckIf(screen,'someonedead'):
-                AddImportantInfo("他們活了,活了!")
-                runtimeContext._COUNTERDEATH += 1  # 增加死亡計數
-                MonitorState.death_count = runtimeContext._COUNTERDEATH
-                for _ in range(5):
-                    Press([400+random.randint(0,100),750+random.randint(0,100)])
-                    Sleep(1)
+            identifyConfig = {
+                'chestFlag':     DungeonState.Chest,   # 寶箱優先
+                'whowillopenit': DungeonState.Chest,   # 寶箱優先
+                'dungFlag':      DungeonState.Dungeon,
+                'mapFlag':       DungeonState.Map,
+                }
+
+            # 如果設置了樓層選擇但檢測到 dungFlag，不要立即返回，繼續等待傳送完成（接續判斷後面的規則）
+            if matched == 'dungFlag' and runtimeContext._HARKEN_FLOOR_TARGET is not None:
+                logger.debug(f"哈肯樓層選擇: 檢測到 dungFlag 但正在等待傳送，繼續等待...")
+                classification = ClassifyScreen(screen, skip=skip_rules, start=classification['index'] + 1, result=classification)
+                matched = classification['match']
+
+            if matched in identifyConfig:
+                state = identifyConfig[matched]
+                logger.debug(f"[狀態識別] 匹配成功: {matched} -> {state} (分類耗時 {classification['elapsed_ms']:.0f} ms)")
+                # 確認已進入地城（用於黑屏偵測）
+                if not runtimeContext._DUNGEON_CONFIRMED:
+                    runtimeContext._DUNGEON_CONFIRMED = True
+                    logger.info("[狀態識別] 已確認進入地城")
+                
+                MonitorState.current_state = "Dungeon"
+                MonitorState.current_dungeon_state = state.name if state else None
+                return State.Dungeon, state, screen
 
             # 正常的 returnText 和 returntoTown 處理（當沒有設置樓層選擇時）
             if runtimeContext._HARKEN_FLOOR_TARGET is None:
-                if Press(CheckIf(screen, "returnText")):
+                if matched == 'returnText' and Press(classification['pos']):
                     Sleep(2)
                     counter += 1
                     continue
 
-                if CheckIf(screen,"returntoTown"):
+                if matched == 'returntoTown':
                     if not should_skip_return_to_town():
                         # 回城
                         FindCoordsOrElseExecuteFallbackAndWait('Inn',['return',[1,1]],1)
@@ -2929,7 +4638,8 @@ def Factory():
 
 
 
-            if pos:=CheckIf(screen,"openworldmap"):
+            if matched == 'openworldmap':
+                pos = classification['pos']
                 if runtimeContext._DUNGEON_CONFIRMED:
                     runtimeContext._DUNGEON_CONFIRMED = False
                     logger.info("[狀態識別] 偵測到世界地圖，視為離開地城，回傳 Quit")
@@ -2975,7 +4685,7 @@ def Factory():
                     MonitorState.current_dungeon_state = None
                     return State.Dungeon, None, ScreenShot()
 
-            if CheckIf(screen,"RoyalCityLuknalia"):
+            if matched == 'RoyalCityLuknalia':
                 FindCoordsOrElseExecuteFallbackAndWait(['Inn','dungFlag'],['RoyalCityLuknalia',[1,1]],1)
                 if CheckIf(scn:=ScreenShot(),'Inn'):
                     MonitorState.current_state = "Inn"
@@ -2986,14 +4696,14 @@ def Factory():
                     MonitorState.current_dungeon_state = None
                     return State.Dungeon,None, screen
 
-            if CheckIf(screen,"fortressworldmap"):
+            if matched == 'fortressworldmap':
                 FindCoordsOrElseExecuteFallbackAndWait(['Inn','dungFlag'],['fortressworldmap',[1,1]],1)
                 if CheckIf(scn:=ScreenShot(),'Inn'):
                     return State.Inn,DungeonState.Quit, screen
                 elif CheckIf(scn,'dungFlag'):
                     return State.Dungeon,None, screen
 
-            if CheckIf(screen, "Deepsnow", threshold=0.7):
+            if matched == 'Deepsnow':
                 logger.info(f"[狀態識別] 發現 Deepsnow (低閾值觸發), 嘗試進入...")
                 FindCoordsOrElseExecuteFallbackAndWait(['Inn','dungFlag'],['Deepsnow',[1,1]],1)
                 if CheckIf(scn:=ScreenShot(),'Inn'):
@@ -3008,7 +4718,7 @@ def Factory():
             # [新增] 通用世界地圖處理 (放在特定城鎮判斷之後)
             # 這段邏輯是為了防止 openworldmap 判斷失敗時的長時間等待
             # 它模仿了 fallback 的縮放與確認邏輯，但改為在第一時間執行
-            if CheckIf(screen, "worldmapflag"):
+            if matched == 'worldmapflag':
                 if runtimeContext._DUNGEON_CONFIRMED:
                     runtimeContext._DUNGEON_CONFIRMED = False
                     logger.info("[狀態識別] 偵測到 worldmapflag，視為離開地城，回傳 Quit")
@@ -3061,7 +4771,7 @@ def Factory():
                         MonitorState.current_dungeon_state = None
                         return State.Dungeon, None, ScreenShot()
 
-            if (CheckIf(screen,'Inn')):
+            if matched == 'Inn':
                 return State.Inn, None, screen
 
             if quest._SPECIALFORCESTOPINGSYMBOL != None:
@@ -3178,14 +4888,14 @@ def Factory():
                     'dontGiveAntitoxin',
                     'pass',
                 ]
-                for op in dialogOption:
-                    if Press(CheckIf(screen, op)):
-                        Sleep(2)
-                        if op == 'adventurersbones':
-                            AddImportantInfo("購買了骨頭.")
-                        if op == 'halfBone':
-                            AddImportantInfo("購買了屍油.")
-                        return IdentifyState()
+                op, pos = CheckIfAny(screen, dialogOption)
+                if Press(pos):
+                    Sleep(2)
+                    if op == 'adventurersbones':
+                        AddImportantInfo("購買了骨頭.")
+                    if op == 'halfBone':
+                        AddImportantInfo("購買了屍油.")
+                    return IdentifyState()
                 
                 if (CheckIf(screen,'multipeopledead')):
                     runtimeContext._SUICIDE = True # 準備嘗試自殺
@@ -3244,8 +4954,8 @@ def Factory():
         t = time.time()
         if len(queue)==LENGTH:
             for i in range(1,LENGTH):
-                grayThis = cv2.cvtColor(queue[i], cv2.COLOR_BGR2GRAY)
-                grayLast = cv2.cvtColor(queue[i-1], cv2.COLOR_BGR2GRAY)
+                grayThis = FrameGray(queue[i])
+                grayLast = FrameGray(queue[i-1])
                 mean_diff = cv2.absdiff(grayThis, grayLast).mean()/255
                 totalDiff += mean_diff
             logger.info(f"卡死檢測耗時: {time.time()-t:.5f}秒")
@@ -3391,8 +5101,7 @@ def Factory():
         # 2. 自動補給（可選）
         if setting._AUTO_REFILL:
             FindCoordsOrElseExecuteFallbackAndWait('refilled', ['box', 'refill', 'OK', [1, 1]], 2)
-            Press([1, 1])
-            Sleep(2)
+            TapAndAwait([1, 1], disappear='refilled', timeout=2)
 
         # 3. 整理背包（可選）
         if setting._ORGANIZE_BACKPACK_ENABLED and setting._ORGANIZE_BACKPACK_COUNT > 0:
@@ -3401,14 +5110,12 @@ def Factory():
                 # StateOrganizeBackpack 內部已有 PressReturn 離開旅館
             except Exception as e:
                 logger.error(f"整理背包失敗: {e}")
-                for _ in range(3):
-                    PressReturn()
-                    Sleep(1)
+                # 最多返回 3 次，回到城鎮畫面即停止
+                TapAndAwait(PressReturn, appear='Inn', timeout=1, retries=2)
         else:
-            # 沒有整理背包時，在這裡離開旅館
+            # 沒有整理背包時，在這裡離開旅館，回到城鎮畫面即繼續
             logger.info("離開旅館")
-            PressReturn()
-            Sleep(2)
+            TapAndAwait(PressReturn, appear='Inn', timeout=2)
     @stoppable
     def StateEoT():
         MonitorState.current_state = "EoT"
@@ -3684,17 +5391,7 @@ def Factory():
             else:
                 # 找不到 next 時的固定座標保底
                 logger.info("[普攻] 找不到 next，使用固定座標保底")
-                Press([150, 750])
-                Sleep(0.1)
-                Press([300, 750])
-                Sleep(0.1)
-                Press([450, 750])
-                Sleep(0.1)
-                Press([550, 750])
-                Sleep(0.1)
-                Press([650, 750])
-                Sleep(0.1)
-                Press([750, 750])
+                PressBatch(ENEMY_FALLBACK_POSITIONS, interval=0.1)
                 Sleep(0.1)
             
             Sleep(0.5)
@@ -3813,17 +5510,7 @@ def Factory():
                 else:
                     # 如果找不到 next，使用固定座標
                     logger.info(f"[順序 {caster_type}] 找不到 next 按鈕，使用固定座標點擊敵人")
-                    Press([150, 750])
-                    Sleep(0.1)
-                    Press([300, 750])
-                    Sleep(0.1)
-                    Press([450, 750])
-                    Sleep(0.1)
-                    Press([550, 750])
-                    Sleep(0.1)
-                    Press([650, 750])
-                    Sleep(0.1)
-                    Press([750, 750])
+                    PressBatch(ENEMY_FALLBACK_POSITIONS, interval=0.1)
                     Sleep(0.1)
                 logger.info(f"[順序 {caster_type}] 等待技能動畫完成...")
                 Sleep(2)  # 增加等待時間，讓遊戲完成動畫並切換角色
@@ -4000,56 +5687,35 @@ def Factory():
         auto_btn_2 = CheckIf(scn, 'combatAuto_2', [[700, 1000, 200, 200]])
         is_manual_mode = auto_btn or auto_btn_2
         
+        # 搜尋技能按鈕：輕點 (1,1) 顯示技能欄，技能一出現就繼續
+        # CheckIf 內部會透過 get_multi_templates 自動掃描整個資料夾的所有技能
+        skill_start = time.time()
         if not is_manual_mode:
-            # 可能在自動戰鬥模式，需要打斷
+            # 可能在自動戰鬥模式，需要打斷（固定點 3 次，技能欄提早出現也要點完才能確實打斷）
             logger.info(f"[技能施放] 打斷自動戰鬥以顯示技能欄")
             for _ in range(3):
                 Press([1, 1])
                 Sleep(0.3)
-            Sleep(0.2)
-            scn = ScreenShot() # 打斷後必須重新截圖以搜尋技能
+            scn, skill_pos = TapAndAwait(None, appear=image_path, threshold=0.70, timeout=3.0)
         else:
-            # 輕點確保技能欄顯示 (如果已經是手動模式，通常不需要重新截圖，除非確定輕點會改變 UI)
-            Press([1, 1])
-            Sleep(0.2)
-            # 這裡不重新截圖，直接使用 scn (或在 0.2s 後重新截一次以保險，但為了性能我們嘗試直接用舊圖或短暫等待)
-            # 修正：實測點擊 (1,1) 後技能欄可能會有微小延遲，維持一次截圖
-            scn = ScreenShot()
-        
-        # 搜尋技能按鈕
-        # CheckIf 內部會透過 get_multi_templates 自動掃描整個資料夾的所有技能
-        skill_pos = None
-        for wait_skill in range(10):  # 最多等待 3 秒 (10 × 0.3s)
-            check_stop_signal()
-            scn = ScreenShot()
-            skill_pos = CheckIf(scn, image_path, threshold=0.70)
-            if skill_pos:
-                break
-            Sleep(0.3)
+            # 輕點確保技能欄顯示
+            scn, skill_pos = TapAndAwait([1, 1], appear=image_path, threshold=0.70, timeout=3.0, screen=scn)
         
         if skill_pos:
-            logger.info(f"[技能施放-DEBUG] 找到技能圖片 {image_path} 於 {skill_pos} (等待 {wait_skill} 次)")
+            logger.info(f"[技能施放-DEBUG] 找到技能圖片 {image_path} 於 {skill_pos} (等待 {time.time() - skill_start:.1f} 秒)")
             logger.info(f"[技能施放] 使用技能: {skill_name} ({category})")
-            Press(skill_pos)
             
             # 處理技能等級
             SKILL_LEVEL_X = {"LV2": 251, "LV3": 378, "LV4": 500, "LV5": 625}
             if level != "關閉" and level in SKILL_LEVEL_X:
-                # 輪詢等級選擇介面
-                lv1_pos = None
-                for wait_lv in range(10):  # 最多等待 3 秒 (10 × 0.3s)
-                    check_stop_signal()
-                    Sleep(0.3)
-                    scn = ScreenShot()
-                    lv1_pos = CheckIf(scn, 'spellskill/lv1', threshold=0.8)
-                    if lv1_pos:
-                        break
-                
+                # 點擊技能後等待等級選擇介面
+                scn, lv1_pos = TapAndAwait(skill_pos, appear='spellskill/lv1', threshold=0.8, timeout=3.0, screen=scn)
                 if lv1_pos:
-                    logger.info(f"[技能施放] 升級技能到 {level} (等待 {wait_lv} 次)")
-                    Press([SKILL_LEVEL_X[level], lv1_pos[1]])
-                    Sleep(0.3)
-                    scn = ScreenShot()
+                    logger.info(f"[技能施放] 升級技能到 {level}")
+                    # 等級選擇介面關閉後的畫面才能用來找 OK
+                    scn, _ = TapAndAwait([SKILL_LEVEL_X[level], lv1_pos[1]], disappear='spellskill/lv1', threshold=0.8, timeout=1.0, screen=scn)
+            else:
+                Press(skill_pos)
             
             # 根據施放方式確認技能
             cast_type = get_skill_cast_type(category)
@@ -4072,39 +5738,22 @@ def Factory():
                 logger.warning(f"[技能施放] 輔助技能 {skill_name} 未指定有效目標位置 ({target_pos})，不點擊目標")
                 return True
             elif cast_type == "ok":
-                # AOE 類技能：等待並點擊 OK 確認
-                ok_pos = None
-                for wait_ok in range(10):  # 最多等待 3 秒 (10 × 0.3s)
-                    check_stop_signal()  # 確保能快速響應停止信號
-                    ok_pos = CheckIf(scn, 'OK')
-                    if ok_pos:
-                        break
-                    Sleep(0.3)
-                    scn = ScreenShot()
+                # AOE 類技能：等待並點擊 OK 確認（最多等待 3 秒）
+                scn, ok_pos = TapAndAwait(None, appear='OK', timeout=3.0)
 
                 if ok_pos:
-                    logger.info(f"[技能施放] 點擊 OK 確認 (等待 {wait_ok} 次)")
-                    Press(ok_pos)
-                    Sleep(1)
-                    # 檢查 MP/SP 不足
-                    scn = ScreenShot()
-                    if CheckIf(scn, 'notenoughsp') or CheckIf(scn, 'notenoughmp'):
+                    logger.info(f"[技能施放] 點擊 OK 確認")
+                    # 檢查 MP/SP 不足（提示最多 1 秒內出現）
+                    scn, not_enough = TapAndAwait(ok_pos, appear=['notenoughsp', 'notenoughmp'], timeout=1.0, screen=scn)
+                    if not_enough:
                         logger.info("[技能施放] SP/MP 不足，改用普攻")
-                        Press(CheckIf(scn, 'notenough_close'))
-                        Sleep(0.5)
+                        TapAndAwait('notenough_close', disappear=['notenoughsp', 'notenoughmp'], timeout=0.5)
                         return use_normal_attack()
                 else:
                     logger.warning(f"[技能施放] OK 按鈕等待超時，可能技能施放失敗")
             else:
-                # 單體/橫排/群控技能：點擊敵人
-                next_pos = None
-                for wait_next in range(10):  # 最多等待 3 秒 (10 × 0.3s)
-                    check_stop_signal()
-                    next_pos = CheckIf(scn, 'next', threshold=0.70)
-                    if next_pos:
-                        break
-                    Sleep(0.3)
-                    scn = ScreenShot()
+                # 單體/橫排/群控技能：點擊敵人（最多等待 3 秒 next 出現）
+                scn, next_pos = TapAndAwait(None, appear='next', threshold=0.70, timeout=3.0)
 
                 if next_pos:
                     # 點擊多個位置覆蓋不同大小敵人
@@ -4113,7 +5762,7 @@ def Factory():
                     target_y1 = next_pos[1] + 100
                     target_y2 = next_pos[1] + 170
                     target_y3 = next_pos[1] + 260
-                    logger.info(f"[技能施放] 點擊目標敵人 (等待 {wait_next} 次)")
+                    logger.info(f"[技能施放] 點擊目標敵人")
                     Press([target_x1, target_y1])
                     Sleep(0.1)
                     Press([target_x1, target_y2])
@@ -4128,17 +5777,7 @@ def Factory():
                 else:
                     # 使用固定座標
                     logger.info(f"[技能施放] 找不到 next，使用固定座標點擊敵人")
-                    Press([150, 750])
-                    Sleep(0.1)
-                    Press([300, 750])
-                    Sleep(0.1)
-                    Press([450, 750])
-                    Sleep(0.1)
-                    Press([550, 750])
-                    Sleep(0.1)
-                    Press([650, 750])
-                    Sleep(0.1)
-                    Press([750, 750])
+                    PressBatch(ENEMY_FALLBACK_POSITIONS, interval=0.1)
                     Sleep(0.1)
                 
             Sleep(0.3)
@@ -4152,104 +5791,47 @@ def Factory():
         MonitorState.current_state = "Combat"
         last_character_update = 0
         def update_combat_flag(scn):
+            if VisionActive():
+                return  # 視覺線程已持續更新監控面板的 Flag 相似度
             combat_templates = get_combat_active_templates()
             if combat_templates:
                 MonitorState.flag_combatActive = max(GetMatchValue(scn, t) for t in combat_templates)
                 MonitorState.flag_updates['combatActive'] = time.time()
         def doubleConfirmCastSpell(skill_name=None):
+            def fallback_normal_attack(scn):
+                # SP/MP 不足，關閉提示後點擊 attack 普攻
+                logger.info("[戰鬥] SP/MP 不足，改用普攻")
+                scn, attack_pos = TapAndAwait('notenough_close', appear='spellskill/普攻/attack', timeout=0.5, screen=scn)
+                TapAndAwait(attack_pos or CheckIf(scn, 'spellskill/普攻/attack'), timeout=0.5, screen=scn)
+                # 點擊六個點位選擇敵人
+                PressBatch(ENEMY_FALLBACK_POSITIONS, interval=0.1)
+                Sleep(0.1)
+                Sleep(1)
+
             is_success_aoe = False
-            Sleep(0.5)
-            scn = ScreenShot()
+            # 等待 OK 按鈕出現 (最多 3 秒)，畫面有變化就立即重新檢查；期間出現 Retry 時點擊重試並延長等待
+            scn, ok_pos = TapAndAwait(None, appear='OK', timeout=3.0, screen=WaitForNextFrame(timeout=0.5), handle_retry=True)
             update_combat_flag(scn)
 
-            # 等待 OK 按鈕出現 (最多 3 秒)
-            ok_pos = None
-            for wait_ok in range(6):
-                check_stop_signal()  # 確保能快速響應停止信號
-                # [網路重試] 檢測網路波動
-                if TryPressRetry(scn):
-                    logger.info("[戰鬥] 等待 OK 按鈕時偵測到 Retry 選項，點擊重試")
-                    Sleep(2)
-                    scn = ScreenShot()  # 重新截圖
-                    continue
-                
-                ok_pos = CheckIf(scn, 'OK')
-                if ok_pos:
-                    break
-                Sleep(0.5)
-                scn = ScreenShot()
-
             if ok_pos:
                 logger.info(f"[戰鬥] 找到 OK 按鈕，點擊確認")
-                Press(ok_pos)
                 is_success_aoe = True
-                Sleep(2)
-                scn = ScreenShot()
-                if CheckIf(scn,'notenoughsp') or CheckIf(scn,'notenoughmp'):
-                    # SP/MP 不足，關閉提示後點擊 attack 普攻
-                    logger.info("[戰鬥] SP/MP 不足，改用普攻")
-                    Press(CheckIf(scn,'notenough_close'))
-                    Sleep(0.5)
-                    scn = ScreenShot()
-                    Press(CheckIf(scn, 'spellskill/普攻/attack'))
-                    Sleep(0.5)
-                    # 點擊六個點位選擇敵人
-                    Press([150,750])
-                    Sleep(0.1)
-                    Press([300,750])
-                    Sleep(0.1)
-                    Press([450,750])
-                    Sleep(0.1)
-                    Press([550,750])
-                    Sleep(0.1)
-                    Press([650,750])
-                    Sleep(0.1)
-                    Press([750,750])
-                    Sleep(0.1)
-                    Sleep(1)
+                # SP/MP 不足的提示最多 2 秒內出現
+                scn, not_enough = TapAndAwait(ok_pos, appear=['notenoughsp', 'notenoughmp'], timeout=2.0, screen=scn)
+                if not_enough:
+                    fallback_normal_attack(scn)
             elif pos:=(CheckIf(scn,'next')):
                 # 多點幾個位置，覆蓋不同大小的敵人
                 Press([pos[0]-15+random.randint(0,30),pos[1]+100+random.randint(0,20)])
                 Sleep(0.2)
                 Press([pos[0]-15+random.randint(0,30),pos[1]+170+random.randint(0,30)])
                 Sleep(0.2)
-                Press([pos[0]-15+random.randint(0,30),pos[1]+260+random.randint(0,30)])
-                Sleep(1)
-                scn = ScreenShot()
-                if CheckIf(scn,'notenoughsp') or CheckIf(scn,'notenoughmp'):
-                    # SP/MP 不足，關閉提示後點擊 attack 普攻
-                    logger.info("[戰鬥] SP/MP 不足，改用普攻")
-                    Press(CheckIf(scn,'notenough_close'))
-                    Sleep(0.5)
-                    scn = ScreenShot()
-                    Press(CheckIf(scn, 'spellskill/普攻/attack'))
-                    Sleep(0.5)
-                    # 點擊六個點位選擇敵人
-                    Press([150,750])
-                    Sleep(0.1)
-                    Press([300,750])
-                    Sleep(0.1)
-                    Press([450,750])
-                    Sleep(0.1)
-                    Press([550,750])
-                    Sleep(0.1)
-                    Press([650,750])
-                    Sleep(0.1)
-                    Press([750,750])
-                    Sleep(0.1)
-                    Sleep(1)
+                scn, not_enough = TapAndAwait([pos[0]-15+random.randint(0,30),pos[1]+260+random.randint(0,30)],
+                                              appear=['notenoughsp', 'notenoughmp'], timeout=1.0)
+                if not_enough:
+                    fallback_normal_attack(scn)
             else:
-                Press([150,750])
-                Sleep(0.1)
-                Press([300,750])
-                Sleep(0.1)
-                Press([450,750])
-                Sleep(0.1)
-                Press([550,750])
-                Sleep(0.1)
-                Press([650,750])
-                Sleep(0.1)
-                Press([750,750])
+                PressBatch(ENEMY_FALLBACK_POSITIONS, interval=0.1)
                 Sleep(0.1)
                 Sleep(2)
             Sleep(1)
@@ -4429,115 +6011,122 @@ def Factory():
         # 等待 flee 出現，確認玩家可控制角色（所有戰鬥邏輯的前提）
         flee_seen = False  # 標記是否已看過戰鬥介面（flee 出現），用於黑屏判定
         logger.info("[戰鬥] 等待 flee 出現...")
-        for wait_count in range(50):  # 最多等待 15 秒 (50 × 0.3s)
-            check_stop_signal()  # 確保能快速響應停止信號
-            screen = ScreenShot()
-            update_combat_flag(screen)
+        FLEE_WAIT_TIMEOUT = 15  # 最多等待 15 秒
+        flee_deadline = time.time() + FLEE_WAIT_TIMEOUT
+        screen = None
+        wait_count = -1
+        # 訂閱視覺線程的死亡 / 重試事件：靜止等待中出現時立即喚醒處理
+        with vision_bus.subscribe(['rise_again', 'retry']) as events:
+            while time.time() < flee_deadline:
+                check_stop_signal()  # 確保能快速響應停止信號
+                wait_count += 1
+                # 畫面有變化或視覺線程回報事件就立即檢查，靜止時最多等 0.3 秒
+                screen = ScreenShot() if screen is None else WaitForChangeOrEvent(screen, events, timeout=0.3)[0]
+                update_combat_flag(screen)
 
-            # [異常檢測] 穿插檢測復活/對話/死亡，避免卡在等待 flee
-            if CheckIf(screen, 'RiseAgain'):
-                logger.info("[戰鬥] flee 等待中偵測到 RiseAgain，中斷並處理復活")
-                RiseAgainReset(reason='combat')
-                return IdentifyState()
-            if CheckIf(screen, 'someonedead'):
-                logger.info("[戰鬥] flee 等待中偵測到 someonedead，嘗試多次點擊以推進對話")
-                # 仿照 Upstream: 隨機偏移點擊 5 次，確保過場動畫/對話被跳過
-                for _ in range(5):
-                    Press([400+random.randint(0,100), 750+random.randint(0,100)])
+                # [異常檢測] 穿插檢測復活/對話/死亡，避免卡在等待 flee
+                if VisionValue('rise_again', lambda scn: CheckIf(scn, 'RiseAgain'), screen):
+                    logger.info("[戰鬥] flee 等待中偵測到 RiseAgain，中斷並處理復活")
+                    RiseAgainReset(reason='combat')
+                    return IdentifyState()
+                if CheckIf(screen, 'someonedead'):
+                    logger.info("[戰鬥] flee 等待中偵測到 someonedead，嘗試多次點擊以推進對話")
+                    # 仿照 Upstream: 隨機偏移點擊 5 次，確保過場動畫/對話被跳過
+                    for _ in range(5):
+                        Press([400+random.randint(0,100), 750+random.randint(0,100)])
+                        Sleep(1)
+                    return IdentifyState()
+                if Press(CheckIf(screen, 'returnText')) or Press(CheckIf(screen, 'ReturnText')):
+                    logger.info("[戰鬥] flee 等待中偵測到 returnText，中斷並處理對話")
                     Sleep(1)
-                return IdentifyState()
-            if Press(CheckIf(screen, 'returnText')) or Press(CheckIf(screen, 'ReturnText')):
-                logger.info("[戰鬥] flee 等待中偵測到 returnText，中斷並處理對話")
-                Sleep(1)
-                return IdentifyState()
+                    return IdentifyState()
             
-            # [網路重試] 檢測網路波動
-            if TryPressRetry(screen):
-                logger.info("[戰鬥] flee 等待中偵測到 Retry 選項，點擊重試")
-                Sleep(2)
-                continue
+                # [網路重試] 檢測網路波動
+                if PressRetryIfSeen(screen):
+                    logger.info("[戰鬥] flee 等待中偵測到 Retry 選項，點擊重試")
+                    Sleep(2)
+                    continue
 
-            # [新增] 檢查是否已經脫離戰鬥 (例如瞬殺或過場過快)
-            # 如果出現 寶箱/地城/地圖 標誌，代表戰鬥已結束
-            if CheckIf(screen, 'chestFlag'):
-                logger.info("[戰鬥] 等待 flee 時發現 chestFlag，判定戰鬥已結束")
-                return DungeonState.Chest
-            if CheckIf(screen, 'dungFlag') or CheckIf(screen, 'mapFlag'):
-                logger.info("[戰鬥] 等待 flee 時發現 dungFlag/mapFlag，判定戰鬥已結束")
-                return DungeonState.Dungeon
+                # [新增] 檢查是否已經脫離戰鬥 (例如瞬殺或過場過快)
+                # 如果出現 寶箱/地城/地圖 標誌，代表戰鬥已結束
+                if CheckIf(screen, 'chestFlag'):
+                    logger.info("[戰鬥] 等待 flee 時發現 chestFlag，判定戰鬥已結束")
+                    return DungeonState.Chest
+                if CheckIf(screen, 'dungFlag') or CheckIf(screen, 'mapFlag'):
+                    logger.info("[戰鬥] 等待 flee 時發現 dungFlag/mapFlag，判定戰鬥已結束")
+                    return DungeonState.Dungeon
             
-            # [新增] 避免誤判：如果已經進入戰鬥介面 (combatActive) 就不用等 flee 了
-            # 使用所有 combatActive 模板來檢測，與 IdentifyState 保持一致
-            if any(CheckIf(screen, t, threshold=0.75) for t in get_combat_active_templates()):
-                 # logger.debug("[戰鬥] 發現 combatActive，標記戰鬥進行中")
-                 pass
+                # [新增] 避免誤判：如果已經進入戰鬥介面 (combatActive) 就不用等 flee 了
+                # 使用所有 combatActive 模板來檢測，與 IdentifyState 保持一致
+                if any(CheckIf(screen, t, threshold=0.75) for t in get_combat_active_templates()):
+                     # logger.debug("[戰鬥] 發現 combatActive，標記戰鬥進行中")
+                     pass
 
-            # 偵測黑屏：如果已有行動且偵測到黑屏，表示戰鬥結束，準備進入下一戰
-            is_black = IsScreenBlack(screen)
-            # 使用所有 combatActive 模板的最大匹配值，與 IdentifyState 保持一致
-            combat_templates = get_combat_active_templates()
-            match_combat = max(GetMatchValue(screen, t) for t in combat_templates) if combat_templates else GetMatchValue(screen, 'combatActive')
+                # 偵測黑屏：如果已有行動且偵測到黑屏，表示戰鬥結束，準備進入下一戰
+                is_black = IsScreenBlack(screen)
+                # 使用所有 combatActive 模板的最大匹配值，與 IdentifyState 保持一致
+                combat_templates = get_combat_active_templates()
+                match_combat = max(GetMatchValue(screen, t) for t in combat_templates) if combat_templates else GetMatchValue(screen, 'combatActive')
             
 
             
-            if runtimeContext._COMBAT_ACTION_COUNT > 0 and is_black and flee_seen:
-                logger.info(f"[戰鬥] 偵測到黑屏，第 {runtimeContext._COMBAT_BATTLE_COUNT} 戰結束，等待下一戰...")
-                # 只重置 action_count，讓 StateCombat 開頭統一處理 battle_count
-                runtimeContext._COMBAT_ACTION_COUNT = 0
-                # 等待黑屏結束
-                # [戰後加速] 黑屏期間點擊 (1,1) 加速過場，並提前偵測下一狀態
-                # 限制最多點擊 20 次 (約 6 秒)，或偵測到明確狀態時退出
-                spam_click_count = 0
-                MAX_SPAM_CLICKS = 20
+                if runtimeContext._COMBAT_ACTION_COUNT > 0 and is_black and flee_seen:
+                    logger.info(f"[戰鬥] 偵測到黑屏，第 {runtimeContext._COMBAT_BATTLE_COUNT} 戰結束，等待下一戰...")
+                    # 只重置 action_count，讓 StateCombat 開頭統一處理 battle_count
+                    runtimeContext._COMBAT_ACTION_COUNT = 0
+                    # 等待黑屏結束
+                    # [戰後加速] 黑屏期間點擊 (1,1) 加速過場，並提前偵測下一狀態
+                    # 限制最多點擊 20 次 (約 6 秒)，或偵測到明確狀態時退出
+                    spam_click_count = 0
+                    MAX_SPAM_CLICKS = 20
                 
-                while spam_click_count < MAX_SPAM_CLICKS:
-                    # 檢查停止信號（使用統一機制確保快速響應）
-                    check_stop_signal()
+                    while spam_click_count < MAX_SPAM_CLICKS:
+                        # 檢查停止信號（使用統一機制確保快速響應）
+                        check_stop_signal()
 
-                    # 1. 點擊加速
-                    Press([1, 1])
-                    spam_click_count += 1
-                    Sleep(0.3)
+                        # 1. 點擊加速
+                        Press([1, 1])
+                        spam_click_count += 1
+                        Sleep(0.3)
                     
-                    # 2. 截圖檢查狀態
-                    scn = ScreenShot()
-                    update_combat_flag(scn)
+                        # 2. 截圖檢查狀態
+                        scn = ScreenShot()
+                        update_combat_flag(scn)
                     
-                    # 如果還在黑屏，繼續點擊
-                    if IsScreenBlack(scn):
-                        continue
+                        # 如果還在黑屏，繼續點擊
+                        if IsScreenBlack(scn):
+                            continue
                         
-                    # 3. 檢查下一狀態標誌 (優先級: 戰鬥 > 寶箱 > 地城 > 其它)
-                    # 這些標誌出現意味著過場結束，應立即交回主循環處理
-                    # 使用所有 combatActive 模板，與 IdentifyState 保持一致
-                    next_state_markers = ['chestFlag', 'dungFlag', 'mapFlag'] + get_combat_active_templates()
-                    if any(CheckIf(scn, marker) for marker in next_state_markers):
-                        logger.info(f"[戰後加速] 偵測到下一狀態標誌 (點擊 {spam_click_count} 次)，結束等待")
-                        break
+                        # 3. 檢查下一狀態標誌 (優先級: 戰鬥 > 寶箱 > 地城 > 其它)
+                        # 這些標誌出現意味著過場結束，應立即交回主循環處理
+                        # 使用所有 combatActive 模板，與 IdentifyState 保持一致
+                        next_state_markers = ['chestFlag', 'dungFlag', 'mapFlag'] + get_combat_active_templates()
+                        if any(CheckIf(scn, marker) for marker in next_state_markers):
+                            logger.info(f"[戰後加速] 偵測到下一狀態標誌 (點擊 {spam_click_count} 次)，結束等待")
+                            break
                     
-                    # [網路重試] 檢測網路波動
-                    if TryPressRetry(scn):
-                        logger.info("[戰鬥] 黑屏加速時偵測到 Retry 選項，點擊重試")
-                        Sleep(2)
-                        break  # 退出黑屏加速循環，重新識別狀態
+                        # [網路重試] 檢測網路波動
+                        if TryPressRetry(scn):
+                            logger.info("[戰鬥] 黑屏加速時偵測到 Retry 選項，點擊重試")
+                            Sleep(2)
+                            break  # 退出黑屏加速循環，重新識別狀態
                 
-                logger.info(f"[戰後加速] 完成，共點擊 {spam_click_count} 次")
-                # 黑屏結束後，回到 StateCombat 開頭重新計數
-                return
+                    logger.info(f"[戰後加速] 完成，共點擊 {spam_click_count} 次")
+                    # 黑屏結束後，回到 StateCombat 開頭重新計數
+                    return
             
-            if CheckIf(screen, 'flee'):
-                flee_seen = True  # 標記已看過戰鬥介面
-                logger.info(f"[戰鬥] flee 出現，等待 {wait_count + 1} 次")
-                # 角色比對（flee 偵測成功後執行，節流避免過於頻繁）
-                now = time.time()
-                if now - last_character_update >= 1.0:
-                    MonitorState.current_character = DetectCharacter(screen)
-                    last_character_update = now
-                break
-            Sleep(0.3)
-        else:
-            logger.warning("[戰鬥] flee 等待超時，共等待 50 次，跳過本次行動")
-            return
+                if CheckIf(screen, 'flee'):
+                    flee_seen = True  # 標記已看過戰鬥介面
+                    logger.info(f"[戰鬥] flee 出現，等待 {wait_count + 1} 次")
+                    # 角色比對（flee 偵測成功後執行，節流避免過於頻繁）
+                    now = time.time()
+                    if now - last_character_update >= 1.0:
+                        MonitorState.current_character = DetectCharacter(screen)
+                        last_character_update = now
+                    break
+            else:
+                logger.warning(f"[戰鬥] flee 等待超時 ({FLEE_WAIT_TIMEOUT} 秒，共檢查 {wait_count + 1} 次)，跳過本次行動")
+                return
 
         # 每次進入戰鬥都檢查 2 倍速 (避免遊戲異常重置後無法恢復)
         if Press(CheckIf(screen, 'combatSpd', threshold=0.70)):
@@ -4645,6 +6234,7 @@ def Factory():
         
         # 輪詢設定
         POLL_INTERVAL = 0.5
+        STILL_DIFF_THRESHOLD = 0.05  # 畫面灰階差異低於此值視為靜止
         STILL_REQUIRED = 10  # 約 5 秒靜止判定
         
         # Resume 設定
@@ -4652,7 +6242,6 @@ def Factory():
         RESUME_CLICK_INTERVAL = 3  # 每 3 秒主動檢查
         CHEST_AUTO_CLICK_INTERVAL = 5  # chest_auto 每 5 秒檢查
         CHEST_AUTO_STILL_THRESHOLD = 3  # chest_auto 靜止判定次數
-        MONITOR_UPDATE_INTERVAL = 0.8  # 監控數值節流 (秒)
 
         # 轉向解卡設定
         MAX_TURN_ATTEMPTS = 6
@@ -4672,7 +6261,6 @@ def Factory():
             self.resume_consecutive_count = 0
             self.last_resume_click_time = time.time()
             self.last_chest_auto_click_time = time.time()
-            self.last_monitor_update_time = 0
             self.is_gohome_mode = False
             self.current_target = None
             self.waiting_for_arrival_after_resume = False
@@ -4850,7 +6438,7 @@ def Factory():
                     scn = ScreenShot()
                     
                     # 使用標準全屏亮度偵測 (不修改 IsScreenBlack)
-                    avg_brightness = np.mean(scn)
+                    avg_brightness = FrameMean(scn)
                     
                     if avg_brightness < 20: 
                         logger.info(f"[DungeonMover] 監控中偵測到轉場黑屏 (亮度: {avg_brightness:.2f})！判定進入戰鬥")
@@ -5068,8 +6656,7 @@ def Factory():
 
                 if not CheckIf(screen, 'mapFlag'):
                     # 檢查是否為黑屏/過場動畫（戰鬥轉場的典型特徵）
-                    gray = cv2.cvtColor(screen, cv2.COLOR_BGR2GRAY)
-                    avg_brightness = np.mean(gray)
+                    avg_brightness = FrameMean(screen, gray=True)
                     
                     if avg_brightness < 30:  # 黑屏閾值
                         logger.info("[DungeonMover] 檢測到黑屏（可能是戰鬥過場），等待狀態穩定...")
@@ -5176,10 +6763,14 @@ def Factory():
         
         def _monitor_move(self, targetInfoList, ctx):
             """
-            統一的移動監控循環
+            統一的移動監控循環（訂閱視覺線程的死亡 / 重試 / 低血量事件，事件發生時立即處理）
             Returns:
                 DungeonState: 下一個狀態
             """
+            with vision_bus.subscribe(['rise_again', 'retry', 'low_hp']) as events:
+                return self._monitor_move_loop(targetInfoList, ctx, events)
+
+        def _monitor_move_loop(self, targetInfoList, ctx, events):
             target_info = targetInfoList[0] if targetInfoList else None
             target = target_info.target if target_info else None
             is_chest_auto = (target == 'chest_auto')
@@ -5189,20 +6780,107 @@ def Factory():
             # 初始化全域計時（如果是第一次進入）
             if self.global_retry_start_time is None:
                 self.global_retry_start_time = time.time()
-            
+
+            mover_rules = get_state_rules('DungeonMover', DEFAULT_MOVER_RULES)
+            tick = 0
+
+            def special_dialog(screen):
+                # 偵測到時直接點擊，返回點擊的選項
+                for option in getattr(quest, '_SPECIALDIALOGOPTION', None) or []:
+                    if Press(CheckIf(screen, option)):
+                        return option
+                return None
+
+            detectors = {
+                'always': lambda screen: True,
+                'rise_again': lambda screen: VisionValue('rise_again', lambda scn: CheckIf(scn, 'RiseAgain'), screen),
+                'low_hp_recover': lambda screen: setting._LOWHP_RECOVER and MonitorState.flag_low_hp,
+                'retry': PressRetryIfSeen,  # 偵測到時直接點擊
+                'special_dialog': special_dialog,
+            }
+
+            # 動作返回 None 繼續檢查下一條規則，NEXT_LOOP 重新等待畫面，Exit(value) 離開監控循環
+            def on_update_flags(scn, hit):
+                # 只在移動時更新監控相似度；視覺線程運行時由它持續更新，這裡不重複比對
+                now = time.time()
+                if not VisionActive():
+                    MonitorState.flag_dungFlag = GetMatchValue(scn, 'dungFlag')
+                    MonitorState.flag_mapFlag = GetMatchValue(scn, 'mapFlag')
+                    MonitorState.flag_chestFlag = GetMatchValue(scn, 'chestFlag')
+                    MonitorState.flag_worldMap = GetMatchValue(scn, 'worldmapflag')
+                    MonitorState.flag_chest_auto = GetMatchValue(scn, 'chest_auto')
+                    MonitorState.flag_auto_text = GetMatchValue(scn, 'AUTO')
+                    # 同步更新時間戳 (讓 GUI 過期檢測正常運作)
+                    for flag in ('dungFlag', 'mapFlag', 'chestFlag', 'worldMap', 'chest_auto', 'AUTO'):
+                        MonitorState.flag_updates[flag] = now
+                # 血量偵測 (只在地城移動時更新)
+                MonitorState.flag_low_hp = VisionValue('low_hp', CheckLowHP, scn)
+                return None
+
+            def on_low_visibility(scn, hit):
+                logger.warning("[DungeonMover] 移動中偵測到能見度過低")
+                return None
+
+            def on_death(scn, hit):
+                logger.info("[DungeonMover] 移動中偵測到 RiseAgain (死亡)")
+                RiseAgainReset(reason='combat')
+                return Exit(None)
+
+            def on_low_hp(scn, hit):
+                logger.info("[DungeonMover] 偵測到低血量，觸發強制恢復流程...")
+                runtimeContext._FORCE_LOWHP_RECOVER = True
+                # 返回 Dungeon 狀態，讓 StateDungeon 處理恢復
+                return Exit(self._cleanup_exit(DungeonState.Dungeon))
+
+            def on_network_retry(scn, hit):
+                logger.info("[DungeonMover] 偵測到 Retry 選項，點擊重試")
+                Sleep(2)
+                return NEXT_LOOP
+
+            def on_dismiss_dialog(scn, hit):
+                Press(hit[1])
+                logger.info("[DungeonMover] 偵測到 returnText (可能是對話框)，點擊返回")
+                Sleep(0.5)
+                return NEXT_LOOP
+
+            def on_special_dialog(scn, hit):
+                logger.info(f"[DungeonMover] 點擊特殊對話選項: {hit[1]}")
+                Sleep(0.5)
+                return NEXT_LOOP
+
+            actions = {
+                'update_flags': on_update_flags,
+                'low_visibility': on_low_visibility,
+                'death': on_death,
+                'low_hp': on_low_hp,
+                'network_retry': on_network_retry,
+                'dismiss_dialog': on_dismiss_dialog,
+                'special_dialog': on_special_dialog,
+            }
+            unknown = {rule.action for rule in mover_rules.rules} - set(actions)
+            if unknown:
+                raise KeyError(f"[DungeonMover] 規則檔中有未實作的動作: {sorted(unknown)}")
+
+            last_tick = 0.0
             while True:
                 # 檢查停止信號（使用統一機制）
                 try:
                     check_stop_signal()
                 except StopSignalException:
                     return self._cleanup_exit(DungeonState.Quit)
+                MonitorState.mark_progress()
                 
                 # NOTE: 檢查異常狀態恢復標誌，若設置則跳出監控循環讓 StateDungeon 處理恢復
                 if runtimeContext._FORCE_ABNORMAL_RECOVER:
                     logger.info("[DungeonMover] 偵測到異常狀態恢復標誌，跳出監控循環")
                     return self._cleanup_exit(DungeonState.Dungeon)
                 
-                Sleep(self.POLL_INTERVAL)
+                # 靜止時等滿 POLL_INTERVAL，畫面一有變化（超過靜止閾值）或視覺線程偵測到事件就立即進入下一輪；
+                # 移動中每一幀都算變化，因此兩輪之間仍至少間隔 POLL_INTERVAL（事件不受限制）
+                _, vision_event = WaitForChangeOrEvent(self.last_screen, events, threshold=self.STILL_DIFF_THRESHOLD,
+                                                       timeout=self.POLL_INTERVAL,
+                                                       min_interval=self.POLL_INTERVAL - (time.time() - last_tick))
+                last_tick = time.time()
 
                 # === 新增：全域硬超時檢查 ===
                 global_elapsed = time.time() - self.global_retry_start_time
@@ -5245,86 +6923,20 @@ def Factory():
                 
                 # ========== C. 狀態檢查 ==========
                 # ========== C. 異常狀況預先檢查 (防止 IdentifyState 卡死) ==========
+                # 偵測順序與頻率見 resources/state_rules.json 的 "DungeonMover" 區段；
+                # 進入監控後的第一次，以及視覺線程的事件（死亡、重試、低血量）出現時不等 interval，立即檢查
                 screen_pre = ScreenShot()
-
-                # 只在移動時更新監控相似度 (節流)
-                now = time.time()
-                if now - self.last_monitor_update_time >= self.MONITOR_UPDATE_INTERVAL:
-                    MonitorState.flag_dungFlag = GetMatchValue(screen_pre, 'dungFlag')
-                    MonitorState.flag_mapFlag = GetMatchValue(screen_pre, 'mapFlag')
-                    MonitorState.flag_chestFlag = GetMatchValue(screen_pre, 'chestFlag')
-                    MonitorState.flag_worldMap = GetMatchValue(screen_pre, 'worldmapflag')
-                    MonitorState.flag_chest_auto = GetMatchValue(screen_pre, 'chest_auto')
-                    MonitorState.flag_auto_text = GetMatchValue(screen_pre, 'AUTO')
-                    # 同步更新時間戳 (讓 GUI 過期檢測正常運作)
-                    MonitorState.flag_updates['dungFlag'] = now
-                    MonitorState.flag_updates['mapFlag'] = now
-                    MonitorState.flag_updates['chestFlag'] = now
-                    MonitorState.flag_updates['worldMap'] = now
-                    MonitorState.flag_updates['chest_auto'] = now
-                    MonitorState.flag_updates['AUTO'] = now
-                    # 血量偵測 (只在地城移動時更新)
-                    MonitorState.flag_low_hp = CheckLowHP(screen_pre)
-                    self.last_monitor_update_time = now
-                    
-                    # [新增] Visibility Resume Check
-                    # 在監控中途如果遇到能見度過低
-                    if CheckIf(screen_pre, 'visibliityistoopoor'):
-                        logger.warning("[DungeonMover] 移動中偵測到能見度過低")
-                    
-                    # [新增] 移動中死亡偵測
-                    if CheckIf(screen_pre, 'RiseAgain'):
-                        logger.info("[DungeonMover] 移動中偵測到 RiseAgain (死亡)")
-                        RiseAgainReset(reason='combat')
-                        return None
-                        resume_pos = CheckIf(screen_pre, 'resume')
-                        if resume_pos:
-                            logger.info(f"[DungeonMover] 點擊 Resume 嘗試脫困: {resume_pos}")
-                            Press(resume_pos)
-                            Sleep(1)
-                            
-                            # 如果是 chest_auto 模式，啟用 "等待到達" 邏輯
-                            if is_chest_auto:
-                                logger.info("[DungeonMover] chest_search 模式下觸發 Resume，進入臨時導航等待模式 (等待 routenotfound)")
-                                self.waiting_for_arrival_after_resume = True
-                                # 重置靜止計數，給予移動時間
-                                self.still_count = 0
-                            
-                            continue
-                        else:
-                             # 無 Resume，不處理，讓它自然落入 GoHome (如果靜止)
-                             pass
-                    
-                    # 低血量恢復檢查（啟用時觸發）
-                    if setting._LOWHP_RECOVER and MonitorState.flag_low_hp:
-                        logger.info("[DungeonMover] 偵測到低血量，觸發強制恢復流程...")
-                        runtimeContext._FORCE_LOWHP_RECOVER = True
-                        # 返回 Dungeon 狀態，讓 StateDungeon 處理恢復
-                        return self._cleanup_exit(DungeonState.Dungeon)
-                
-                # 1. 網路重試 / 異常彈窗
-                if TryPressRetry(screen_pre):
-                    logger.info("[DungeonMover] 偵測到 Retry 選項，點擊重試")
-                    Sleep(2)
-                    continue
-
-                # 2. ReturnText (對話框卡住)
-                if Press(CheckIf(screen_pre, "returnText")):
-                    logger.info("[DungeonMover] 偵測到 returnText (可能是對話框)，點擊返回")
-                    Sleep(0.5)
+                tick += 1
+                outcome = None
+                urgent = tick == 1 or (vision_event is not None and bool(vision_event.value))
+                for rule, hit in mover_rules.run(screen_pre, tick, CheckRuleTemplates, detectors, urgent=urgent):
+                    outcome = actions[rule.action](screen_pre, hit)
+                    if outcome is not None:
+                        break
+                if isinstance(outcome, Exit):
+                    return outcome.value
+                if outcome == NEXT_LOOP:
                     continue
-                
-                # 3. 特殊對話選項
-                if getattr(quest, '_SPECIALDIALOGOPTION', None):
-                    handled_dialog = False
-                    for option in quest._SPECIALDIALOGOPTION:
-                        if Press(CheckIf(screen_pre, option)):
-                            logger.info(f"[DungeonMover] 點擊特殊對話選項: {option}")
-                            handled_dialog = True
-                            break
-                    if handled_dialog:
-                        Sleep(0.5)
-                        continue
 
                 # ========== D. 狀態檢查 ==========
                 # 記錄調用前的 _DUNGEON_CONFIRMED 狀態
@@ -5476,11 +7088,11 @@ def Factory():
 
                 # ========== F. 靜止與 Resume 偵測 ==========
                 if self.last_screen is not None:
-                    gray1 = cv2.cvtColor(screen, cv2.COLOR_BGR2GRAY)
-                    gray2 = cv2.cvtColor(self.last_screen, cv2.COLOR_BGR2GRAY)
+                    gray1 = FrameGray(screen)
+                    gray2 = FrameGray(self.last_screen)
                     diff = cv2.absdiff(gray1, gray2).mean() / 255
                     
-                    if diff < 0.05:
+                    if diff < self.STILL_DIFF_THRESHOLD:
                         self.still_count += 1
                         MonitorState.still_count = self.still_count  # 同步到監控
                         if is_chest_auto:
@@ -5853,73 +7465,50 @@ def Factory():
         DUNGFLAG_CONFIRM_REQUIRED = 3  # [優化] 從 5 改為 3
         DUNGFLAG_FAIL_THRESHOLD = 3  # 連續失敗 3 次才重置
         
-        # 異常狀態定義
-        abnormal_states = [
-            'ambush', 'ignore', 'sandman_recover', 'cursedWheel_timeLeap',
-            'multipeopledead', 'startdownload', 'totitle', 'Deepsnow',
-            'adventurersbones', 'halfBone', 'nothanks', 'strange_things', 'blessing',
-            'DontBuyIt', 'donthelp', 'buyNothing', 'Nope', 'ignorethequest',
-            'dontGiveAntitoxin', 'pass', 'returnText', 'ReturnText'
-        ]
+        # 偵測順序、頻率與閾值見 resources/state_rules.json 的 "StateChest" 區段，這裡只實作各規則的動作
+        chest_rules = get_state_rules('StateChest', DEFAULT_CHEST_RULES)
 
-        while True:
-            # 檢查停止信號（使用統一機制確保快速響應）
-            check_stop_signal()
+        detectors = {
+            'retry': TryPressRetry,  # 偵測到時直接點擊
+            'fast_forward_off': CheckIf_fastForwardOff,
+            'blackout': lambda screen: FrameMean(screen) < 15,
+            'always': lambda screen: True,
+        }
 
-            chest_wait_count += 1
-            logger.debug(f"[StateChest] === 循環 #{chest_wait_count} 開始 === dungFlag計數={dungflag_consecutive_count}")
-            if chest_wait_count > MAX_CHEST_WAIT_LOOPS:
-                logger.warning(f"[StateChest] 超時：等待循環超過 {MAX_CHEST_WAIT_LOOPS} 次，強制退出")
-                return None
+        # 動作返回 None 繼續檢查下一條規則，NEXT_LOOP 重新截圖，Exit(value) 離開 StateChest
+        def on_abnormal(scn, hit):
+            logger.info(f"[StateChest] 偵測到異常狀態 {hit[0]}，交由 IdentifyState 處理")
+            return Exit(None)
 
-            scn = ScreenShot()
+        def on_combat(scn, hit):
+            logger.info("[StateChest] 偵測到戰鬥，進入戰鬥狀態")
+            return Exit(DungeonState.Combat)
 
-            # 1. 優先中斷條件 (Interrupts) - [優化] 分頻檢查
-            # 異常狀態：每 20 次循環檢查一次 (約 2-4 秒一次)
-            # 戰鬥/死亡：每 5 次循環檢查一次 (約 0.5-1 秒一次)
-            
-            # 異常狀態
-            if chest_wait_count % 20 == 0:
-                if any(CheckIf(scn, t) for t in abnormal_states):
-                    logger.info(f"[StateChest] 偵測到異常狀態，交由 IdentifyState 處理")
-                    return None
-            
-            # 戰鬥與死亡
-            if chest_wait_count % 5 == 0:
-                # 戰鬥
-                if any(CheckIf(scn, t, threshold=0.70) for t in get_combat_active_templates()):
-                    logger.info("[StateChest] 偵測到戰鬥，進入戰鬥狀態")
-                    return DungeonState.Combat
-                # 死亡
-                if CheckIf(scn, 'RiseAgain'):
-                    logger.info("[StateChest] 偵測到死亡")
-                    RiseAgainReset(reason='chest')
-                    return None
+        def on_death(scn, hit):
+            logger.info("[StateChest] 偵測到死亡")
+            RiseAgainReset(reason='chest')
+            return Exit(None)
 
-            # [網路重試] 檢測網路波動 (每 10 次循環)
-            if chest_wait_count % 10 == 0:
-                if TryPressRetry(scn):
-                    logger.info("[StateChest] 偵測到 Retry 選項，點擊重試")
-                    Sleep(2)
-                    continue
+        def on_network_retry(scn, hit):
+            # [網路重試] 檢測網路波動
+            logger.info("[StateChest] 偵測到 Retry 選項，點擊重試")
+            Sleep(2)
+            return NEXT_LOOP
 
-            # 2. 結束檢查 (DungFlag) - 帶連續確認 (保持每次檢查)
-            dungFlag_result = CheckIf(scn, 'dungFlag', threshold=0.75)
-            logger.debug(f"[StateChest] dungFlag 偵測結果: {dungFlag_result}, 當前計數={dungflag_consecutive_count}")
-            if dungFlag_result:
+        def on_dung_flag(scn, hit):
+            # 結束檢查 (DungFlag) - 帶連續確認
+            nonlocal dungflag_consecutive_count, dungflag_fail_count
+            logger.debug(f"[StateChest] dungFlag 偵測結果: {hit}, 當前計數={dungflag_consecutive_count}")
+            if hit:
                 dungflag_consecutive_count += 1
                 dungflag_fail_count = 0  # 成功時重置失敗計數
                 if dungflag_consecutive_count >= DUNGFLAG_CONFIRM_REQUIRED:
                     logger.info(f"[StateChest] dungFlag 已連續穩定確認 {dungflag_consecutive_count} 次，畫面無彈窗幹擾，開箱流程結束")
-                    return DungeonState.Dungeon
+                    return Exit(DungeonState.Dungeon)
 
                 # [優化] 即使看到 dungFlag，也不馬上退出，而是繼續執行下方的 Spam Click
-                # 這樣可以利用主循環的點擊能力來消除潛在的殘留彈窗
-                logger.debug(f"[StateChest] 檢測到 dungFlag ({dungflag_consecutive_count}/5)，繼續執行清理點擊以確保彈窗關閉...")
-                # 注意：這裡不 continue，讓它自然掉落到下方的 Spam Click 邏輯
-                pass
-                # [Modified] Removed 'continue' to allow fall-through to Spam Click below
-                # 這樣即使在確認 dungFlag 期間，也能持續點擊關閉彈窗 
+                # 這樣即使在確認 dungFlag 期間，也能持續點擊關閉彈窗
+                logger.debug(f"[StateChest] 檢測到 dungFlag ({dungflag_consecutive_count}/{DUNGFLAG_CONFIRM_REQUIRED})，繼續執行清理點擊以確保彈窗關閉...")
             else:
                 # [優化] 延遲重置：只有連續失敗 3 次才重置計數
                 dungflag_fail_count += 1
@@ -5927,146 +7516,184 @@ def Factory():
                     logger.debug(f"[StateChest] dungFlag 連續失敗 {dungflag_fail_count} 次，重置計數")
                     dungflag_consecutive_count = 0
                     dungflag_fail_count = 0
+            return None
 
-            # 3. 寶箱交互 (Interactive States) (保持每次檢查)
-            has_interaction = False
-            
-            # 3.1 選擇開箱角色 (whowillopenit)
-            if CheckIf(scn, 'whowillopenit'):
-                logger.info("[StateChest] 選擇開箱角色")
-                while True:
-                    # 檢查停止信號（使用統一機制確保快速響應）
-                    check_stop_signal()
-                    pointSomeone = setting._WHOWILLOPENIT - 1
-                    if (pointSomeone != -1) and (pointSomeone in availableChar) and (not haveBeenTried):
-                        whowillopenit = pointSomeone 
-                    else:
-                        whowillopenit = random.choice(availableChar) 
-                    pos = [258+(whowillopenit%3)*258, 1161+((whowillopenit)//3)%2*184]
-                    
-                    if CheckIf(scn,'chestfear',[[pos[0]-125,pos[1]-82,250,164]]):
-                        if whowillopenit in availableChar:
-                            availableChar.remove(whowillopenit) 
-                    else:
-                        Press(pos)
-                        # 動態等待角色選擇介面關閉或進入下一階段
-                        for _ in range(10):
-                            check_stop_signal()
-                            Sleep(0.3)
-                            loop_scn = ScreenShot()
-                            if not CheckIf(loop_scn, 'whowillopenit') or CheckIf(loop_scn, 'chestOpening') or CheckIf(loop_scn, 'dungFlag'):
-                                break
-                        break
-                if not haveBeenTried:
-                    haveBeenTried = True
-                has_interaction = True
+        def on_pick_opener(scn, hit):
+            # 選擇開箱角色 (whowillopenit)
+            nonlocal haveBeenTried
+            logger.info("[StateChest] 選擇開箱角色")
+            while True:
+                # 檢查停止信號（使用統一機制確保快速響應）
+                check_stop_signal()
+                pointSomeone = setting._WHOWILLOPENIT - 1
+                if (pointSomeone != -1) and (pointSomeone in availableChar) and (not haveBeenTried):
+                    whowillopenit = pointSomeone
+                else:
+                    whowillopenit = random.choice(availableChar)
+                pos = [258+(whowillopenit%3)*258, 1161+((whowillopenit)//3)%2*184]
 
-            # 3.2 正在開箱/解鎖 (chestOpening)
-            elif CheckIf(scn, 'chestOpening'):
-                pass
+                if CheckIf(scn,'chestfear',[[pos[0]-125,pos[1]-82,250,164]]):
+                    if whowillopenit in availableChar:
+                        availableChar.remove(whowillopenit)
+                else:
+                    Press(pos)
+                    # 動態等待角色選擇介面關閉或進入下一階段
+                    for _ in range(10):
+                        check_stop_signal()
+                        Sleep(0.3)
+                        loop_scn = ScreenShot()
+                        if not CheckIf(loop_scn, 'whowillopenit') or CheckIf(loop_scn, 'chestOpening') or CheckIf(loop_scn, 'dungFlag'):
+                            break
+                    break
+            haveBeenTried = True
+            return NEXT_LOOP
 
-            # 3.3 點擊寶箱 (chestFlag)
-            elif pos := CheckIf(scn, 'chestFlag'):
-                logger.info(f"[StateChest] 發現寶箱 (chestFlag)，點擊打開")
-                Press(pos)
-                # 動態等待進入開箱角色選擇或開箱中狀態
-                for _ in range(10):
-                    check_stop_signal()
-                    Sleep(0.3)
-                    loop_scn = ScreenShot()
-                    if CheckIf(loop_scn, 'whowillopenit') or CheckIf(loop_scn, 'chestOpening') or CheckIf(loop_scn, 'dungFlag'):
-                        break
-                has_interaction = True
+        def on_opening(scn, hit):
+            # 正在開箱/解鎖 (chestOpening)：不點寶箱，繼續連點跳過
+            return None
 
-            if has_interaction:
-                continue
+        def on_open_chest(scn, hit):
+            # 點擊寶箱 (chestFlag)
+            logger.info(f"[StateChest] 發現寶箱 (chestFlag)，點擊打開")
+            Press(hit[1])
+            # 動態等待進入開箱角色選擇或開箱中狀態
+            for _ in range(10):
+                check_stop_signal()
+                Sleep(0.3)
+                loop_scn = ScreenShot()
+                if CheckIf(loop_scn, 'whowillopenit') or CheckIf(loop_scn, 'chestOpening') or CheckIf(loop_scn, 'dungFlag'):
+                    break
+            return NEXT_LOOP
 
-            # 4. 默認操作：連點跳過對話 (Spam Click)
-            # 包含：快進、重試、點擊跳過
-            
-            # 快進與重試 (保持檢查，但可以稍微降低頻率，比如每 2 次)
-            if chest_wait_count % 2 == 0:
-                if Press(CheckIf_fastForwardOff(scn)):
-                    Sleep(0.3)
-                    continue
-                if TryPressRetry(scn):
-                    Sleep(0.3)
-                    continue
+        def on_fast_forward(scn, hit):
+            Press(hit[1])
+            Sleep(0.3)
+            return NEXT_LOOP
 
-            # [優化] 突發連點 (Burst Click) - 減少次數和間隔
-            # 從 5次x0.1s 改為 3次x0.05s，節省約 0.35s/循環
+        def on_retry(scn, hit):
+            Sleep(0.3)
+            return NEXT_LOOP
 
+        def on_blackout(scn, hit):
             # 黑幕檢測：如果畫面太暗，可能正在進入戰鬥，停止點擊
-            screen_brightness = scn.mean()
-            if screen_brightness < 15:
-                logger.info(f"[StateChest] 偵測到黑幕 (亮度={screen_brightness:.1f})，停止點擊，交由 IdentifyState 判斷")
-                return None  # 讓 IdentifyState 做最終判斷，它有更完整的黑屏處理邏輯
+            logger.info(f"[StateChest] 偵測到黑幕 (亮度={FrameMean(scn):.1f})，停止點擊，交由 IdentifyState 判斷")
+            return Exit(None)  # 讓 IdentifyState 做最終判斷，它有更完整的黑屏處理邏輯
 
-            logger.debug(f"[StateChest] 執行 Burst Click (3次) - has_interaction={has_interaction}")
+        def on_burst_click(scn, hit):
+            # [優化] 突發連點 (Burst Click) - 從 5次x0.1s 改為 3次x0.05s，節省約 0.35s/循環
+            logger.debug("[StateChest] 執行 Burst Click (3次)")
             for _ in range(3):
                 Press(disarm)
                 Sleep(0.05)
+            return None
 
+        def on_auto(scn, hit):
             # AUTO 偵測：偵測到 AUTO 時持續點擊直到消失
-            auto_match = GetMatchValue(scn, 'AUTO')
-            if auto_match >= 80:
-                logger.info(f"[StateChest] 偵測到 AUTO (匹配度={auto_match:.0f}%)，開始連續點擊")
-                auto_click_count = 0
-                while auto_click_count < 10:
-                    # 檢查停止信號（使用統一機制確保快速響應）
-                    check_stop_signal()
-                    # 連點 3 下清對話
-                    for _ in range(3):
-                        Press(disarm)
-                        Sleep(0.05)
-                    Sleep(0.1)
-                    scn = ScreenShot()
-                    auto_match = GetMatchValue(scn, 'AUTO')
-                    if auto_match < 80:
-                        logger.info("[StateChest] AUTO 已消失，停止點擊")
-                        
-                        # [恢復判斷] AUTO 消失後，檢查是否需要恢復（只設置標誌，不執行動作）
-                        logger.debug("[StateChest] 執行恢復條件判斷...")
-                        scn_recover = ScreenShot()
-                        
-                        # [Debug] 進入檢查即刻拍照（需開啟 debug截圖 選項）
-                        if setting._DEBUG_SCREENSHOT:
-                            try:
-                                debug_dir = "debug_screens"
-                                if not os.path.exists(debug_dir): os.makedirs(debug_dir)
-                                ts = datetime.now().strftime("%H%M%S_%f")[:9] 
-                                save_path = f"{debug_dir}/chest_auto_check_{ts}.png"
-                                cv2.imwrite(save_path, scn_recover)
-                                logger.debug(f"[StateChest] 恢復檢查前截圖: {save_path}")
-                            except Exception as e: logger.error(f"截圖失敗: {e}")
-                        
-                        # 1. 異常狀態
-                        if (setting._RECOVER_POISON or setting._RECOVER_VENOM or 
-                            setting._RECOVER_STONE or setting._RECOVER_PARALYSIS or 
-                            setting._RECOVER_CURSED or setting._RECOVER_FEAR or
-                            setting._RECOVER_SKILLLOCK):
-                            detected, status_types = CheckAbnormalStatus(scn_recover, setting)
-                            if detected:
-                                logger.info(f"[StateChest] 偵測到異常狀態: {status_types}，標記強制恢復")
-                                runtimeContext._FORCE_ABNORMAL_RECOVER = True
-                                # 如果偵測到麻痺或封技，標記恢復後重置戰鬥計數
-                                if '麻痺' in status_types or '封技' in status_types:
-                                    runtimeContext._RESET_BATTLE_COUNT_AFTER_RECOVER = True
-                                    logger.info("[StateChest] 偵測到麻痺/封技，將在恢復後重置戰鬥計數器")
-                                
-                        # 2. 低血量恢復
-                        if setting._LOWHP_RECOVER:
-                            if CheckLowHP(scn_recover):
-                                logger.debug("[StateChest] 偵測到低血量，啟用低血量恢復檢查標誌")
-                                runtimeContext._FORCE_LOWHP_RECOVER = True
-                            else:
-                                logger.debug("[StateChest] 低血量檢查: 未偵測到低血量")
+            logger.info(f"[StateChest] 偵測到 AUTO (匹配度={GetMatchValue(scn, 'AUTO'):.0f}%)，開始連續點擊")
+            auto_click_count = 0
+            while auto_click_count < 10:
+                # 檢查停止信號（使用統一機制確保快速響應）
+                check_stop_signal()
+                # 連點 3 下清對話
+                for _ in range(3):
+                    Press(disarm)
+                    Sleep(0.05)
+                Sleep(0.1)
+                scn = ScreenShot()
+                auto_match = GetMatchValue(scn, 'AUTO')
+                if auto_match < 80:
+                    logger.info("[StateChest] AUTO 已消失，停止點擊")
 
-                        break
-                    auto_click_count += 1
+                    # [恢復判斷] AUTO 消失後，檢查是否需要恢復（只設置標誌，不執行動作）
+                    logger.debug("[StateChest] 執行恢復條件判斷...")
+                    scn_recover = ScreenShot()
+                    
+                    # [Debug] 進入檢查即刻拍照（需開啟 debug截圖 選項）
+                    if setting._DEBUG_SCREENSHOT:
+                        try:
+                            debug_dir = "debug_screens"
+                            if not os.path.exists(debug_dir): os.makedirs(debug_dir)
+                            ts = datetime.now().strftime("%H%M%S_%f")[:9] 
+                            save_path = f"{debug_dir}/chest_auto_check_{ts}.png"
+                            cv2.imwrite(save_path, scn_recover)
+                            logger.debug(f"[StateChest] 恢復檢查前截圖: {save_path}")
+                        except Exception as e: logger.error(f"截圖失敗: {e}")
+                    
+                    # 1. 異常狀態
+                    if (setting._RECOVER_POISON or setting._RECOVER_VENOM or 
+                        setting._RECOVER_STONE or setting._RECOVER_PARALYSIS or 
+                        setting._RECOVER_CURSED or setting._RECOVER_FEAR or
+                        setting._RECOVER_SKILLLOCK):
+                        detected, status_types = CheckAbnormalStatus(scn_recover, setting)
+                        if detected:
+                            logger.info(f"[StateChest] 偵測到異常狀態: {status_types}，標記強制恢復")
+                            runtimeContext._FORCE_ABNORMAL_RECOVER = True
+                            # 如果偵測到麻痺或封技，標記恢復後重置戰鬥計數
+                            if '麻痺' in status_types or '封技' in status_types:
+                                runtimeContext._RESET_BATTLE_COUNT_AFTER_RECOVER = True
+                                logger.info("[StateChest] 偵測到麻痺/封技，將在恢復後重置戰鬥計數器")
+                            
+                    # 2. 低血量恢復
+                    if setting._LOWHP_RECOVER:
+                        if CheckLowHP(scn_recover):
+                            logger.debug("[StateChest] 偵測到低血量，啟用低血量恢復檢查標誌")
+                            runtimeContext._FORCE_LOWHP_RECOVER = True
+                        else:
+                            logger.debug("[StateChest] 低血量檢查: 未偵測到低血量")
+
+                    break
+                auto_click_count += 1
+            return None
+
+        actions = {
+            'abnormal': on_abnormal,
+            'combat': on_combat,
+            'death': on_death,
+            'network_retry': on_network_retry,
+            'dung_flag': on_dung_flag,
+            'pick_opener': on_pick_opener,
+            'opening': on_opening,
+            'open_chest': on_open_chest,
+            'fast_forward': on_fast_forward,
+            'retry': on_retry,
+            'blackout': on_blackout,
+            'burst_click': on_burst_click,
+            'auto': on_auto,
+        }
+        unknown = {rule.action for rule in chest_rules.rules} - set(actions)
+        if unknown:
+            raise KeyError(f"[StateChest] 規則檔中有未實作的動作: {sorted(unknown)}")
+
+        while True:
+            # 檢查停止信號（使用統一機制確保快速響應）
+            check_stop_signal()
+            MonitorState.mark_progress()
+
+            chest_wait_count += 1
+            logger.debug(f"[StateChest] === 循環 #{chest_wait_count} 開始 === dungFlag計數={dungflag_consecutive_count}")
+            if chest_wait_count > MAX_CHEST_WAIT_LOOPS:
+                logger.warning(f"[StateChest] 超時：等待循環超過 {MAX_CHEST_WAIT_LOOPS} 次，強制退出")
+                return None
+
+            scn = ScreenShot()
+
+            # 依優先順序執行本次循環需要檢查的規則，動作要求重新截圖或離開時停止（之後的規則不比對）
+            outcome = None
+            for rule, hit in chest_rules.run(scn, chest_wait_count, CheckRuleTemplates, detectors):
+                outcome = actions[rule.action](scn, hit)
+                if outcome is not None:
+                    break
+            if isinstance(outcome, Exit):
+                return outcome.value
 
     @stoppable
     def StateDungeon(targetInfoList : list[TargetInfo], initial_dungState = None):
+        # 訂閱視覺線程的事件：異常狀態的變化（不受偵測間隔與結果時效影響），
+        # 以及畫面無法識別時等待的喚醒（死亡、重試）
+        with vision_bus.subscribe(['abnormal_status', 'rise_again', 'retry']) as events:
+            return _StateDungeonLoop(targetInfoList, initial_dungState, events)
+
+    def _StateDungeonLoop(targetInfoList, initial_dungState, events):
         gameFrozen_none = []
         gameFrozen_map = 0
         dungState = initial_dungState
@@ -6075,6 +7702,9 @@ def Factory():
         needRecoverBecauseCombat = False
         needRecoverBecauseChest = False
         resume_fail_counter = 0  # Resume 檢測失敗計數器，防止死循環
+        # 視覺線程回報的異常狀態（事件只在結果改變時發布，最後一個事件的值即為目前狀態）
+        latest_status = vision_bus.latest('abnormal_status')
+        vision_status = latest_status.value if latest_status is not None else None
 
         nonlocal runtimeContext
 
@@ -6083,6 +7713,7 @@ def Factory():
         
         while 1:
             check_stop_signal()  # 每次迭代開始時檢查停止信號
+            MonitorState.mark_progress()
             state_handle_start = time.time()
             state_handle_name = dungState
             logger.info("----------------------")
@@ -6127,6 +7758,8 @@ def Factory():
                         if result:
                             logger.info("由於畫面卡死, 軟超時重啓.")
                             restartGame()
+                        # 無法識別的畫面：等到畫面變化或視覺線程回報死亡 / 重試再重新識別
+                        WaitForChangeOrEvent(scn, events, timeout=0.5)
                 case DungeonState.Quit:
                     elapsed_ms = (time.time() - state_handle_start) * 1000
                     logger.debug(f"[耗時] 地城狀態處理 {state_handle_name} (耗時 {elapsed_ms:.0f} ms)")
@@ -6141,9 +7774,15 @@ def Factory():
                         setting._RECOVER_SKILLLOCK):
                          # 為了避免頻繁截圖，可以考慮只在某些條件下檢查，但這裡為了即時性先每次檢查
                          # 如果 CheckAbnormalStatus 效能允許 (已優化 ROI)
-                         scn_status = ScreenShot()
-                         detected, status_types = CheckAbnormalStatus(scn_status, setting)
-                         if detected:
+                         # 視覺線程運行時以訂閱到的事件為準，不再截圖比對
+                         for event in events.drain():
+                             if event.kind == 'abnormal_status':
+                                 vision_status = event.value
+                         if VisionActive() and vision_status is not None:
+                             status_types = vision_status
+                         else:
+                             status_types = tuple(CheckAbnormalStatus(ScreenShot(), setting)[1])
+                         if status_types:
                              logger.info(f"[StateDungeon] 偵測到異常狀態: {status_types}，觸發恢復")
                              shouldRecover = True
                              # 如果偵測到麻痺或封技，標記恢復後重置戰鬥計數
@@ -6413,6 +8052,7 @@ def Factory():
             except StopSignalException:
                 logger.info("DungeonFarm 收到停止信號，優雅退出")
                 break
+            MonitorState.mark_progress()
             logger.info("======================")
             Sleep(1)
             
@@ -6548,6 +8188,7 @@ def Factory():
             case '7000G':
                 while 1:
                     check_stop_signal()  # 確保快速響應停止信號
+                    MonitorState.mark_progress()
 
                     starttime = time.time()
                     runtimeContext._COUNTERDUNG += 1
@@ -6633,6 +8274,7 @@ def Factory():
                 quest._SPECIALDIALOGOPTION = ['fordraig/thedagger','fordraig/InsertTheDagger']
                 while 1:
                     check_stop_signal()  # 確保快速響應停止信號
+                    MonitorState.mark_progress()
                     runtimeContext._COUNTERDUNG += 1
                     setting._SYSTEMAUTOCOMBAT = True
                     starttime = time.time()
@@ -7414,6 +9056,7 @@ def Factory():
         nonlocal quest
         nonlocal setting # 初始化
         nonlocal runtimeContext
+        nonlocal session_recorder, replay_source
         
         # 保存統計計數器（避免重啟時清零）
         saved_counters = None
@@ -7440,6 +9083,7 @@ def Factory():
                 setattr(runtimeContext, key, value)
 
         setting = set
+        setting._FARM_ERROR = None
 
         # 將 _start_game_monitor 存到 setting 上，讓 ResetADBDevice 可以調用
         setting._start_game_monitor = _start_game_monitor
@@ -7458,11 +9102,44 @@ def Factory():
                     setting._FINISHINGCALLBACK()
                 return
 
+            if getattr(setting, '_REPLAY_SESSION_PATH', ""):
+                # 回放模式：以錄製的幀取代設備，不連接 ADB、不啟動串流和遊戲
+                replay_source = ReplayFrameSource(setting._REPLAY_SESSION_PATH)
+                replay_start = time.time()
+                quest = LoadQuest(setting._FARMTARGET)
+                try:
+                    if quest:
+                        if quest._TYPE =="dungeon":
+                            DungeonFarm()
+                        else:
+                            QuestFarm()
+                finally:
+                    elapsed = time.time() - replay_start
+                    fps = replay_source.frame_index / elapsed if elapsed > 0 else 0
+                    logger.info(f"[回放] 處理 {replay_source.frame_index} 幀，耗時 {elapsed:.2f} 秒 ({fps:.1f} 幀/秒)")
+                    replay_source.close()
+                    replay_source = None
+                MonitorState.reset()
+                if setting._MSGQUEUE:
+                    setting._MSGQUEUE.put(('task_finished', None))
+                elif setting._FINISHINGCALLBACK:
+                    setting._FINISHINGCALLBACK()
+                return
+
+            if getattr(setting, '_RECORD_SESSION', False) and session_recorder is None:
+                session_recorder = SessionRecorder()
+
+            # 編輯器或使用者在運行中新增/修改圖片時，自動更新模板註冊表
+            template_registry.start_watching()
+            screen_cache.configure(getattr(setting, '_SCREEN_CACHE_SIZE', 64), getattr(setting, '_SCREEN_CACHE_DISTANCE', 4))
+
             ResetADBDevice()
 
             # 檢查 ADB 連接是否成功
             if not setting._ADBDEVICE:
                 logger.error("ADB 連接失敗或被中斷，無法啟動任務")
+                if not (setting._FORCESTOPING and setting._FORCESTOPING.is_set()):
+                    setting._FARM_ERROR = "ADB 連接失敗"
                 MonitorState.reset()
                 # 通過消息隊列通知主線程
                 if setting._MSGQUEUE:
@@ -7473,9 +9150,11 @@ def Factory():
 
             # 啟動 pyscrcpy 串流（如果可用）
             stream = get_scrcpy_stream()
+            _EnableVisionWorker(stream)
             if stream:
                 if stream.start():
                     logger.info("pyscrcpy 串流已啟動，截圖將使用快速模式")
+                    _StartVisionWorker()
                 else:
                     logger.info("pyscrcpy 串流啟動失敗，將使用傳統 ADB 截圖")
 
@@ -7506,6 +9185,7 @@ def Factory():
             if setting._FORCESTOPING and setting._FORCESTOPING.is_set():
                 logger.info("Farm ADB 初始化後檢測到停止信號")
                 if stream:
+                    stream.stop_supervisor()
                     stream.stop()
                 MonitorState.reset()
                 # 通過消息隊列通知主線程
@@ -7538,6 +9218,7 @@ def Factory():
                 setting._FINISHINGCALLBACK()
         except Exception as e:
             logger.error(f"Farm 執行時發生錯誤: {e}")
+            setting._FARM_ERROR = e
             MonitorState.reset()
             # 通過消息隊列通知主線程
             if setting._MSGQUEUE:
@@ -7545,10 +9226,19 @@ def Factory():
             elif setting._FINISHINGCALLBACK:
                 setting._FINISHINGCALLBACK()
         finally:
-            # 清理：停止 pyscrcpy 串流
+            # 清理：先停視覺線程，再停止 pyscrcpy 串流（先停監管線程，避免任務結束後又被重連）
+            _PublishLatency(force=True)  # 任務結束時輸出一次延遲摘要（含視覺線程統計）
+            _StopVisionWorker()
             stream = get_scrcpy_stream()
             if stream:
+                stream.stop_supervisor()
                 stream.stop()
+            if session_recorder is not None:
+                session_recorder.close()
+                session_recorder = None
+            search_regions.save()
+            screen_transitions.save()
+            _ShutdownMatchPool()
     return Farm
 
 def TestFactory():
@@ -7599,8 +9289,7 @@ def TestFactory():
         template = LoadTemplateImage(shortPathOfTarget)
         if template is None:
             return None
-        screenshot = screenImage.copy()
-        search_area = CutRoI(screenshot, roi)
+        search_area, (offset_x, offset_y) = CropRoI(screenImage, roi)
         try:
             result = cv2.matchTemplate(search_area, template, cv2.TM_CCOEFF_NORMED)
         except Exception as e:
@@ -7611,7 +9300,7 @@ def TestFactory():
         if max_val < threshold:
             logger.debug("匹配程度不足閾值.")
             return None
-        pos = [max_loc[0] + template.shape[1]//2, max_loc[1] + template.shape[0]//2]
+        pos = [max_loc[0] + offset_x + template.shape[1]//2, max_loc[1] + offset_y + template.shape[0]//2]
         return pos
     
     def get_organize_items():
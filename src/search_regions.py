@@ -0,0 +1,76 @@
+"""
+模板搜索區域索引
+
+大部分 UI 元素（dungFlag、mapFlag、OK、returnText…）每次都出現在差不多的位置。
+CheckIf 每次匹配成功時把模板在螢幕上的矩形記錄下來，累積成每個模板的外接矩形，
+存成 resources/search_regions.json。下次比對時先在學到的區域（加上邊距）內搜索，
+沒有達到閾值才退回全螢幕搜索。
+
+檢視 / 重置索引:
+    python src/search_regions.py show [模板名稱...]
+    python src/search_regions.py reset [模板名稱...]   # 不指定名稱則全部清除
+    python src/search_regions.py show --device 127.0.0.1:16384   # 多開模式下某台設備的索引
+"""
+from persisted_index import PersistedIndex, run_cli
+
+SEARCH_REGION_FILE = "resources/search_regions.json"
+
+
+class SearchRegionIndex(PersistedIndex):
+    """每個模板的搜索區域（螢幕座標外接矩形）"""
+
+    FILE = SEARCH_REGION_FILE
+    LOG_TAG = "[搜索區域]"
+    MARGIN = 40             # 搜索區域在外接矩形外加的邊距（像素）
+    MIN_HITS = 3            # 至少匹配成功幾次才使用學到的區域
+    MAX_AREA_RATIO = 0.5    # 區域超過螢幕此比例時不再使用（位置不固定的模板）
+
+    def region(self, template_name, screen_shape):
+        """取得學到的搜索區域
+
+        Returns:
+            list: [[x, y, w, h]]（CheckIf 的 roi 格式），尚未學到或不適用時返回 None
+        """
+        entry = self._data.get(template_name)
+        if entry is None or entry['hits'] < self.MIN_HITS:
+            return None
+        img_height, img_width = screen_shape[:2]
+        x0 = max(0, entry['x0'] - self.MARGIN)
+        y0 = max(0, entry['y0'] - self.MARGIN)
+        x1 = min(img_width, entry['x1'] + self.MARGIN)
+        y1 = min(img_height, entry['y1'] + self.MARGIN)
+        if (x1 - x0) * (y1 - y0) > img_width * img_height * self.MAX_AREA_RATIO:
+            return None
+        return [[x0, y0, x1 - x0, y1 - y0]]
+
+    def record(self, template_name, x, y, w, h):
+        """記錄一次匹配成功的位置（螢幕座標的模板矩形）"""
+        with self._lock:
+            entry = self._data.get(template_name)
+            if entry is None:
+                self._data[template_name] = {'x0': x, 'y0': y, 'x1': x + w, 'y1': y + h, 'hits': 1}
+            else:
+                entry['x0'] = min(entry['x0'], x)
+                entry['y0'] = min(entry['y0'], y)
+                entry['x1'] = max(entry['x1'], x + w)
+                entry['y1'] = max(entry['y1'], y + h)
+                entry['hits'] += 1
+        self._changed()
+
+
+def show(index, names):
+    entries = index.entries()
+    names = names or sorted(entries)
+    print(f"索引: {index.path} ({len(entries)} 個模板)")
+    for name in names:
+        entry = entries.get(name)
+        if entry is None:
+            print(f"  {name}: (未學習)")
+            continue
+        w, h = entry['x1'] - entry['x0'], entry['y1'] - entry['y0']
+        active = "使用中" if index.region(name, (1600, 900)) else "未啟用"
+        print(f"  {name}: x={entry['x0']} y={entry['y0']} w={w} h={h} 命中 {entry['hits']} 次 [{active}]")
+
+
+if __name__ == "__main__":
+    run_cli(SearchRegionIndex, '檢視或重置模板搜索區域索引', '模板名稱', show)
@@ -0,0 +1,192 @@
+"""
+Session 錄製與回放
+
+錄製：記錄 ScreenShot 返回的每一幀（序號、時間戳、當下的 MonitorState 狀態）
+以及每一次輸入（Press / Swipe / DeviceShell），供離線重現與效能測試。
+
+格式（一個 session 一個資料夾）:
+    frames.bin   幀資料，依 ScreenShot 呼叫順序追加
+                 每筆 = header(<BIIdI: 類型, 幀序號, 來源, 時間戳, 資料長度) + 資料
+                 類型: KEY = PNG 無損關鍵幀
+                       DELTA = 與上一幀的差值 (uint8 環繞相減) 經 zlib 壓縮
+                       REPEAT = 與上一筆是同一幀（無資料）
+    events.jsonl 事件紀錄，每行一個 JSON：幀 (含狀態) 與輸入
+
+回放：ReplayFrameSource 依錄製順序逐幀還原，取代設備作為 Factory 的畫面來源。
+"""
+import json
+import os
+import queue
+import struct
+import threading
+import time
+import zlib
+from datetime import datetime
+
+import cv2
+import numpy as np
+
+from utils import logger
+
+RECORD_FOLDER = "recordings"
+
+FRAME_KEY = 0
+FRAME_DELTA = 1
+FRAME_REPEAT = 2
+
+FRAME_SOURCES = {None: 0, 'stream': 1, 'adb': 2, 'replay': 3}
+FRAME_SOURCE_NAMES = {v: k for k, v in FRAME_SOURCES.items()}
+
+_HEADER = struct.Struct('<BIIdI')
+
+
+class SessionRecorder:
+    """Session 錄製器
+
+    編碼與寫檔在背景線程進行，錄製端只把幀的引用放進佇列
+    （串流幀為唯讀，ADB 幀每次都是新陣列，不需要複製）。
+    """
+
+    KEYFRAME_INTERVAL = 60      # 每隔多少幀強制寫一個關鍵幀
+    MAX_PENDING_FRAMES = 120    # 佇列積壓上限，超過時丟棄新幀（避免拖慢腳本）
+
+    def __init__(self, folder=None):
+        if folder is None:
+            folder = os.path.join(RECORD_FOLDER, datetime.now().strftime("%Y%m%d_%H%M%S"))
+        os.makedirs(folder, exist_ok=True)
+        self.folder = folder
+        self._frames_file = open(os.path.join(folder, "frames.bin"), "wb")
+        self._events_file = open(os.path.join(folder, "events.jsonl"), "w", encoding="utf-8")
+        self._queue = queue.Queue()
+        self._prev_frame = None
+        self._prev_key = None
+        self._since_keyframe = 0
+        self.frame_index = 0
+        self.dropped_frames = 0
+        self._closed = False
+        self._thread = threading.Thread(target=self._writer, name="SessionRecorder", daemon=True)
+        self._thread.start()
+        logger.info(f"[錄製] 開始錄製 session: {folder}")
+
+    def record_frame(self, frame, source, seq, timestamp, state="", dungeon_state=""):
+        """記錄一幀 ScreenShot 的結果"""
+        if self._closed:
+            return
+        if self._queue.qsize() > self.MAX_PENDING_FRAMES:
+            self.dropped_frames += 1
+            return
+        self._queue.put(('frame', frame, source, seq, timestamp, state, dungeon_state))
+
+    def record_input(self, kind, **data):
+        """記錄一次輸入（press / swipe / key / shell）"""
+        if self._closed:
+            return
+        self._queue.put(('input', kind, time.time(), data))
+
+    def close(self):
+        """寫完佇列中的資料後關閉檔案"""
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(None)
+        self._thread.join(timeout=10)
+        self._frames_file.close()
+        self._events_file.close()
+        logger.info(f"[錄製] 錄製結束: {self.frame_index} 幀，丟棄 {self.dropped_frames} 幀 ({self.folder})")
+
+    def _writer(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            try:
+                if item[0] == 'frame':
+                    self._write_frame(*item[1:])
+                else:
+                    _, kind, t, data = item
+                    self._write_event({'type': kind, 't': t, **data})
+            except Exception as e:
+                logger.warning(f"[錄製] 寫入失敗: {e}")
+
+    def _write_frame(self, frame, source, seq, timestamp, state, dungeon_state):
+        key = (source, seq)
+        if self._prev_frame is not None and key == self._prev_key and frame.shape == self._prev_frame.shape:
+            kind, payload = FRAME_REPEAT, b""
+        elif (self._prev_frame is None or self._since_keyframe >= self.KEYFRAME_INTERVAL
+              or frame.shape != self._prev_frame.shape):
+            kind, payload = FRAME_KEY, cv2.imencode('.png', frame)[1].tobytes()
+        else:
+            delta = frame - self._prev_frame  # uint8 環繞相減，還原時相加即可
+            kind, payload = FRAME_DELTA, zlib.compress(delta.tobytes(), 1)
+
+        if kind == FRAME_KEY:
+            self._since_keyframe = 0
+        else:
+            self._since_keyframe += 1
+        if kind != FRAME_REPEAT:
+            self._prev_frame = frame
+        self._prev_key = key
+
+        self._frames_file.write(_HEADER.pack(kind, seq or 0, FRAME_SOURCES.get(source, 0), timestamp, len(payload)))
+        self._frames_file.write(payload)
+        self._write_event({
+            'type': 'frame', 't': timestamp, 'index': self.frame_index,
+            'source': source, 'seq': seq, 'state': state, 'dungeon_state': dungeon_state,
+        })
+        self.frame_index += 1
+
+    def _write_event(self, event):
+        self._events_file.write(json.dumps(event, ensure_ascii=False) + "\n")
+
+
+class ReplayFrameSource:
+    """回放錄製的 session，依原本的 ScreenShot 順序逐幀還原"""
+
+    def __init__(self, folder):
+        self.folder = folder
+        self._frames_file = open(os.path.join(folder, "frames.bin"), "rb")
+        self._prev_frame = None
+        self.frame_index = 0
+        self.finished = False
+        logger.info(f"[回放] 載入錄製 session: {folder}")
+
+    def next_frame(self):
+        """讀取下一幀
+
+        Returns:
+            tuple: (frame, meta)，meta = {'index', 'source', 'seq', 'timestamp'}；
+                   全部讀完時返回 None
+        """
+        header = self._frames_file.read(_HEADER.size)
+        if len(header) < _HEADER.size:
+            self.finished = True
+            return None
+        kind, seq, source, timestamp, length = _HEADER.unpack(header)
+        payload = self._frames_file.read(length)
+
+        if kind == FRAME_KEY:
+            frame = cv2.imdecode(np.frombuffer(payload, dtype=np.uint8), cv2.IMREAD_COLOR)
+        elif kind == FRAME_DELTA:
+            delta = np.frombuffer(zlib.decompress(payload), dtype=np.uint8).reshape(self._prev_frame.shape)
+            frame = self._prev_frame + delta
+        else:
+            frame = self._prev_frame
+        frame.setflags(write=False)
+        self._prev_frame = frame
+
+        meta = {'index': self.frame_index, 'source': FRAME_SOURCE_NAMES.get(source), 'seq': seq, 'timestamp': timestamp}
+        self.frame_index += 1
+        return frame, meta
+
+    def load_events(self):
+        """讀取所有事件（幀與輸入），用於比對回放時的輸入是否與錄製一致"""
+        events = []
+        with open(os.path.join(self.folder, "events.jsonl"), "r", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    events.append(json.loads(line))
+        return events
+
+    def close(self):
+        self._frames_file.close()
@@ -0,0 +1,193 @@
+"""
+預編譯模板包 (templates.bundle)
+
+把 resources/images 下所有 PNG 預先解碼，連同 Alpha 遮罩與灰階版本寫成單一二進位檔。
+執行時以 numpy.memmap 唯讀映射：啟動不需要解碼，多個 worker 進程共用同一份 page cache。
+
+格式:
+    MAGIC (8 bytes) | 索引長度 (<Q) | 索引 JSON (UTF-8) | 資料區
+    索引: {'version', 'images': {邏輯名稱: {'size', 'mtime', 'crc32', 'arrays': {種類: [offset, shape]}}}}
+    種類: image = 解碼後的原圖（技能圖保留 Alpha，其餘為 BGR）
+          mask  = 技能圖的 Alpha 通道
+          gray  = 灰階版本
+    每個陣列都是 uint8、C 連續、以 ALIGNMENT 對齊。
+
+建置（打包前執行，localpack.bat 已包含此步驟）:
+    python src/template_bundle.py build
+"""
+import json
+import logging
+import os
+import struct
+import zlib
+
+import cv2
+import numpy as np
+
+logger = logging.getLogger('WvDASLogger')
+
+BUNDLE_FILE = "resources/templates.bundle"
+MAGIC = b"WVDTPL01"
+ALIGNMENT = 64
+_LENGTH = struct.Struct('<Q')
+
+
+def decode_template(name, path):
+    """依模板規則解碼：技能圖 (spellskill) 保留 Alpha 通道，其餘讀成 BGR"""
+    flags = cv2.IMREAD_UNCHANGED if "spellskill" in name else cv2.IMREAD_COLOR
+    return cv2.imdecode(np.fromfile(path, dtype=np.uint8), flags)
+
+
+def template_arrays(name, img):
+    """模板的衍生陣列：{'image', 'mask'(僅技能圖且有 Alpha), 'gray'}"""
+    has_alpha = len(img.shape) == 3 and img.shape[2] == 4
+    bgr = img[:, :, :3] if has_alpha else img
+    arrays = {
+        'image': img,
+        'gray': cv2.cvtColor(bgr, cv2.COLOR_BGR2GRAY) if len(bgr.shape) == 3 else bgr,
+    }
+    if has_alpha and "spellskill" in name:
+        arrays['mask'] = np.ascontiguousarray(img[:, :, 3])
+    return arrays
+
+
+def _file_crc32(path):
+    with open(path, 'rb') as f:
+        return zlib.crc32(f.read())
+
+
+def _align(n):
+    return (n + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def build_bundle(root, output):
+    """掃描 root 下所有 PNG，寫出模板包
+
+    Returns:
+        int: 寫入的模板數量
+    """
+    images = {}
+    blobs = []
+    offset = 0
+    for dirpath, _, filenames in os.walk(root):
+        for filename in sorted(filenames):
+            if not filename.lower().endswith('.png'):
+                continue
+            path = os.path.join(dirpath, filename)
+            name = os.path.relpath(path, root)[:-4].replace(os.sep, '/')
+            img = decode_template(name, path)
+            if img is None:
+                logger.warning(f"[模板包] 無法解碼，略過: {path}")
+                continue
+            stat = os.stat(path)
+            entry = {'size': stat.st_size, 'mtime': stat.st_mtime, 'crc32': _file_crc32(path), 'arrays': {}}
+            for kind, array in template_arrays(name, img).items():
+                data = np.ascontiguousarray(array, dtype=np.uint8).tobytes()
+                entry['arrays'][kind] = [offset, list(array.shape)]
+                blobs.append((offset, data))
+                offset = _align(offset + len(data))
+            images[name] = entry
+
+    index = json.dumps({'version': 1, 'images': images}, ensure_ascii=False).encode('utf-8')
+    data_start = _align(len(MAGIC) + _LENGTH.size + len(index))
+    tmp_path = output + ".tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(MAGIC)
+        f.write(_LENGTH.pack(len(index)))
+        f.write(index)
+        for blob_offset, data in blobs:
+            f.seek(data_start + blob_offset)
+            f.write(data)
+        f.truncate(data_start + offset)
+    os.replace(tmp_path, output)
+    return len(images)
+
+
+class TemplateBundle:
+    """唯讀映射的模板包"""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f"不是模板包: {path}")
+            (index_length,) = _LENGTH.unpack(f.read(_LENGTH.size))
+            self._images = json.loads(f.read(index_length).decode('utf-8'))['images']
+        self._data_start = _align(len(MAGIC) + _LENGTH.size + index_length)
+        self._mm = np.memmap(path, dtype=np.uint8, mode='r')
+
+    @classmethod
+    def open(cls, path):
+        """開啟模板包，不存在或格式錯誤時返回 None"""
+        if not os.path.exists(path):
+            return None
+        try:
+            return cls(path)
+        except (OSError, ValueError) as e:
+            logger.warning(f"[模板包] 無法載入 {path}: {e}")
+            return None
+
+    def __contains__(self, name):
+        return name in self._images
+
+    def __len__(self):
+        return len(self._images)
+
+    def is_fresh(self, name, path):
+        """原始 PNG 是否與建置時相同（被修改過就改用磁碟讀取）
+
+        大小不同一定是舊的；大小與修改時間都相同視為相同。
+        只有修改時間不同時（打包 / 解壓縮不一定保留檔案時間）再比對內容的 CRC32，
+        只讀檔不解碼，仍比重新解碼便宜。
+        """
+        info = self._images.get(name)
+        if info is None:
+            return False
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return False
+        if stat.st_size != info['size']:
+            return False
+        if abs(stat.st_mtime - info['mtime']) < 1e-3:
+            return True
+        if 'crc32' not in info:
+            return False
+        try:
+            return _file_crc32(path) == info['crc32']
+        except OSError:
+            return False
+
+    def arrays(self, name):
+        """Returns: {'image', 'gray', 'mask'(可能沒有)}，皆為映射的唯讀視圖"""
+        result = {}
+        for kind, (offset, shape) in self._images[name]['arrays'].items():
+            start = self._data_start + offset
+            count = int(np.prod(shape))
+            result[kind] = self._mm[start:start + count].reshape(shape)
+        return result
+
+
+def main():
+    import argparse
+    from utils import ResourcePath, IMAGE_FOLDER
+
+    parser = argparse.ArgumentParser(description='建置預編譯模板包')
+    parser.add_argument('command', choices=['build', 'info'])
+    parser.add_argument('-o', '--output', default=None, help=f'輸出路徑 (預設 {BUNDLE_FILE})')
+    args = parser.parse_args()
+
+    output = args.output or ResourcePath(BUNDLE_FILE)
+    if args.command == 'build':
+        count = build_bundle(ResourcePath(IMAGE_FOLDER), output)
+        print(f"已寫入 {count} 張模板 -> {output} ({os.path.getsize(output) / 1024 / 1024:.1f} MB)")
+    else:
+        bundle = TemplateBundle.open(output)
+        if bundle is None:
+            print(f"找不到模板包: {output}")
+            return
+        print(f"{output}: {len(bundle)} 張模板 ({os.path.getsize(output) / 1024 / 1024:.1f} MB)")
+
+
+if __name__ == "__main__":
+    main()
@@ -10,6 +10,8 @@ import time
 import threading
 import queue
 import numpy as np
+from fnmatch import fnmatchcase
+from template_bundle import TemplateBundle, BUNDLE_FILE, template_arrays
 
 # 基礎模塊包括:
 # LOGGER. 將輸入寫入到logger.txt文件中.
@@ -435,56 +437,342 @@ def BuildQuestReflection():
         raise FileNotFoundError(f"{e}")
 ###########################################
 IMAGE_FOLDER = fr'resources/images/'
+TEMPLATE_MANIFEST_FILE = 'resources/template_manifest.json'
+
+# 比對模式：
+#   gray   灰階 TM_CCOEFF_NORMED（單通道，約為 BGR 的 1/3 計算量）
+#   bgr    三通道彩色比對（需要靠顏色區分的模板，例如亮 / 暗狀態的按鈕）
+#   masked 帶 Alpha 遮罩的 BGR 比對（最慢，只用在背景會變動的圖示，例如技能圖）
+#   edge   Canny 邊緣圖比對（對亮度、配色變化不敏感的外框類模板）
+MATCH_MODES = ('gray', 'bgr', 'masked', 'edge')
+EDGE_CANNY_LOW = 50
+EDGE_CANNY_HIGH = 150
+
+PYRAMID_SCALES = (2, 4)
+PYRAMID_MIN_TEMPLATE_SIZE = 8  # 縮小後的模板邊長下限（太小時粗比對不可靠，退回原解析度）
+
+def EdgeMap(gray):
+    """edge 模式使用的邊緣圖（模板與搜索區域必須使用同一組參數）"""
+    return cv2.Canny(gray, EDGE_CANNY_LOW, EDGE_CANNY_HIGH)
+
+def ConvertForMatch(image, mode):
+    """把 BGR 圖片轉成比對模式需要的表示（搜索區域與縮小的模板共用）"""
+    if mode in ('bgr', 'masked') or image.size == 0:
+        return image
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if len(image.shape) == 3 else image
+    return EdgeMap(gray) if mode == 'edge' else gray
+
+def DownscaleForMatch(image, scale):
+    """金字塔比對的縮小（先縮小 BGR 再轉換，模板與搜索區域必須使用同一種順序）"""
+    height, width = image.shape[:2]
+    return cv2.resize(image, (max(1, width // scale), max(1, height // scale)), interpolation=cv2.INTER_AREA)
+
+def _default_match_spec(name):
+    # 清單沒有指定時沿用舊規則：技能圖使用遮罩比對，其他使用 BGR；不使用金字塔比對
+    return {'mode': 'masked' if "spellskill" in name else 'bgr', 'threshold': None, 'region': None, 'pyramid': None}
+
+def LoadTemplateManifest(path=None):
+    """讀取模板比對清單 (resources/template_manifest.json)
+
+    格式: {"templates": {模式: {"mode": ..., "threshold": ..., "region": [[x, y, w, h], ...], "pyramid": 2}}}
+    pyramid 為金字塔比對的縮小倍率 (2 或 4)，先在縮小的畫面找候選位置，再於原解析度的小視窗內精比對。
+    模式為 fnmatch 樣式（例如 "spellskill/*"、"dungFlag"），依檔案中的順序比對，
+    同一欄位以第一個指定的樣式為準；沒有指定的欄位使用預設值。
 
-# 全局模版快取 (In-Memory Cache)
-_TEMPLATE_CACHE = {}
+    Returns:
+        list: [(模式, spec), ...]，讀取失敗時返回空列表
+    """
+    path = path or ResourcePath(TEMPLATE_MANIFEST_FILE)
+    if not os.path.exists(path):
+        return []
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            templates = json.load(f).get('templates', {})
+    except (OSError, json.JSONDecodeError) as e:
+        logger.warning(f"[模板註冊表] 無法讀取比對清單 {path}: {e}")
+        return []
+    rules = []
+    for pattern, spec in templates.items():
+        mode = spec.get('mode')
+        if mode is not None and mode not in MATCH_MODES:
+            logger.warning(f"[模板註冊表] 比對清單中 {pattern} 的模式無效: {mode}，忽略")
+            spec = {k: v for k, v in spec.items() if k != 'mode'}
+        pyramid = spec.get('pyramid')
+        if pyramid is not None and pyramid not in PYRAMID_SCALES:
+            logger.warning(f"[模板註冊表] 比對清單中 {pattern} 的金字塔倍率無效: {pyramid}，忽略")
+            spec = {k: v for k, v in spec.items() if k != 'pyramid'}
+        rules.append((pattern, spec))
+    return rules
+
+class TemplateRegistry:
+    """模板註冊表
+
+    啟動時掃描一次 resources/images 建立清單 (manifest)：邏輯名稱（相對路徑、不含 .png，
+    以 / 分隔，例如 "dungFlag"、"spellskill/全體/01_LAHALITO"）→ 檔案路徑與修改時間。
+    比對時只查清單與記憶體快取，不再掃描資料夾：
+        variants(name)  邏輯名稱對應的所有模板（harken → harken, harken2…；
+                        "spellskill/類別" / "character/" 等資料夾 → 資料夾內全部模板；
+                        "combatActive*" → 所有 combatActive 開頭的模板）
+        entry(name)     解碼後的圖片、BGR、遮罩 (僅技能圖的 Alpha 通道) 與尺寸等資訊，
+                        以及依比對清單預先算好的比對用圖 (match / match_mask)
+        spec(name)      比對清單中的模式、預設閾值與預設搜索區域
+        get(name)       解碼後的圖片（等同舊的 LoadTemplateImage）
+
+    若存在預編譯模板包 (resources/templates.bundle，見 template_bundle.py)，
+    未修改過的模板直接取用映射的陣列，不需要解碼。
+
+    編輯器存圖後呼叫 invalidate(name)；或以 start_watching() 在背景定期比對檔案修改時間。
+    """
 
-def LoadTemplateImage(shortPathOfTarget):
-    global _TEMPLATE_CACHE
-    
-    # 1. 檢查快取
-    if shortPathOfTarget in _TEMPLATE_CACHE:
-        # logger.trace(f"[LoadTemplate] Hit Cache: {shortPathOfTarget}")
-        return _TEMPLATE_CACHE[shortPathOfTarget]
+    WATCH_INTERVAL = 5.0  # 背景監看檔案變更的間隔（秒）
+
+    def __init__(self, root=None):
+        self.root = root or ResourcePath(IMAGE_FOLDER)
+        self._lock = threading.RLock()
+        self._manifest = {}   # 邏輯名稱 -> (路徑, mtime)
+        self._entries = {}    # 邏輯名稱 -> entry dict（None = 讀取失敗，避免重複嘗試）
+        self._variants = {}   # 查詢名稱 -> 模板名稱列表
+        self._specs = {}      # 名稱 -> 比對設定（spec 的快取）
+        self._watcher = None
+        self._match_rules = LoadTemplateManifest()
+        self._bundle = TemplateBundle.open(ResourcePath(BUNDLE_FILE))
+        if self._bundle is not None:
+            logger.debug(f"[模板註冊表] 使用預編譯模板包: {len(self._bundle)} 張模板")
+        self._build_manifest()
+
+    def _scan(self):
+        manifest = {}
+        for dirpath, _, filenames in os.walk(self.root):
+            for filename in filenames:
+                if not filename.lower().endswith('.png'):
+                    continue
+                path = os.path.join(dirpath, filename)
+                name = os.path.relpath(path, self.root)[:-4].replace(os.sep, '/')
+                try:
+                    manifest[name] = (path, os.path.getmtime(path))
+                except OSError:
+                    continue
+        return manifest
+
+    def _build_manifest(self):
+        manifest = self._scan()
+        with self._lock:
+            self._manifest = manifest
+            self._variants = {}
+        logger.debug(f"[模板註冊表] 清單建立完成: {len(manifest)} 張模板")
+
+    def names(self):
+        with self._lock:
+            return sorted(self._manifest)
+
+    def variants(self, name):
+        """邏輯名稱對應的模板列表（結果快取，清單變更時重算）"""
+        with self._lock:
+            cached = self._variants.get(name)
+            if cached is not None:
+                return cached
+
+            if name.endswith('*'):
+                prefix = name[:-1]
+                result = sorted(n for n in self._manifest if n.startswith(prefix) and '/' not in n[len(prefix):])
+            elif name == 'harken':
+                # 只匹配 harken.png 或 harken+數字.png（如 harken2.png, harken3.png）
+                result = sorted(n for n in self._manifest if n == 'harken' or (n.startswith('harken') and n[len('harken'):].isdigit()))
+            elif name.endswith('/') or (name.startswith('spellskill/') and name.count('/') == 1):
+                # 資料夾：取資料夾內（不含子資料夾）的所有模板
+                folder = name.rstrip('/') + '/'
+                result = sorted(n for n in self._manifest if n.startswith(folder) and '/' not in n[len(folder):])
+            else:
+                result = []
+            if not result:
+                result = [name]  # 預設只返回原始目標
+            self._variants[name] = result
+            return result
+
+    def spec(self, name):
+        """比對設定（比對清單中第一個符合的樣式優先，未指定的欄位使用預設值）
+
+        Returns:
+            dict: {'mode', 'threshold', 'region', 'pyramid'}，threshold / region / pyramid 未指定時為 None
+        """
+        with self._lock:
+            cached = self._specs.get(name)
+            if cached is not None:
+                return cached
+            spec = _default_match_spec(name)
+            assigned = set()
+            for pattern, rule in self._match_rules:
+                if not fnmatchcase(name, pattern):
+                    continue
+                for key, value in rule.items():
+                    if key in spec and key not in assigned:
+                        spec[key] = value
+                        assigned.add(key)
+            self._specs[name] = spec
+            return spec
+
+    def entry(self, name):
+        """解碼後的模板資訊
+
+        Returns:
+            dict: {'image', 'bgr', 'mask', 'gray', 'shape', 'path', 'mtime', 'source',
+                   'mode', 'threshold', 'region', 'match', 'match_mask',
+                   'pyramid', 'match_small', 'match_small_mask'}，讀取失敗時返回 None
+                  source = 'bundle'（映射自模板包）或 'png'（從磁碟解碼）
+                  match / match_mask = 依比對模式預先算好的模板與遮罩（搜索區域需轉成同一種表示）
+                  pyramid = 金字塔倍率（None = 不使用），match_small / match_small_mask 為縮小後的版本
+        """
+        with self._lock:
+            if name in self._entries:
+                return self._entries[name]
+            path, mtime = self._manifest.get(name, (None, None))
+
+        if path is None:
+            # 不在清單中（例如 "spellskill/全體" 這類資料夾名稱）：按舊規則組出路徑嘗試讀取一次
+            path = ResourcePath(os.path.join(IMAGE_FOLDER + f"{name}.png"))
+
+        arrays = None
+        source = 'bundle'
+        if self._bundle is not None and mtime is not None and self._bundle.is_fresh(name, path):
+            arrays = self._bundle.arrays(name)
+        elif os.path.exists(path):
+            source = 'png'
+            logger.trace(f"[LoadTemplate] Loading from disk: {name}")
+            # NOTE: 僅技能圖片使用 Alpha 通道讀取，其他圖片使用標準 BGR 讀取
+            img = LoadImageWithAlpha(path) if "spellskill" in name else LoadImage(path)
+            if img is not None:
+                arrays = template_arrays(name, img)
+                for array in arrays.values():
+                    array.setflags(write=False)
+
+        entry = None
+        if arrays is not None:
+            img = arrays['image']
+            has_alpha = len(img.shape) == 3 and img.shape[2] == 4
+            entry = {
+                'image': img,
+                'bgr': img[:, :, :3] if has_alpha else img,
+                'mask': arrays.get('mask'),
+                'gray': arrays['gray'],
+                'shape': img.shape,
+                'path': path,
+                'mtime': mtime,
+                'source': source,
+            }
+            self._prepare_match(name, entry)
+        with self._lock:
+            self._entries[name] = entry
+        return entry
+
+    def _prepare_match(self, name, entry):
+        """依比對設定預先算好比對用的模板表示（每張模板只算一次）"""
+        spec = self.spec(name)
+        mode = spec['mode']
+        if mode == 'masked' and entry['mask'] is None:
+            # 沒有 Alpha 通道的圖無法遮罩比對
+            logger.trace(f"[模板註冊表] {name} 沒有 Alpha 遮罩，改用 bgr 比對")
+            mode = 'bgr'
+        if mode == 'gray':
+            match = entry['gray']
+        elif mode == 'edge':
+            match = EdgeMap(entry['gray'])
+            match.setflags(write=False)
+        else:
+            match = entry['bgr']
+        match_mask = entry['mask'] if mode == 'masked' else None
+
+        pyramid = spec['pyramid']
+        match_small = match_small_mask = None
+        if pyramid is not None:
+            height, width = entry['shape'][:2]
+            if min(height, width) // pyramid < PYRAMID_MIN_TEMPLATE_SIZE:
+                logger.trace(f"[模板註冊表] {name} 縮小 {pyramid} 倍後過小，不使用金字塔比對")
+                pyramid = None
+            else:
+                match_small = ConvertForMatch(DownscaleForMatch(entry['bgr'], pyramid), mode)
+                if match_mask is not None:
+                    match_small_mask = DownscaleForMatch(match_mask, pyramid)
+        entry.update({
+            'mode': mode,
+            'threshold': spec['threshold'],
+            'region': spec['region'],
+            'match': match,
+            'match_mask': match_mask,
+            'pyramid': pyramid,
+            'match_small': match_small,
+            'match_small_mask': match_small_mask,
+        })
+
+    def get(self, name):
+        entry = self.entry(name)
+        return None if entry is None else entry['image']
+
+    def invalidate(self, name=None):
+        """使快取失效：指定名稱只丟棄該模板，否則重新建立整份清單"""
+        if name is not None:
+            name = name[:-4] if name.lower().endswith('.png') else name
+            name = name.replace('\\', '/')
+            path = os.path.join(self.root, name + '.png')
+            with self._lock:
+                self._entries.pop(name, None)
+                if os.path.exists(path):
+                    self._manifest[name] = (path, os.path.getmtime(path))
+                else:
+                    self._manifest.pop(name, None)
+                self._variants = {}
+            logger.debug(f"[模板註冊表] 模板已更新: {name}")
+            return
+        with self._lock:
+            self._entries = {}
+            self._specs = {}
+            self._match_rules = LoadTemplateManifest()
+        self._build_manifest()
+
+    def _changed_names(self):
+        manifest = self._scan()
+        with self._lock:
+            old = self._manifest
+        changed = {n for n in manifest if n not in old or old[n][1] != manifest[n][1]}
+        changed |= {n for n in old if n not in manifest}
+        return changed
+
+    def start_watching(self, interval=None):
+        """背景定期比對檔案修改時間，有變更時自動使對應模板失效（重複呼叫無副作用）"""
+        if self._watcher is not None and self._watcher.is_alive():
+            return
+        interval = interval or self.WATCH_INTERVAL
 
-    logger.trace(f"[LoadTemplate] Loading from disk: {shortPathOfTarget}")
-    pathOfTarget = ResourcePath(os.path.join(IMAGE_FOLDER + f"{shortPathOfTarget}.png"))
-    
-    # 2. 讀取並解碼
-    # NOTE: 僅技能圖片使用 Alpha 通道讀取，其他圖片使用標準 BGR 讀取
-    if "spellskill" in shortPathOfTarget:
-        img = LoadImageWithAlpha(pathOfTarget)
-    else:
-        img = LoadImage(pathOfTarget)
-    
-    # 3. 存入快取 (即使是 None 也可以存，避免重複嘗試讀取不存在的檔案)
-    if img is not None:
-        _TEMPLATE_CACHE[shortPathOfTarget] = img
-        
-    return img
+        def watch():
+            while True:
+                time.sleep(interval)
+                try:
+                    for name in self._changed_names():
+                        self.invalidate(name)
+                except Exception as e:
+                    logger.debug(f"[模板註冊表] 監看失敗: {e}")
+
+        self._watcher = threading.Thread(target=watch, name="TemplateWatcher", daemon=True)
+        self._watcher.start()
 
-# 快取 combatActive 圖片列表（避免每次都掃描資料夾）
-_COMBAT_ACTIVE_TEMPLATES_CACHE = None
+
+_template_registry = None
+
+def get_template_registry():
+    """獲取全局模板註冊表（第一次呼叫時掃描資料夾）"""
+    global _template_registry
+    if _template_registry is None:
+        _template_registry = TemplateRegistry()
+    return _template_registry
+
+def LoadTemplateImage(shortPathOfTarget):
+    return get_template_registry().get(shortPathOfTarget)
 
 def get_combat_active_templates():
-    """自動掃描 images 資料夾中所有 combatActive* 圖片名稱
+    """所有 combatActive* 圖片名稱
     Returns:
         list: 圖片名稱列表，例如 ['combatActive', 'combatActive_2', 'combatActive_3', 'combatActive_4']
     """
-    global _COMBAT_ACTIVE_TEMPLATES_CACHE
-    if _COMBAT_ACTIVE_TEMPLATES_CACHE is not None:
-        return _COMBAT_ACTIVE_TEMPLATES_CACHE
-    
-    import glob
-    images_path = ResourcePath(IMAGE_FOLDER)
-    pattern = os.path.join(images_path, 'combatActive*.png')
-    files = glob.glob(pattern)
-    # 提取檔名（不含副檔名和路徑）
-    templates = [os.path.splitext(os.path.basename(f))[0] for f in files]
-    templates.sort()  # 確保順序一致
-    _COMBAT_ACTIVE_TEMPLATES_CACHE = templates
-    logger.debug(f"掃描到 combatActive 圖片: {templates}")
-    return templates
+    return get_template_registry().variants('combatActive*')
 
 def smart_clean_image(input_path, output_path=None, threshold=50):
     """對圖片進行智慧去背處理（亮度門檻 + 四角背景色排除）
@@ -0,0 +1,222 @@
+"""
+視覺線程與畫面事件 (VisionWorker / VisionBus)
+
+VisionWorker 在背景線程消費串流的每一個新幀（處理不及時只取最新一幀），
+依各偵測器的間隔執行偵測，結果以 ScreenEvent 發布到 VisionBus：
+    - bus.latest(kind, max_age) 取得最近一次的結果（狀態值）
+    - bus.subscribe(kinds) 訂閱結果「改變」的事件（例如 RiseAgain 出現 / 消失），
+      以 subscription.get(timeout) 等待
+
+偵測與輸入延遲（點擊、Sleep、等待畫面變化）重疊，狀態處理函數不需要自己在同一個線程上輪詢偵測器。
+偵測器本身（模板比對、HSV 判斷）由 script.py 註冊，這裡不依賴任何遊戲邏輯。
+"""
+import threading
+import time
+from collections import deque
+
+from utils import logger
+
+
+class ScreenEvent:
+    """一次偵測結果"""
+
+    __slots__ = ('kind', 'value', 'seq', 'timestamp')
+
+    def __init__(self, kind, value, seq, timestamp):
+        self.kind = kind
+        self.value = value
+        self.seq = seq              # 幀序號
+        self.timestamp = timestamp  # 幀的擷取時間
+
+    def age(self):
+        return time.time() - self.timestamp
+
+    def __repr__(self):
+        return f"ScreenEvent({self.kind}={self.value!r}, seq={self.seq})"
+
+
+class Subscription:
+    """訂閱的事件佇列（只收到結果改變的事件），離開 with 區塊時自動取消訂閱"""
+
+    MAX_PENDING = 32  # 沒有被取走的事件最多保留幾筆（舊的丟棄）
+
+    def __init__(self, bus, kinds):
+        self.bus = bus
+        self.kinds = frozenset(kinds)
+        self._events = deque(maxlen=self.MAX_PENDING)
+        self._cond = threading.Condition()
+
+    def _put(self, event):
+        with self._cond:
+            self._events.append(event)
+            self._cond.notify_all()
+
+    def get(self, timeout=0.0):
+        """取出下一個事件，timeout 秒內沒有事件時返回 None（timeout=0 不等待）"""
+        with self._cond:
+            if not self._events and timeout > 0:
+                self._cond.wait_for(lambda: self._events, timeout)
+            return self._events.popleft() if self._events else None
+
+    def drain(self):
+        """取出所有尚未處理的事件"""
+        with self._cond:
+            events = list(self._events)
+            self._events.clear()
+            return events
+
+    def close(self):
+        self.bus.unsubscribe(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+
+class VisionBus:
+    """畫面事件的發布 / 訂閱"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._latest = {}
+        self._subscriptions = []
+
+    def publish(self, event):
+        with self._lock:
+            previous = self._latest.get(event.kind)
+            self._latest[event.kind] = event
+            subscriptions = [sub for sub in self._subscriptions if event.kind in sub.kinds]
+        if previous is None or previous.value != event.value:
+            for sub in subscriptions:
+                sub._put(event)
+
+    def latest(self, kind, max_age=None):
+        """最近一次的結果，沒有結果或超過 max_age 秒時返回 None"""
+        with self._lock:
+            event = self._latest.get(kind)
+        if event is None or (max_age is not None and event.age() > max_age):
+            return None
+        return event
+
+    def subscribe(self, kinds):
+        sub = Subscription(self, kinds)
+        with self._lock:
+            self._subscriptions.append(sub)
+        return sub
+
+    def unsubscribe(self, sub):
+        with self._lock:
+            if sub in self._subscriptions:
+                self._subscriptions.remove(sub)
+
+    def clear(self):
+        """清除所有結果（視覺線程停止時，避免之後讀到過期的值）"""
+        with self._lock:
+            self._latest = {}
+
+
+class VisionWorker:
+    """在背景線程對每個新幀執行已註冊的偵測器，結果發布到 VisionBus"""
+
+    FRAME_WAIT = 0.1  # 等待新幀的分段時間（秒），確保能快速響應停止
+    ERROR_LOG_INTERVAL = 60.0  # 同一個偵測器的錯誤最多每隔幾秒寫一次日誌
+
+    def __init__(self, bus, wait_frame, thread_init=None, cancelled=()):
+        """
+        Args:
+            bus: VisionBus
+            wait_frame: wait_frame(after_seq, timeout) -> (seq, timestamp, frame)，沒有新幀時返回 None；
+                        frame 為 None 表示這一幀不處理（例如尺寸不符）
+            thread_init: 視覺線程開始時呼叫一次（設定線程區域狀態）
+            cancelled: 代表比對被取消（例如停止中）的例外類型，略過這一幀但不視為錯誤
+        """
+        self.bus = bus
+        self._wait_frame = wait_frame
+        self._thread_init = thread_init
+        self._cancelled = tuple(cancelled)
+        self._detectors = []  # [{'kind', 'func', 'interval', 'last', 'runs', 'ms'}]
+        self._thread = None
+        self._stop = threading.Event()
+        self._errors = {}  # {kind: [上次寫日誌的時間, 之後略過的次數]}（避免每幀都寫日誌）
+        self.frames = 0
+        self._started = 0.0
+
+    def register(self, kind, func, interval=0.0):
+        """註冊偵測器 func(frame) -> 值；interval 秒內最多執行一次（0 = 每幀）"""
+        self._detectors.append({'kind': kind, 'func': func, 'interval': interval, 'last': 0.0, 'runs': 0, 'ms': 0.0})
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        if self.running:
+            return
+        self._stop.clear()
+        self._errors = {}
+        self._started = time.time()
+        self._thread = threading.Thread(target=self._run, name="VisionWorker", daemon=True)
+        self._thread.start()
+        logger.info(f"[視覺線程] 已啟動，偵測器: {', '.join(d['kind'] for d in self._detectors)}")
+
+    def stop(self, timeout=2.0):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+        self.bus.clear()
+
+    def _run(self):
+        if self._thread_init is not None:
+            self._thread_init()
+        seq = 0
+        while not self._stop.is_set():
+            latest = self._wait_frame(seq, self.FRAME_WAIT)
+            if latest is None:
+                continue
+            seq, timestamp, frame = latest
+            if frame is None:
+                continue
+            self.frames += 1
+            now = time.time()
+            for detector in self._detectors:
+                if self._stop.is_set():
+                    break
+                if now - detector['last'] < detector['interval']:
+                    continue
+                detector['last'] = now
+                start = time.time()
+                try:
+                    value = detector['func'](frame)
+                except self._cancelled:
+                    continue
+                except Exception as e:
+                    self._log_error(detector['kind'], e)
+                    continue
+                detector['runs'] += 1
+                detector['ms'] += (time.time() - start) * 1000
+                self.bus.publish(ScreenEvent(detector['kind'], value, seq, timestamp))
+
+    def _log_error(self, kind, error):
+        """同一個偵測器在 ERROR_LOG_INTERVAL 內只寫一次日誌，並附上期間略過的次數"""
+        now = time.time()
+        entry = self._errors.get(kind)
+        if entry is not None and now - entry[0] < self.ERROR_LOG_INTERVAL:
+            entry[1] += 1
+            return
+        skipped = f"（前 {self.ERROR_LOG_INTERVAL:.0f} 秒內另有 {entry[1]} 次）" if entry is not None and entry[1] else ""
+        self._errors[kind] = [now, 0]
+        logger.warning(f"[視覺線程] 偵測器 {kind} 發生錯誤: {error}{skipped}")
+
+    def snapshot(self):
+        """Returns: {'frames', 'fps', 'detectors': {kind: {'runs', 'avg_ms'}}}"""
+        elapsed = time.time() - self._started if self._started else 0.0
+        return {
+            'frames': self.frames,
+            'fps': self.frames / elapsed if elapsed > 0 else 0.0,
+            'detectors': {d['kind']: {'runs': d['runs'], 'avg_ms': d['ms'] / d['runs'] if d['runs'] else 0.0}
+                          for d in self._detectors},
+        }